@@ -154,3 +154,5 @@ try:
 except:
     pass
 
+
+import unit_tests
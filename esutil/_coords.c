@@ -0,0 +1,644 @@
+#include <Python.h>
+#include <stdlib.h>
+#include <string.h>
+#include <ctype.h>
+#include <math.h>
+#include <pthread.h>
+#include <numpy/arrayobject.h>
+
+#define COORDS_D2R (M_PI/180.0)
+#define COORDS_R2D (180.0/M_PI)
+
+/*
+ * the arrays may be float32 or float64, each independently.  Returns 1 for
+ * float32, 0 for float64 and -1 with an exception set otherwise
+ */
+static int check_real_array(PyObject* obj, const char* name, npy_intp n)
+{
+    int type=PyArray_TYPE((PyArrayObject*)obj);
+
+    if ((type != NPY_FLOAT32 && type != NPY_FLOAT64)
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "%s must be a contiguous, aligned, native "
+                     "float32 or float64 array", name);
+        return -1;
+    }
+    if (n >= 0 && PyArray_SIZE((PyArrayObject*)obj) != n) {
+        PyErr_Format(PyExc_ValueError,
+                     "%s must have %ld elements, got %ld", name,
+                     (long) n, (long) PyArray_SIZE((PyArrayObject*)obj));
+        return -1;
+    }
+    return (type == NPY_FLOAT32);
+}
+
+static inline double get_real(const void* data, int isf4, npy_intp i)
+{
+    if (isf4) {
+        return ((const npy_float32*)data)[i];
+    } else {
+        return ((const npy_float64*)data)[i];
+    }
+}
+
+static inline void set_real(void* data, int isf4, npy_intp i, double val)
+{
+    if (isf4) {
+        ((npy_float32*)data)[i] = (npy_float32) val;
+    } else {
+        ((npy_float64*)data)[i] = val;
+    }
+}
+
+/*
+ * Rotate longitude and latitude in degrees by the 3x3 rotation matrix rot,
+ * acting on the unit vector (cos(lat)cos(lon), cos(lat)sin(lon), sin(lat)).
+ *
+ * Each point is converted to the unit vector, rotated and converted back
+ * in a single pass, with no temporary arrays.  The output longitude is in
+ * [0,360).  The output arrays may be the same as the input arrays.
+ */
+static PyObject *
+PyCoords_rotate_lonlat(PyObject *self, PyObject *args)
+{
+    PyObject *lon_obj=NULL, *lat_obj=NULL, *rot_obj=NULL;
+    PyObject *lonout_obj=NULL, *latout_obj=NULL;
+    const double *rot=NULL;
+    const void *lon=NULL, *lat=NULL;
+    void *lonout=NULL, *latout=NULL;
+    int lonf4=0, latf4=0, lonoutf4=0, latoutf4=0;
+    npy_intp n=0, i=0;
+    double r[9];
+    double a=0, b=0, sa=0, ca=0, sb=0, cb=0, x=0, y=0, z=0, xr=0, yr=0, zr=0;
+
+    if (!PyArg_ParseTuple(args, (char*)"O!O!O!O!O!",
+                          &PyArray_Type, &lon_obj,
+                          &PyArray_Type, &lat_obj,
+                          &PyArray_Type, &rot_obj,
+                          &PyArray_Type, &lonout_obj,
+                          &PyArray_Type, &latout_obj)) {
+        return NULL;
+    }
+
+    if (PyArray_TYPE((PyArrayObject*)rot_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)rot_obj)
+            || PyArray_SIZE((PyArrayObject*)rot_obj) != 9) {
+        PyErr_SetString(PyExc_ValueError,
+                        "rot must be a contiguous, aligned, native float64 "
+                        "array with 9 elements");
+        return NULL;
+    }
+
+    n = PyArray_SIZE((PyArrayObject*)lon_obj);
+    if ((lonf4=check_real_array(lon_obj, "lon", n)) < 0
+            || (latf4=check_real_array(lat_obj, "lat", n)) < 0
+            || (lonoutf4=check_real_array(lonout_obj, "lon_out", n)) < 0
+            || (latoutf4=check_real_array(latout_obj, "lat_out", n)) < 0) {
+        return NULL;
+    }
+    if (!PyArray_ISWRITEABLE((PyArrayObject*)lonout_obj)
+            || !PyArray_ISWRITEABLE((PyArrayObject*)latout_obj)) {
+        PyErr_SetString(PyExc_ValueError, "output arrays must be writeable");
+        return NULL;
+    }
+
+    rot = PyArray_DATA((PyArrayObject*)rot_obj);
+    memcpy(r, rot, 9*sizeof(double));
+    lon = PyArray_DATA((PyArrayObject*)lon_obj);
+    lat = PyArray_DATA((PyArrayObject*)lat_obj);
+    lonout = PyArray_DATA((PyArrayObject*)lonout_obj);
+    latout = PyArray_DATA((PyArrayObject*)latout_obj);
+
+    Py_BEGIN_ALLOW_THREADS
+
+    for (i=0; i<n; i++) {
+        a = get_real(lon, lonf4, i)*COORDS_D2R;
+        b = get_real(lat, latf4, i)*COORDS_D2R;
+        sa = sin(a);
+        ca = cos(a);
+        sb = sin(b);
+        cb = cos(b);
+
+        x = cb*ca;
+        y = cb*sa;
+        z = sb;
+
+        xr = r[0]*x + r[1]*y + r[2]*z;
+        yr = r[3]*x + r[4]*y + r[5]*z;
+        zr = r[6]*x + r[7]*y + r[8]*z;
+
+        if (zr > 1.0) {
+            zr = 1.0;
+        } else if (zr < -1.0) {
+            zr = -1.0;
+        }
+
+        a = atan2(yr, xr)*COORDS_R2D;
+        if (a < 0) {
+            a += 360.0;
+        }
+        if (a >= 360.0 || (lonoutf4 && (npy_float32) a >= 360.0f)) {
+            a = 0.0;
+        }
+
+        set_real(lonout, lonoutf4, i, a);
+        set_real(latout, latoutf4, i, asin(zr)*COORDS_R2D);
+    }
+
+    Py_END_ALLOW_THREADS
+
+    Py_RETURN_NONE;
+}
+
+
+// inputs and outputs for a range of points in sphdist
+struct sphdist_info {
+    const void *coord[4];
+    int isf4[4];
+    int step[4];
+    double scale_in;
+    double scale_out;
+    double *dist;
+    double *angle;
+    npy_intp start;
+    npy_intp stop;
+};
+
+static void *sphdist_range(void *arg)
+{
+    struct sphdist_info *info=arg;
+    const double scale_in=info->scale_in, scale_out=info->scale_out;
+    npy_intp i=0;
+    double ra1=0, ra2=0, dec=0, sd1=0, cd1=0, sd2=0, cd2=0;
+    double dra=0, sdra=0, cdra=0, x=0, y=0, num=0, den=0;
+
+    for (i=info->start; i<info->stop; i++) {
+        ra1 = get_real(info->coord[0], info->isf4[0], info->step[0]*i)*scale_in;
+        ra2 = get_real(info->coord[2], info->isf4[2], info->step[2]*i)*scale_in;
+
+        // for one point against many, only calculate its trig once
+        if (info->step[1] || i == info->start) {
+            dec = get_real(info->coord[1], info->isf4[1], info->step[1]*i)*scale_in;
+            sd1 = sin(dec);
+            cd1 = cos(dec);
+        }
+        if (info->step[3] || i == info->start) {
+            dec = get_real(info->coord[3], info->isf4[3], info->step[3]*i)*scale_in;
+            sd2 = sin(dec);
+            cd2 = cos(dec);
+        }
+
+        dra = ra2-ra1;
+        sdra = sin(dra);
+        cdra = cos(dra);
+
+        // Vincenty formula, accurate at all separations
+        x = cd2*sdra;
+        y = cd1*sd2 - sd1*cd2*cdra;
+        num = sqrt(x*x + y*y);
+        den = sd1*sd2 + cd1*cd2*cdra;
+
+        info->dist[i] = atan2(num, den)*scale_out;
+
+        if (info->angle != NULL) {
+            info->angle[i] = (atan2(x, -y) - M_PI/2.0)*scale_out;
+        }
+    }
+    return NULL;
+}
+
+/*
+ * Calculate the great circle distance between points (ra1,dec1) and
+ * (ra2,dec2) using the Vincenty formula, optionally with the angle as
+ * defined for esutil.coords.gcirc.  Each input may have one element, in
+ * which case it is used for all points, or the same number as the output.
+ *
+ * The inputs are multiplied by scale_in to get radians, and the outputs
+ * by scale_out.  The points are split between nthreads threads.
+ */
+static PyObject *
+PyCoords_sphdist(PyObject *self, PyObject *args)
+{
+    PyObject *coord_obj[4], *dist_obj=NULL, *angle_obj=NULL;
+    static const char* names[4] = {"ra1", "dec1", "ra2", "dec2"};
+    double scale_in=1, scale_out=1;
+    long int nthreads=1;
+    npy_intp n=0, nc=0, ithread=0;
+    struct sphdist_info tmpinfo, *info=NULL;
+    pthread_t *threads=NULL;
+    int i=0;
+
+    if (!PyArg_ParseTuple(args, (char*)"O!O!O!O!O!Oddl",
+                          &PyArray_Type, &coord_obj[0],
+                          &PyArray_Type, &coord_obj[1],
+                          &PyArray_Type, &coord_obj[2],
+                          &PyArray_Type, &coord_obj[3],
+                          &PyArray_Type, &dist_obj,
+                          &angle_obj,
+                          &scale_in, &scale_out, &nthreads)) {
+        return NULL;
+    }
+
+    if (PyArray_TYPE((PyArrayObject*)dist_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY((PyArrayObject*)dist_obj)) {
+        PyErr_SetString(PyExc_ValueError,
+                        "dist must be a writeable, contiguous, aligned, "
+                        "native float64 array");
+        return NULL;
+    }
+    n = PyArray_SIZE((PyArrayObject*)dist_obj);
+    if (angle_obj != Py_None) {
+        if (!PyArray_Check(angle_obj)
+                || PyArray_TYPE((PyArrayObject*)angle_obj) != NPY_FLOAT64
+                || !PyArray_ISCARRAY((PyArrayObject*)angle_obj)
+                || PyArray_SIZE((PyArrayObject*)angle_obj) != n) {
+            PyErr_SetString(PyExc_ValueError,
+                            "angle must be None or a writeable, contiguous, "
+                            "aligned, native float64 array the same size "
+                            "as dist");
+            return NULL;
+        }
+    }
+
+    for (i=0; i<4; i++) {
+        nc = PyArray_SIZE((PyArrayObject*)coord_obj[i]);
+        if (nc != 1 && nc != n) {
+            PyErr_Format(PyExc_ValueError,
+                         "%s must have 1 or %ld elements, got %ld",
+                         names[i], (long) n, (long) nc);
+            return NULL;
+        }
+        if ((tmpinfo.isf4[i]=check_real_array(coord_obj[i], names[i], -1)) < 0) {
+            return NULL;
+        }
+        tmpinfo.coord[i] = PyArray_DATA((PyArrayObject*)coord_obj[i]);
+        tmpinfo.step[i] = (nc == n && n > 1) ? 1 : 0;
+    }
+    if (nthreads < 1) {
+        PyErr_Format(PyExc_ValueError,"nthreads must be >= 1, got %ld", nthreads);
+        return NULL;
+    }
+    if (nthreads > n) {
+        nthreads = n > 0 ? n : 1;
+    }
+
+    tmpinfo.scale_in = scale_in;
+    tmpinfo.scale_out = scale_out;
+    tmpinfo.dist = PyArray_DATA((PyArrayObject*)dist_obj);
+    tmpinfo.angle = NULL;
+    if (angle_obj != Py_None) {
+        tmpinfo.angle = PyArray_DATA((PyArrayObject*)angle_obj);
+    }
+
+    info = malloc(nthreads*sizeof(struct sphdist_info));
+    threads = malloc(nthreads*sizeof(pthread_t));
+    if (info==NULL || threads==NULL) {
+        free(info);
+        free(threads);
+        return PyErr_NoMemory();
+    }
+
+    for (ithread=0; ithread<nthreads; ithread++) {
+        info[ithread] = tmpinfo;
+        info[ithread].start = (n*ithread)/nthreads;
+        info[ithread].stop = (n*(ithread+1))/nthreads;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (ithread=1; ithread<nthreads; ithread++) {
+        if (pthread_create(&threads[ithread], NULL, sphdist_range, &info[ithread]) != 0) {
+            // do it in this thread instead
+            sphdist_range(&info[ithread]);
+            info[ithread].start = info[ithread].stop = -1;
+        }
+    }
+    sphdist_range(&info[0]);
+    for (ithread=1; ithread<nthreads; ithread++) {
+        if (info[ithread].start != -1) {
+            pthread_join(threads[ithread], NULL);
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    free(info);
+    free(threads);
+
+    Py_RETURN_NONE;
+}
+
+
+static int check_string_array(PyObject* obj, const char* name)
+{
+    if (PyArray_TYPE((PyArrayObject*)obj) != NPY_STRING
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "%s must be a contiguous fixed width string array", name);
+        return 0;
+    }
+    return 1;
+}
+
+static inline int is_sexagesimal_sep(char c)
+{
+    return (c == ':' || c == ' ' || c == '\t');
+}
+
+/*
+ * parse a NUL terminated sexagesimal string [+-]D[:M[:S]] into D+M/60+S/3600
+ * with the sign applied to all parts.  The parts may be separated by colons
+ * or white space.  Returns 1 on success, with NaN for a blank string, or 0
+ * if the string could not be parsed.
+ */
+static int parse_sexagesimal(const char* str, double *val)
+{
+    const char *p=str;
+    char *end=NULL;
+    double sign=1, sum=0, part=0, div=1;
+    int npart=0;
+
+    while (*p == ' ' || *p == '\t') {
+        p++;
+    }
+    if (*p == '\0') {
+        *val = Py_NAN;
+        return 1;
+    }
+    if (*p == '-' || *p == '+') {
+        if (*p == '-') {
+            sign = -1;
+        }
+        p++;
+    }
+
+    while (*p != '\0') {
+        if (npart == 3 || !(isdigit((unsigned char) *p) || *p == '.')) {
+            return 0;
+        }
+        part = strtod(p, &end);
+        if (end == p) {
+            return 0;
+        }
+        sum += part/div;
+        div *= 60;
+        npart++;
+
+        p = end;
+        if (*p != '\0' && !is_sexagesimal_sep(*p)) {
+            return 0;
+        }
+        while (is_sexagesimal_sep(*p)) {
+            p++;
+        }
+    }
+    if (npart == 0) {
+        return 0;
+    }
+
+    *val = sign*sum;
+    return 1;
+}
+
+/*
+ * Parse an array of fixed width sexagesimal strings, multiplying by scale,
+ * e.g. 15 for hours to degrees.  Blank strings give NaN.
+ */
+static PyObject *
+PyCoords_parse_sexagesimal(PyObject *self, PyObject *args)
+{
+    PyObject *str_obj=NULL, *out_obj=NULL;
+    const char *data=NULL;
+    double *out=NULL, scale=1, val=0;
+    char *buf=NULL;
+    npy_intp n=0, width=0, i=0, j=0, bad=-1;
+
+    if (!PyArg_ParseTuple(args, (char*)"O!dO!",
+                          &PyArray_Type, &str_obj,
+                          &scale,
+                          &PyArray_Type, &out_obj)) {
+        return NULL;
+    }
+    if (!check_string_array(str_obj, "strings")) {
+        return NULL;
+    }
+    n = PyArray_SIZE((PyArrayObject*)str_obj);
+    if (PyArray_TYPE((PyArrayObject*)out_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY((PyArrayObject*)out_obj)
+            || PyArray_SIZE((PyArrayObject*)out_obj) != n) {
+        PyErr_SetString(PyExc_ValueError,
+                        "out must be a writeable, contiguous, aligned, native "
+                        "float64 array the same size as the strings");
+        return NULL;
+    }
+
+    width = PyArray_ITEMSIZE((PyArrayObject*)str_obj);
+    data = PyArray_DATA((PyArrayObject*)str_obj);
+    out = PyArray_DATA((PyArrayObject*)out_obj);
+
+    buf = malloc(width+1);
+    if (buf == NULL) {
+        return PyErr_NoMemory();
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i=0; i<n; i++) {
+        // the strings are not NUL terminated if they fill the width
+        for (j=0; j<width && data[i*width+j] != '\0'; j++) {
+            buf[j] = data[i*width+j];
+        }
+        buf[j] = '\0';
+
+        if (!parse_sexagesimal(buf, &val)) {
+            bad = i;
+            break;
+        }
+        out[i] = val*scale;
+    }
+    Py_END_ALLOW_THREADS
+
+    if (bad >= 0) {
+        PyErr_Format(PyExc_ValueError,
+                     "could not parse '%s' at index %ld", buf, (long) bad);
+        free(buf);
+        return NULL;
+    }
+
+    free(buf);
+    Py_RETURN_NONE;
+}
+
+// largest value, in units of the last digit of the seconds, that fits
+// comfortably in a long long
+#define SEXAGESIMAL_MAX 9.0e18
+
+/*
+ * Format values as sexagesimal strings D:M:S.sss, after dividing by scale,
+ * e.g. 15 for degrees to hours.  The seconds have ndigits decimals and are
+ * rounded, carrying into the minutes and degrees.  If wrap > 0 the value is
+ * wrapped into [0,wrap), with fmod before rounding so large values do not
+ * overflow.  If dosign is set a sign is always written.  The first field is
+ * zero padded to ndeg digits.  NaN give blank strings, as do values too
+ * large to count in units of the last digit.
+ */
+static PyObject *
+PyCoords_format_sexagesimal(PyObject *self, PyObject *args)
+{
+    PyObject *val_obj=NULL, *out_obj=NULL;
+    const double *vals=NULL;
+    char *out=NULL, *buf=NULL;
+    double scale=1, wrap=0, val=0;
+    int ndigits=0, dosign=0, ndeg=2, len=0;
+    char sep=':';
+    npy_intp n=0, width=0, i=0;
+    long long fac=1, total=0, nwrap=0, sec=0, mins=0, deg=0;
+
+    if (!PyArg_ParseTuple(args, (char*)"O!ddiiicO!",
+                          &PyArray_Type, &val_obj,
+                          &scale, &wrap, &ndigits, &dosign, &ndeg, &sep,
+                          &PyArray_Type, &out_obj)) {
+        return NULL;
+    }
+    if (PyArray_TYPE((PyArrayObject*)val_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)val_obj)) {
+        PyErr_SetString(PyExc_ValueError,
+                        "values must be a contiguous, aligned, native float64 array");
+        return NULL;
+    }
+    if (!check_string_array(out_obj, "out")
+            || !PyArray_ISWRITEABLE((PyArrayObject*)out_obj)) {
+        if (!PyErr_Occurred()) {
+            PyErr_SetString(PyExc_ValueError, "out must be writeable");
+        }
+        return NULL;
+    }
+    n = PyArray_SIZE((PyArrayObject*)val_obj);
+    if (PyArray_SIZE((PyArrayObject*)out_obj) != n) {
+        PyErr_SetString(PyExc_ValueError, "out must be the same size as the values");
+        return NULL;
+    }
+    if (ndigits < 0 || ndigits > 9) {
+        PyErr_Format(PyExc_ValueError, "ndigits must be in [0,9], got %d", ndigits);
+        return NULL;
+    }
+
+    width = PyArray_ITEMSIZE((PyArrayObject*)out_obj);
+    vals = PyArray_DATA((PyArrayObject*)val_obj);
+    out = PyArray_DATA((PyArrayObject*)out_obj);
+
+    for (i=0; i<ndigits; i++) {
+        fac *= 10;
+    }
+    nwrap = (long long) llround(wrap*3600.0*fac);
+
+    // enough for the sign, three fields, separators and the decimals
+    buf = malloc(64);
+    if (buf == NULL) {
+        return PyErr_NoMemory();
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i=0; i<n; i++) {
+        val = vals[i];
+        memset(out+i*width, 0, width);
+        if (!isfinite(val)) {
+            continue;
+        }
+        if (nwrap > 0) {
+            // reduce before dividing by the scale, which can be inexact
+            val = fmod(val, wrap*scale);
+            if (val < 0) {
+                val += wrap*scale;
+            }
+        }
+        val /= scale;
+        if (fabs(val)*3600.0*fac > SEXAGESIMAL_MAX) {
+            continue;
+        }
+
+        total = (long long) llround(fabs(val)*3600.0*fac);
+        if (nwrap > 0) {
+            // rounding can reach the wrap
+            total = total % nwrap;
+        }
+
+        sec = total % (60*fac);
+        total /= 60*fac;
+        mins = total % 60;
+        deg = total/60;
+
+        len = 0;
+        if (dosign) {
+            buf[len++] = (val < 0 && (deg > 0 || mins > 0 || sec > 0)) ? '-' : '+';
+        } else if (val < 0 && nwrap == 0) {
+            buf[len++] = '-';
+        }
+        len += sprintf(buf+len, "%0*lld%c%02lld%c%02lld",
+                       ndeg, deg, sep, mins, sep, sec/fac);
+        if (ndigits > 0) {
+            len += sprintf(buf+len, ".%0*lld", ndigits, sec % fac);
+        }
+
+        memcpy(out+i*width, buf, len < width ? len : width);
+    }
+    Py_END_ALLOW_THREADS
+
+    free(buf);
+    Py_RETURN_NONE;
+}
+
+
+static PyMethodDef coords_module_methods[] = {
+    {"rotate_lonlat", (PyCFunction)PyCoords_rotate_lonlat, METH_VARARGS,  "rotate_lonlat(lon,lat,rot,lon_out,lat_out)"},
+    {"sphdist", (PyCFunction)PyCoords_sphdist, METH_VARARGS,  "sphdist(ra1,dec1,ra2,dec2,dist,angle,scale_in,scale_out,nthreads)"},
+    {"parse_sexagesimal", (PyCFunction)PyCoords_parse_sexagesimal, METH_VARARGS,  "parse_sexagesimal(strings,scale,out)"},
+    {"format_sexagesimal", (PyCFunction)PyCoords_format_sexagesimal, METH_VARARGS,  "format_sexagesimal(values,scale,wrap,ndigits,dosign,ndeg,sep,out)"},
+    {NULL}  /* Sentinel */
+};
+
+
+#if PY_MAJOR_VERSION >= 3
+    static struct PyModuleDef moduledef = {
+        PyModuleDef_HEAD_INIT,
+        "_coords",      /* m_name */
+        "Defines compiled coordinate routines",  /* m_doc */
+        -1,                  /* m_size */
+        coords_module_methods,    /* m_methods */
+        NULL,                /* m_reload */
+        NULL,                /* m_traverse */
+        NULL,                /* m_clear */
+        NULL,                /* m_free */
+    };
+#endif
+
+#ifndef PyMODINIT_FUNC  /* declarations for DLL import/export */
+#define PyMODINIT_FUNC void
+#endif
+#if PY_MAJOR_VERSION >= 3
+PyMODINIT_FUNC
+PyInit__coords(void)
+#else
+PyMODINIT_FUNC
+init_coords(void)
+#endif
+{
+    PyObject* m;
+
+#if PY_MAJOR_VERSION >= 3
+    m = PyModule_Create(&moduledef);
+    if (m==NULL) {
+        return NULL;
+    }
+#else
+    m = Py_InitModule3("_coords", coords_module_methods,
+            "This module defines compiled coordinate routines.\n");
+    if (m==NULL) {
+        return;
+    }
+#endif
+
+    import_array();
+
+#if PY_MAJOR_VERSION >= 3
+    return m;
+#endif
+}
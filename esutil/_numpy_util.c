@@ -0,0 +1,270 @@
+#include <Python.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdint.h>
+#include <numpy/arrayobject.h>
+
+/*
+ * A simple growable buffer of 64-bit integers, used to hold the matched
+ * index pairs since we don't know how many there will be in advance
+ */
+struct i64vec {
+    npy_int64 *data;
+    npy_intp size;
+    npy_intp capacity;
+};
+
+static int i64vec_init(struct i64vec *self, npy_intp capacity)
+{
+    if (capacity < 16) {
+        capacity=16;
+    }
+    self->size=0;
+    self->capacity=capacity;
+    self->data = malloc(capacity*sizeof(npy_int64));
+    return (self->data != NULL);
+}
+
+static int i64vec_push(struct i64vec *self, npy_int64 val)
+{
+    npy_int64 *tmp=NULL;
+    if (self->size == self->capacity) {
+        tmp = realloc(self->data, 2*self->capacity*sizeof(npy_int64));
+        if (tmp == NULL) {
+            return 0;
+        }
+        self->data=tmp;
+        self->capacity *= 2;
+    }
+    self->data[self->size] = val;
+    self->size++;
+    return 1;
+}
+
+static void i64vec_free(struct i64vec *self)
+{
+    free(self->data);
+    self->data=NULL;
+    self->size=0;
+    self->capacity=0;
+}
+
+static PyObject* i64vec_to_array(struct i64vec *self)
+{
+    PyObject* arr=NULL;
+    npy_intp dims[1];
+
+    dims[0] = self->size;
+    arr = PyArray_SimpleNew(1, dims, NPY_INT64);
+    if (arr != NULL && self->size > 0) {
+        memcpy(PyArray_DATA((PyArrayObject*)arr),
+               self->data,
+               self->size*sizeof(npy_int64));
+    }
+    return arr;
+}
+
+/*
+ * Fibonacci hashing of a 64-bit key into a table with 2^shift slots
+ */
+static inline npy_uint64 hash_key(npy_int64 key, int shift)
+{
+    return (((npy_uint64) key)*11400714819323198485ull) >> shift;
+}
+
+static int check_i8_array(PyObject* obj, const char* name)
+{
+    if (PyArray_TYPE((PyArrayObject*)obj) != NPY_INT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "%s must be a contiguous, aligned, native int64 array",
+                     name);
+        return 0;
+    }
+    return 1;
+}
+
+/*
+ * Join two arrays of 64-bit integer keys with a hash table.
+ *
+ * A hash table is built from the "build" array, which should be the smaller
+ * of the two, and probed with each element of the "probe" array.  Duplicate
+ * keys are allowed in both arrays; every pair of equal keys is returned.
+ *
+ * The table is open addressing with linear probing. Each slot holds a
+ * distinct key and the first index in the build array with that key;
+ * further indices with the same key are chained through the "next" array,
+ * in increasing order.
+ *
+ * Pairs are returned ordered by position in the probe array, and by position
+ * in the build array for duplicates.
+ */
+static PyObject *
+PyNumpyUtil_hash_join(PyObject *self, PyObject *args)
+{
+    PyObject *build_obj=NULL, *probe_obj=NULL;
+    PyObject *ibuild_obj=NULL, *iprobe_obj=NULL, *output_tuple=NULL;
+    const npy_int64 *build=NULL, *probe=NULL;
+    npy_intp nbuild=0, nprobe=0, i=0, j=0;
+
+    npy_int64 *keys=NULL, *heads=NULL, *next=NULL;
+    npy_uint64 nslots=1, mask=0, slot=0;
+    int shift=64, status=1;
+    struct i64vec ibuild={0}, iprobe={0};
+
+    if (!PyArg_ParseTuple(args, (char*)"O!O!",
+                          &PyArray_Type, &build_obj,
+                          &PyArray_Type, &probe_obj)) {
+        return NULL;
+    }
+    if (!check_i8_array(build_obj,"build") || !check_i8_array(probe_obj,"probe")) {
+        return NULL;
+    }
+
+    build = PyArray_DATA((PyArrayObject*)build_obj);
+    probe = PyArray_DATA((PyArrayObject*)probe_obj);
+    nbuild = PyArray_SIZE((PyArrayObject*)build_obj);
+    nprobe = PyArray_SIZE((PyArrayObject*)probe_obj);
+
+    // at least twice as many slots as keys keeps the probe sequences short
+    while (nslots < 2*((npy_uint64)nbuild)) {
+        nslots <<= 1;
+        shift--;
+    }
+    if (nslots < 2) {
+        nslots=2;
+        shift=63;
+    }
+    mask = nslots-1;
+
+    keys  = malloc(nslots*sizeof(npy_int64));
+    heads = malloc(nslots*sizeof(npy_int64));
+    next  = malloc((nbuild > 0 ? nbuild : 1)*sizeof(npy_int64));
+    if (keys==NULL || heads==NULL || next==NULL
+            || !i64vec_init(&ibuild, nprobe)
+            || !i64vec_init(&iprobe, nprobe)) {
+        status=0;
+        goto _hash_join_bail;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+
+    for (slot=0; slot<nslots; slot++) {
+        heads[slot] = -1;
+    }
+
+    // insert in reverse order so the chains come out in increasing order
+    for (i=nbuild-1; i>=0; i--) {
+        slot = hash_key(build[i], shift);
+        while (heads[slot] != -1 && keys[slot] != build[i]) {
+            slot = (slot+1) & mask;
+        }
+        if (heads[slot] == -1) {
+            keys[slot] = build[i];
+            next[i] = -1;
+        } else {
+            next[i] = heads[slot];
+        }
+        heads[slot] = i;
+    }
+
+    for (j=0; j<nprobe; j++) {
+        slot = hash_key(probe[j], shift);
+        while (heads[slot] != -1 && keys[slot] != probe[j]) {
+            slot = (slot+1) & mask;
+        }
+        for (i=heads[slot]; i != -1; i=next[i]) {
+            if (!i64vec_push(&ibuild, i) || !i64vec_push(&iprobe, j)) {
+                status=0;
+                break;
+            }
+        }
+        if (!status) {
+            break;
+        }
+    }
+
+    Py_END_ALLOW_THREADS
+
+    if (!status) {
+        goto _hash_join_bail;
+    }
+
+    ibuild_obj = i64vec_to_array(&ibuild);
+    iprobe_obj = i64vec_to_array(&iprobe);
+    if (ibuild_obj==NULL || iprobe_obj==NULL) {
+        Py_XDECREF(ibuild_obj);
+        Py_XDECREF(iprobe_obj);
+        goto _hash_join_bail;
+    }
+
+    output_tuple = PyTuple_New(2);
+    PyTuple_SetItem(output_tuple, 0, ibuild_obj);
+    PyTuple_SetItem(output_tuple, 1, iprobe_obj);
+
+_hash_join_bail:
+    free(keys);
+    free(heads);
+    free(next);
+    i64vec_free(&ibuild);
+    i64vec_free(&iprobe);
+
+    if (!status) {
+        return PyErr_NoMemory();
+    }
+    return output_tuple;
+}
+
+
+static PyMethodDef numpy_util_module_methods[] = {
+    {"hash_join", (PyCFunction)PyNumpyUtil_hash_join, METH_VARARGS,  "ibuild,iprobe=hash_join(build,probe)"},
+    {NULL}  /* Sentinel */
+};
+
+
+#if PY_MAJOR_VERSION >= 3
+    static struct PyModuleDef moduledef = {
+        PyModuleDef_HEAD_INIT,
+        "_numpy_util",      /* m_name */
+        "Defines compiled numpy_util routines",  /* m_doc */
+        -1,                  /* m_size */
+        numpy_util_module_methods,    /* m_methods */
+        NULL,                /* m_reload */
+        NULL,                /* m_traverse */
+        NULL,                /* m_clear */
+        NULL,                /* m_free */
+    };
+#endif
+
+#ifndef PyMODINIT_FUNC  /* declarations for DLL import/export */
+#define PyMODINIT_FUNC void
+#endif
+#if PY_MAJOR_VERSION >= 3
+PyMODINIT_FUNC
+PyInit__numpy_util(void)
+#else
+PyMODINIT_FUNC
+init_numpy_util(void)
+#endif
+{
+    PyObject* m;
+
+#if PY_MAJOR_VERSION >= 3
+    m = PyModule_Create(&moduledef);
+    if (m==NULL) {
+        return NULL;
+    }
+#else
+    m = Py_InitModule3("_numpy_util", numpy_util_module_methods,
+            "This module defines compiled numpy_util routines.\n");
+    if (m==NULL) {
+        return;
+    }
+#endif
+
+    import_array();
+
+#if PY_MAJOR_VERSION >= 3
+    return m;
+#endif
+}
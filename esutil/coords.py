@@ -63,6 +63,10 @@
             parse a colon separated string representing right ascension ito
             degrees.
 
+        ra_format, dec_format:
+            format degrees as sexagesimal strings.  These and the parsers
+            work on arrays of strings in compiled code.
+
         randsphere(numrand, system='eq', ra_range=[0,360], dec_range=[-90,90]):
             Generate random points on the sphere.  By default ra,dec are
             returned.  If system='xyz' then x,y,z are returned.
@@ -71,6 +75,14 @@
             Create random points in a cap, or disc, centered at the
             input ra,dec location and with radius rad.
 
+        randsphere_chunks, randcap_chunks:
+            Generators yielding random points in chunks, with reproducible
+            seeding of each chunk.
+
+        randsphere_mask(num, htmids=None, polygon=None):
+            Generate random points within a set of HTM triangles or a
+            convex polygon.  randsphere_mask_chunks yields them in chunks.
+
         rect_area(lon_min, lon_max, lat_min, lat_max)
             Calculate the area of a rectangle on the sphere.
 
@@ -103,6 +115,13 @@ try:
 except:
     have_numpy=False
 
+# compiled routines, e.g. rotations
+try:
+    from . import _coords
+    have_ccoords=True
+except:
+    have_ccoords=False
+
 import math
 PI=math.pi
 HALFPI = PI/2.0
@@ -134,7 +153,7 @@ _sdsspar['doc'] = """
 """
 
 
-def euler(ai_in, bi_in, select, b1950=False, dtype='f8'):
+def euler(ai_in, bi_in, select, b1950=False, dtype='f8', out=None):
     """
     NAME:
         euler
@@ -143,7 +162,7 @@ def euler(ai_in, bi_in, select, b1950=False, dtype='f8'):
 
     CALLING SEQUENCE:
         long_out, lat_out = 
-            euler(long_in, lat_in, type, b1950=False, dtype='f8')
+            euler(long_in, lat_in, type, b1950=False, dtype='f8', out=None)
 
     INPUTS:
        long_in - Input Longitude in DEGREES, scalar or vector.  
@@ -166,6 +185,19 @@ def euler(ai_in, bi_in, select, b1950=False, dtype='f8'):
        b1950 - If this keyword is true then input and output 
              celestial and ecliptic coordinates should be given in equinox 
              B1950.
+       dtype - The data type of the outputs, 'f8' or 'f4'.  The calculation
+             is always done in double precision.
+       out - Optional tuple of arrays (long_out, lat_out) to hold the
+             result, float32 or float64 with the same size as the input.
+             They may be the input arrays.
+
+    METHOD:
+       Each transformation is a rotation of the sphere.  The rotation
+       matrix is calculated once and cached, and applied to the unit vector
+       for each point.  If the compiled _coords extension is available this
+       is done in a single pass with no temporary arrays, otherwise in
+       blocks with numpy.
+
     REVISION HISTORY:
        Written W. Landsman,  February 1987
        Adapted from Fortran by Daryl Yentis NRL
@@ -177,89 +209,167 @@ def euler(ai_in, bi_in, select, b1950=False, dtype='f8'):
 
     """
 
-    # Make a copy as an array. ndmin=1 to avoid messed up scalar arrays
-    ai = numpy.array(ai_in, ndmin=1, copy=True, dtype=dtype)
-    bi = numpy.array(bi_in, ndmin=1, copy=True, dtype=dtype)
-
-    twopi   =   2.0*PI
-    fourpi  =   4.0*PI
-
-    #   J2000 coordinate conversions are based on the following constants
-    #   (see the Hipparcos explanatory supplement).
-    #  eps = 23.4392911111d           Obliquity of the ecliptic
-    #  alphaG = 192.85948d            Right Ascension of Galactic North Pole
-    #  deltaG = 27.12825d             Declination of Galactic North Pole
-    #  lomega = 32.93192d             Galactic longitude of celestial equator  
-    #  alphaE = 180.02322d            Ecliptic longitude of Galactic North Pole
-    #  deltaE = 29.811438523d         Ecliptic latitude of Galactic North Pole
-    #  Eomega  = 6.3839743d           Galactic longitude of ecliptic equator              
-    # Parameters for all the different conversions
-    if b1950:
-
-        equinox = '(B1950)' 
-        psi    = numpy.array([ 0.57595865315, 4.9261918136,  
-                              0.00000000000, 0.0000000000,  
-                              0.11129056012, 4.7005372834], dtype=dtype)
-        stheta = numpy.array([ 0.88781538514,-0.88781538514, 
-                              0.39788119938,-0.39788119938, 
-                              0.86766174755,-0.86766174755], dtype=dtype)
-        ctheta = numpy.array([ 0.46019978478, 0.46019978478, 
-                              0.91743694670, 0.91743694670, 
-                              0.49715499774, 0.49715499774], dtype=dtype) 
-        phi  =   numpy.array([ 4.9261918136,  0.57595865315, 
-                              0.0000000000, 0.00000000000, 
-                              4.7005372834, 0.11129056012], dtype=dtype)
+    if select < 1 or select > 6:
+        raise ValueError("select must be in [1,6], got %s" % select)
 
-    else:
+    rot = _get_euler_matrix(select, b1950)
+    return _rotate_lonlat(ai_in, bi_in, rot, dtype=dtype, out=out)
 
-        equinox = '(J2000)'
-
-        psi    = numpy.array([ 0.57477043300, 4.9368292465,  
-                              0.00000000000, 0.0000000000,    
-                              0.11142137093, 4.71279419371], dtype=dtype)
-        stheta = numpy.array([ 0.88998808748,-0.88998808748, 
-                              0.39777715593,-0.39777715593, 
-                              0.86766622025,-0.86766622025], dtype=dtype)
-        ctheta = numpy.array([ 0.45598377618, 0.45598377618, 
-                              0.91748206207, 0.91748206207, 
-                              0.49714719172, 0.49714719172], dtype=dtype)
-        phi    = numpy.array([ 4.9368292465,  0.57477043300, 
-                              0.0000000000, 0.00000000000, 
-                              4.71279419371, 0.11142137093], dtype=dtype)
-
-    # zero offset
-    i  = select - 1 
-    a  = ai*D2R - phi[i]
-    
-    b = bi*D2R
-    sb = sin(b)
-    cb = cos(b)
-    cbsa = cb * sin(a)
-    b  = -stheta[i] * cbsa + ctheta[i] * sb
-    w, = numpy.where(b > 1.0)
-    if w.size > 0:
-        b[w] = 1.0
-    bo    = arcsin(b)*R2D
+def _get_euler_matrix(select, b1950):
+    """
+    get the cached rotation matrix for the euler transformation
+
+    The transformation is a rotation by -phi about the z axis, by theta
+    about the x axis and by psi about the new z axis.
+    """
+    key = (select, bool(b1950))
+    rot = _euler_matrices.get(key)
+    if rot is None:
+        if b1950:
+            pars = _euler_pars['b1950']
+        else:
+            pars = _euler_pars['j2000']
+
+        i = select-1
+        psi, stheta, ctheta, phi = [p[i] for p in pars]
 
-    a =  arctan2( ctheta[i] * cbsa + stheta[i] * sb, cb * cos(a) )
+        rtheta = numpy.array([[1.0,  0.0,     0.0],
+                              [0.0,  ctheta,  stheta],
+                              [0.0, -stheta,  ctheta]])
 
-    ao = ( (a+psi[i]+fourpi) % twopi) * R2D
+        rot = numpy.dot(_rotz(psi), numpy.dot(rtheta, _rotz(-phi)))
+        _euler_matrices[key] = rot
 
-    return ao, bo
+    return rot
+
+def _rotz(angle):
+    """
+    matrix for a rotation about the z axis, adding angle in radians to the
+    longitude
+    """
+    c = math.cos(angle)
+    s = math.sin(angle)
+    return numpy.array([[c,  -s,  0.0],
+                        [s,   c,  0.0],
+                        [0.0, 0.0, 1.0]])
+
+def _rotate_lonlat(lon_in, lat_in, rot, dtype='f8', out=None):
+    """
+    rotate longitude and latitude in degrees by the 3x3 rotation matrix,
+    returning arrays with the requested dtype or filling out
+    """
+
+    lon = numpy.array(lon_in, ndmin=1, copy=False)
+    lat = numpy.array(lat_in, ndmin=1, copy=False)
+    if lon.shape != lat.shape:
+        lon, lat = numpy.broadcast_arrays(lon, lat)
+    lon = _as_real_array(lon, dtype)
+    lat = _as_real_array(lat, dtype)
+
+    if out is None:
+        lon_out = numpy.zeros(lon.shape, dtype=dtype)
+        lat_out = numpy.zeros(lat.shape, dtype=dtype)
+    else:
+        lon_out, lat_out = out
+        if lon_out.size != lon.size or lat_out.size != lat.size:
+            raise ValueError("out arrays must have size %d" % lon.size)
+
+    if have_ccoords:
+        _coords.rotate_lonlat(lon, lat, rot, lon_out, lat_out)
+    else:
+        lonf = lon.ravel()
+        latf = lat.ravel()
+        lon_outf = lon_out.reshape(lonf.size)
+        lat_outf = lat_out.reshape(latf.size)
+        for start in xrange(0, lonf.size, _rotate_blocksize):
+            stop = min(start+_rotate_blocksize, lonf.size)
+            a = deg2rad(lonf[start:stop].astype('f8'))
+            b = deg2rad(latf[start:stop].astype('f8'))
+            cb = cos(b)
+            x = cb*cos(a)
+            y = cb*sin(a)
+            z = sin(b)
+
+            xr = rot[0,0]*x + rot[0,1]*y + rot[0,2]*z
+            yr = rot[1,0]*x + rot[1,1]*y + rot[1,2]*z
+            zr = rot[2,0]*x + rot[2,1]*y + rot[2,2]*z
+            numpy.clip(zr, -1.0, 1.0, zr)
+
+            a = rad2deg(arctan2(yr, xr))
+            a %= 360.0
+            lon_outf[start:stop] = a
+            lat_outf[start:stop] = rad2deg(arcsin(zr))
+
+    return lon_out, lat_out
+
+def _as_real_array(arr, dtype):
+    """
+    float32 and float64 arrays are used as is, others are converted to dtype
+    """
+    if (arr.dtype.type not in (numpy.float32, numpy.float64)
+            or not arr.dtype.isnative or not arr.flags['C_CONTIGUOUS']
+            or not arr.flags['ALIGNED']):
+        arr = numpy.array(arr, dtype=dtype, order='C')
+    return arr
+
+#   J2000 coordinate conversions are based on the following constants
+#   (see the Hipparcos explanatory supplement).
+#  eps = 23.4392911111d           Obliquity of the ecliptic
+#  alphaG = 192.85948d            Right Ascension of Galactic North Pole
+#  deltaG = 27.12825d             Declination of Galactic North Pole
+#  lomega = 32.93192d             Galactic longitude of celestial equator  
+#  alphaE = 180.02322d            Ecliptic longitude of Galactic North Pole
+#  deltaE = 29.811438523d         Ecliptic latitude of Galactic North Pole
+#  Eomega  = 6.3839743d           Galactic longitude of ecliptic equator              
+# Parameters psi, stheta, ctheta, phi for all the different conversions
+_euler_pars = {}
+_euler_pars['b1950'] = (
+    [ 0.57595865315, 4.9261918136,  
+      0.00000000000, 0.0000000000,  
+      0.11129056012, 4.7005372834],
+    [ 0.88781538514,-0.88781538514, 
+      0.39788119938,-0.39788119938, 
+      0.86766174755,-0.86766174755],
+    [ 0.46019978478, 0.46019978478, 
+      0.91743694670, 0.91743694670, 
+      0.49715499774, 0.49715499774],
+    [ 4.9261918136,  0.57595865315, 
+      0.0000000000, 0.00000000000, 
+      4.7005372834, 0.11129056012])
+
+_euler_pars['j2000'] = (
+    [ 0.57477043300, 4.9368292465,  
+      0.00000000000, 0.0000000000,    
+      0.11142137093, 4.71279419371],
+    [ 0.88998808748,-0.88998808748, 
+      0.39777715593,-0.39777715593, 
+      0.86766622025,-0.86766622025],
+    [ 0.45598377618, 0.45598377618, 
+      0.91748206207, 0.91748206207, 
+      0.49714719172, 0.49714719172],
+    [ 4.9368292465,  0.57477043300, 
+      0.0000000000, 0.00000000000, 
+      4.71279419371, 0.11142137093])
+
+# rotation matrices for euler, keyed by (select, b1950)
+_euler_matrices = {}
+
+# number of points per block for the pure numpy rotation
+_rotate_blocksize = 65536
 
 
 
 #
 # Some clearer shortcut functions which call Euler
 #
-def eq2gal(ra, dec, b1950=False, dtype='f8'):
+def eq2gal(ra, dec, b1950=False, dtype='f8', out=None):
     """
     NAME
         eq2gal
     PURPOSE
         Convert from equatorial to galactic coordinates in units of degrees.
     CALLING SEQUENCE
-        l,b = eq2gal(ra, dec, b1950=False, dtype='f8')
+        l,b = eq2gal(ra, dec, b1950=False, dtype='f8', out=None)
     INPUTS
         ra, dec: Equatorial coordinates.  May be Numpy arrays, sequences, or
             scalars as long as they are all the same length.  They must be
@@ -267,23 +377,25 @@ def eq2gal(ra, dec, b1950=False, dtype='f8'):
     KEYWORDS
         b1950:  If True, use b1950 coordiates.  By default j2000 are used.
         dtype:  The datatype of the output arrays.  Default is f8
+        out:  Optional tuple of arrays to hold the outputs, see euler
     OUTPUTS
         l, b:  Galactic longitude and latitude.  The returned value is always
             a Numpy array with the specified dtype
     REVISION HISTORY
         Created Erin Sheldon, NYU, 2008-07-02
     """
-    return euler(ra, dec, 1, b1950=b1950, dtype=dtype)
+    return euler(ra, dec, 1, b1950=b1950, dtype=dtype,
+                 out=out)
 
 
-def gal2eq(l, b, b1950=False, dtype='f8'):
+def gal2eq(l, b, b1950=False, dtype='f8', out=None):
     """
     NAME
         gal2eq
     PURPOSE
         Convert from galactice to equatorial coordinates in units of degrees.
     CALLING SEQUENCE
-        ra,dec = gal2eq(l, b, b1950=False, dtype='f8')
+        ra,dec = gal2eq(l, b, b1950=False, dtype='f8', out=None)
     INPUTS
         l, b: Galactic coordinates.  May be Numpy arrays, sequences, or
             scalars as long as they are all the same length.  They must be
@@ -291,6 +403,7 @@ def gal2eq(l, b, b1950=False, dtype='f8'):
     KEYWORDS
         b1950:  If True, use b1950 coordiates.  By default j2000 are used.
         dtype:  The datatype of the output arrays.  Default is f8
+        out:  Optional tuple of arrays to hold the outputs, see euler
     OUTPUTS
         ra, dec:  Equatorial longitude and latitude.  The returned value is 
             always a Numpy array with the specified dtype
@@ -298,16 +411,17 @@ def gal2eq(l, b, b1950=False, dtype='f8'):
         Created Erin Sheldon, NYU, 2008-07-02
     """
 
-    return euler(l, b, 2, b1950=b1950, dtype=dtype)
+    return euler(l, b, 2, b1950=b1950, dtype=dtype,
+                 out=out)
 
-def eq2ec(ra, dec, b1950=False, dtype='f8'):
+def eq2ec(ra, dec, b1950=False, dtype='f8', out=None):
     """
     NAME
         eq2ec
     PURPOSE
         Convert from equatorial to ecliptic coordinates in units of degrees.
     CALLING SEQUENCE
-        lam,beta = eq2ec(ra, dec, b1950=False, dtype='f8')
+        lam,beta = eq2ec(ra, dec, b1950=False, dtype='f8', out=None)
     INPUTS
         ra, dec: Equatorial coordinates.  May be Numpy arrays, sequences, or
             scalars as long as they are all the same length.  They must be
@@ -315,6 +429,7 @@ def eq2ec(ra, dec, b1950=False, dtype='f8'):
     KEYWORDS
         b1950:  If True, use b1950 coordiates.  By default j2000 are used.
         dtype:  The datatype of the output arrays.  Default is f8
+        out:  Optional tuple of arrays to hold the outputs, see euler
     OUTPUTS
         lam, beta:  Ecliptic longitude and latitude.  The returned value is 
             always a Numpy array with the specified dtype
@@ -322,16 +437,17 @@ def eq2ec(ra, dec, b1950=False, dtype='f8'):
         Created Erin Sheldon, NYU, 2008-07-02
     """
 
-    return euler(ra, dec, 3, b1950=b1950, dtype=dtype)
+    return euler(ra, dec, 3, b1950=b1950, dtype=dtype,
+                 out=out)
 
-def ec2eq(lam, beta, b1950=False, dtype='f8'):
+def ec2eq(lam, beta, b1950=False, dtype='f8', out=None):
     """
     NAME
         ec2eq
     PURPOSE
         Convert from ecliptic to equatorial coordinates in units of degrees.
     CALLING SEQUENCE
-        ra,dec = eq2gal(lam, beta, b1950=False, dtype='f8')
+        ra,dec = eq2gal(lam, beta, b1950=False, dtype='f8', out=None)
     INPUTS
         lam,beta: Ecliptic coordinates.  May be Numpy arrays, sequences, or
             scalars as long as they are all the same length.  They must be
@@ -339,6 +455,7 @@ def ec2eq(lam, beta, b1950=False, dtype='f8'):
     KEYWORDS
         b1950:  If True, use b1950 coordiates.  By default j2000 are used.
         dtype:  The datatype of the output arrays.  Default is f8
+        out:  Optional tuple of arrays to hold the outputs, see euler
     OUTPUTS
         ra,dec:  Equatorial longitude and latitude.  The returned value is 
             always a Numpy array with the specified dtype
@@ -346,16 +463,17 @@ def ec2eq(lam, beta, b1950=False, dtype='f8'):
         Created Erin Sheldon, NYU, 2008-07-02
     """
 
-    return euler(lam, beta, 4, b1950=b1950, dtype=dtype)
+    return euler(lam, beta, 4, b1950=b1950, dtype=dtype,
+                 out=out)
 
-def ec2gal(lam, beta, b1950=False, dtype='f8'):
+def ec2gal(lam, beta, b1950=False, dtype='f8', out=None):
     """
     NAME
         ec2gal
     PURPOSE
         Convert from ecliptic to galactic coordinates in units of degrees.
     CALLING SEQUENCE
-        l,b = eq2gal(lam, beta, b1950=False, dtype='f8')
+        l,b = eq2gal(lam, beta, b1950=False, dtype='f8', out=None)
     INPUTS
         lam, beta: Ecliptic coordinates.  May be Numpy arrays, sequences, or
             scalars as long as they are all the same length.  They must be
@@ -363,6 +481,7 @@ def ec2gal(lam, beta, b1950=False, dtype='f8'):
     KEYWORDS
         b1950:  If True, use b1950 coordiates.  By default j2000 are used.
         dtype:  The datatype of the output arrays.  Default is f8
+        out:  Optional tuple of arrays to hold the outputs, see euler
     OUTPUTS
         l, b:  Galactic longitude and latitude.  The returned value is always
             a Numpy array with the specified dtype
@@ -370,16 +489,17 @@ def ec2gal(lam, beta, b1950=False, dtype='f8'):
         Created Erin Sheldon, NYU, 2008-07-02
     """
 
-    return euler(lam, beta, 5, b1950=b1950, dtype=dtype)
+    return euler(lam, beta, 5, b1950=b1950, dtype=dtype,
+                 out=out)
 
-def gal2ec(l, b, b1950=False, dtype='f8'):
+def gal2ec(l, b, b1950=False, dtype='f8', out=None):
     """
     NAME
         gal2ec
     PURPOSE
         Convert from Galactic to Ecliptic coordinates in units of degrees.
     CALLING SEQUENCE
-        lam,beta = eq2gal(l, b, b1950=False, dtype='f8')
+        lam,beta = eq2gal(l, b, b1950=False, dtype='f8', out=None)
     INPUTS
         l, b: Galactic coordinates.  May be Numpy arrays, sequences, or
             scalars as long as they are all the same length.  They must be
@@ -387,6 +507,7 @@ def gal2ec(l, b, b1950=False, dtype='f8'):
     KEYWORDS
         b1950:  If True, use b1950 coordiates.  By default j2000 are used.
         dtype:  The datatype of the output arrays.  Default is f8
+        out:  Optional tuple of arrays to hold the outputs, see euler
     OUTPUTS
         lam,beta:  Ecliptic longitude and latitude.  The returned value is 
             always a Numpy array with the specified dtype
@@ -394,7 +515,8 @@ def gal2ec(l, b, b1950=False, dtype='f8'):
         Created Erin Sheldon, NYU, 2008-07-02
     """
 
-    return euler(l, b, 6, b1950=b1950, dtype=dtype)
+    return euler(l, b, 6, b1950=b1950, dtype=dtype,
+                 out=out)
 
 
 def _thetaphi2xyz(theta, phi):
@@ -480,7 +602,7 @@ def xyz2eq(xin,yin,zin, units='deg'):
 
    
 
-def sphdist(ra1, dec1, ra2, dec2, units=['deg','deg']):
+def sphdist(ra1, dec1, ra2, dec2, units=['deg','deg'], nthreads=1):
     """
     Get the arc length between two points on the unit sphere
 
@@ -488,15 +610,30 @@ def sphdist(ra1, dec1, ra2, dec2, units=['deg','deg']):
     ----------
     ra1,dec1,ra2,dec2: scalar or array
         Coordinates of two points or sets of points. 
-        Must be the same length.
+        Must be the same length, or broadcast against each other, for
+        example a single point against many.
     units: sequence
         A sequence containing the units of the input and output.  Default
         ['deg',deg'], which means inputs and outputs are in degrees.  Units
         can be 'deg' or 'rad'
+    nthreads: int, optional
+        Number of threads to use, default 1.  Only used if the compiled
+        _coords extension is available.
+
+    The distance is calculated with the Vincenty formula, which is accurate
+    for all separations, in a single compiled pass with the GIL released.
     """
     
     units_in,units_out = units
 
+    if have_ccoords:
+        scale_in = D2R if units_in == 'deg' else 1.0
+        scale_out = R2D if units_out == 'deg' else 1.0
+        theta, angle = _sphdist_compiled(ra1, dec1, ra2, dec2,
+                                         scale_in, scale_out, False,
+                                         nthreads)
+        return theta
+
     # note x,y,z from eq2xyz always returns 8-byte float
     x1,y1,z1 = eq2xyz(ra1, dec1, units=units_in)
     x2,y2,z2 = eq2xyz(ra2, dec2, units=units_in)
@@ -511,10 +648,23 @@ def sphdist(ra1, dec1, ra2, dec2, units=['deg','deg']):
     return theta
 
 
-def gcirc(ra1deg,dec1deg,ra2deg,dec2deg,getangle=False):
+def gcirc(ra1deg,dec1deg,ra2deg,dec2deg,getangle=False,nthreads=1):
     """
     This is currently very inflexible: degrees in, radians out
+
+    The inputs may broadcast against each other, for example a single point
+    against many.  If the compiled _coords extension is available the
+    distance is calculated with the Vincenty formula in one pass, using
+    nthreads threads.
     """
+    if have_ccoords:
+        dis, theta = _sphdist_compiled(ra1deg, dec1deg, ra2deg, dec2deg,
+                                       D2R, 1.0, getangle, nthreads)
+        if getangle:
+            return dis,theta
+        else:
+            return dis
+
     ra1  = numpy.array(ra1deg, dtype='f8',ndmin=1)
     dec1 = numpy.array(dec1deg,dtype='f8',ndmin=1)
     ra2  = numpy.array(ra2deg, dtype='f8',ndmin=1)
@@ -545,6 +695,32 @@ def gcirc(ra1deg,dec1deg,ra2deg,dec2deg,getangle=False):
     else:
         return dis
 
+def _sphdist_compiled(ra1, dec1, ra2, dec2, scale_in, scale_out, getangle,
+                      nthreads):
+    """
+    distance and optionally angle from the compiled code, with the output
+    shape from broadcasting the inputs
+    """
+    coords = [numpy.array(c, ndmin=1, copy=False)
+              for c in (ra1, dec1, ra2, dec2)]
+    shape = numpy.broadcast(*coords).shape
+
+    # single points are sent as is, the compiled code reuses them
+    for i in xrange(4):
+        if coords[i].shape != shape and coords[i].size != 1:
+            coords[i] = numpy.broadcast_to(coords[i], shape)
+        coords[i] = _as_real_array(coords[i], 'f8')
+
+    dist = numpy.zeros(shape, dtype='f8')
+    if getangle:
+        angle = numpy.zeros(shape, dtype='f8')
+    else:
+        angle = None
+
+    _coords.sphdist(coords[0], coords[1], coords[2], coords[3],
+                    dist, angle, scale_in, scale_out, int(nthreads))
+    return dist, angle
+
 # utility functions
 def atbound(longitude, minval, maxval):
     w, = numpy.where(longitude < minval)
@@ -580,7 +756,7 @@ def atbound2(theta, phi):
 #
 
 
-def eq2sdss(ra_in, dec_in, dtype='f8'):
+def eq2sdss(ra_in, dec_in, dtype='f8', out=None):
     """
     NAME:
       eq2sdss
@@ -595,7 +771,7 @@ def eq2sdss(ra_in, dec_in, dtype='f8'):
 
     CALLING SEQUENCE:
       from esutil import coords
-      (clambda, ceta) = coords.eq2sdss(ra, dec, dtype='f8')
+      (clambda, ceta) = coords.eq2sdss(ra, dec, dtype='f8', out=None)
 
     INPUTS: 
       ra: Equatorial latitude in degrees. 
@@ -604,6 +780,8 @@ def eq2sdss(ra_in, dec_in, dtype='f8'):
         dtype: The data type of output.  Default is 'f8'. See 
         numpy.typeDict for a list of possible types.
         dtype: The data type of output.  Default is 'f8'.
+        out: Optional tuple of float32 or float64 arrays (clambda, ceta)
+            to hold the outputs.  To convert in place send (ra, dec).
 
     OUTPUTS: 
       clambda: Corrected Survey longitude (actually lattitude) in degrees
@@ -611,14 +789,10 @@ def eq2sdss(ra_in, dec_in, dtype='f8'):
       
     REVISION HISTORY:
       Written: 11-March-2006  Converted from IDL program.
+      The transformation is a single cached rotation, as for euler.
     """
 
-    # Make a copy as an array. ndmin=1 to avoid messed up scalar arrays
-    ra = numpy.array(ra_in, ndmin=1, copy=True, dtype=dtype)
-    dec = numpy.array(dec_in, ndmin=1, copy=True, dtype=dtype)
-
-    if (ra.size != dec.size):
-        raise ValueError("RA, DEC must be same size")
+    ra, dec = _get_sdss_inputs(ra_in, dec_in, dtype)
 
     # range checking
     if (ra.min() < 0.0) | (ra.max() > 360.0):
@@ -626,41 +800,17 @@ def eq2sdss(ra_in, dec_in, dtype='f8'):
     if (dec.min() < -90.0) | (dec.max() > 90.0):
         raise ValueError('DEC must we within [-90,90]')
 
-    ra *= D2R
-    dec *= D2R
-    ra -= _sdsspar['node']
-
-    # generate x,y,z on unit sphere, clearing memory as we go
-    cdec = cos(dec)
-    
-    x = cos(ra)*cdec
-    y = sin(ra)*cdec
-
-    ra = 0; cdec = 0 # mem 
-    
-    z = numpy.sin(dec)
-    
-    dec = 0 # mem
-
-    # generate clambda, ceta
-    # do things in place to save memory
-
-    # clambda = -arcsin( x ) (not a copy clambda=x)
-    arcsin(x, x); clambda=x
-    clambda *= -1
+    if out is not None:
+        out = (out[1], out[0])
+    ceta, clambda = _rotate_lonlat(ra, dec, _sdsspar['rot'],
+                                   dtype=dtype, out=out)
 
-    
-    arctan2( z, y, z); ceta = z
-    ceta -= _sdsspar['etapole']
-
-    clambda *= R2D
-    ceta *= R2D
-
-    atbound(ceta, -180.0, 180.0)
+    # ceta is in [0,360), move to [-180,180]
+    _wrap180(ceta)
     
     return (clambda, ceta)
 
-def sdss2eq(clambda_in, ceta_in, dtype='f8'):
+def sdss2eq(clambda_in, ceta_in, dtype='f8', out=None):
     """
     NAME:
       sdss2eq
@@ -670,7 +820,7 @@ def sdss2eq(clambda_in, ceta_in, dtype='f8'):
 
     CALLING SEQUENCE:
       from esutil import coords
-      (ra, dec) = coords.sdss2eq(clambda, ceta, dtype='f8')
+      (ra, dec) = coords.sdss2eq(clambda, ceta, dtype='f8', out=None)
 
     INPUTS: 
       clambda: Corrected Survey longitude (actually lattitude) in degrees
@@ -678,6 +828,8 @@ def sdss2eq(clambda_in, ceta_in, dtype='f8'):
     OPTIONAL INPUTS:
         dtype: The data type of output.  Default is 'f8'. See 
         numpy.typeDict for a list of possible types.
+        out: Optional tuple of float32 or float64 arrays (ra, dec) to hold
+            the outputs.  To convert in place send (clambda, ceta).
 
     OUTPUTS: 
       ra: Equatorial latitude in degrees. 
@@ -685,11 +837,10 @@ def sdss2eq(clambda_in, ceta_in, dtype='f8'):
       
     REVISION HISTORY:
       Written: 11-March-2006  Converted from IDL program.
+      The transformation is a single cached rotation, as for euler.
     """
     
-    # Make a copy as an array. ndmin=1 to avoid messed up scalar arrays
-    clambda = numpy.array(clambda_in, ndmin=1, copy=True, dtype=dtype)
-    ceta = numpy.array(ceta_in, ndmin=1, copy=True, dtype=dtype)
+    clambda, ceta = _get_sdss_inputs(clambda_in, ceta_in, dtype)
 
     # range checking
     if (clambda.min() < -90.0) | (clambda.max() > 90.0):
@@ -697,21 +848,7 @@ def sdss2eq(clambda_in, ceta_in, dtype='f8'):
     if (ceta.min() < -180.0) | (ceta.max() > 180.0):
         raise ValueError('CETA must we within [-180,180]')
 
-    clambda *= D2R
-    ceta    *= D2R
-
-    x = -sin(clambda)
-    y = cos(ceta + _sdsspar['etapole'])*cos(clambda)
-    z = sin(ceta + _sdsspar['etapole'])*cos(clambda)
-    
-    ra = arctan2( y, x ) + _sdsspar['node']
-    dec = arcsin(z)
-
-    ra  *= R2D
-    dec *= R2D
-    atbound2(dec, ra)
-
-    return (ra,dec)
+    return _sdss_rotate_inverse(clambda, ceta, dtype, out)
 
 
 def _eq2survey(ra_in, dec_in, dtype='f8'):
@@ -742,60 +879,17 @@ def _eq2survey(ra_in, dec_in, dtype='f8'):
       Written: 11-March-2006  Converted from IDL program.
     """
 
-    # Make a copy as an array. ndmin=1 to avoid messed up scalar arrays
-    ra = numpy.array(ra_in, ndmin=1, copy=True, dtype=dtype)
-    dec = numpy.array(dec_in, ndmin=1, copy=True, dtype=dtype)
+    lam, eta = eq2sdss(ra_in, dec_in, dtype=dtype)
 
-    if (ra.size != dec.size):
-        raise ValueError("RA, DEC must be same size")
+    # at the poles the longitude is set to zero
+    eta[numpy.abs(lam) == 90.0] = 0.0
 
-    # range checking
-    if (ra.min() < 0.0) | (ra.max() > 360.0):
-        raise ValueError('RA must we within [0,360]')
-    if (dec.min() < -90.0) | (dec.max() > 90.0):
-        raise ValueError('DEC must we within [-90,90]')
-
-
-
-    ra *= D2R
-    dec *= D2R
-    ra -= _sdsspar['node']
-
-    # generate x,y,z on unit sphere, clearing memory as we go
-    cdec = cos(dec)
-    
-    x = cos(ra)*cdec
-    y = sin(ra)*cdec
-
-    ra = 0; cdec = 0 # mem 
-    
-    z = sin(dec)
-    
-    dec = 0 # mem
-
-    # generate lam, eta
-    # do things in place to save memory
-
-    # lam = -arcsin( x ) (not a copy lam=x)
-    arcsin(x, x); lam=x
-    lam *= -1
-
-    
-    arctan2( z, y, z); eta = z
-    eta -= _sdsspar['etapole']
-
-    lam *= R2D
-    eta *= R2D
-
-    atbound2(lam, eta)
-    atbound(eta, -180.0, 180.0)
-
-    w, = numpy.where( eta > (90.0 - _sdsspar['center_dec']) )
-    if w.size > 0:
-        eta[w] -= 180.0
-        lam[w]  = 180.0 - lam[w]
-
-    atbound(lam, -180.0, 180.0)
+    # move the part of the sphere beyond the survey pole to the other side,
+    # with lambda in [-180,180]
+    flip = eta > (90.0 - _sdsspar['center_dec'])
+    numpy.subtract(eta, 180.0, out=eta, where=flip)
+    numpy.subtract(180.0, lam, out=lam, where=flip)
+    _wrap180(lam)
 
     return (lam, eta)
 
@@ -827,7 +921,39 @@ def _survey2eq(ra, dec, dtype='f8'):
       Written: 11-March-2006  Converted from IDL program.
     """
 
-    return csurvey2eq(ra,dec, dtype=dtype)
+    # the same rotation as for the corrected coordinates works for any
+    # lambda
+    lam, eta = _get_sdss_inputs(ra, dec, dtype)
+    return _sdss_rotate_inverse(lam, eta, dtype, None)
+
+def _get_sdss_inputs(lon_in, lat_in, dtype):
+    """
+    inputs as arrays, float32 and float64 are not copied
+    """
+    lon = numpy.array(lon_in, ndmin=1, copy=False)
+    lat = numpy.array(lat_in, ndmin=1, copy=False)
+    if lon.size != lat.size:
+        raise ValueError("longitude, latitude must be same size")
+    return _as_real_array(lon, dtype), _as_real_array(lat, dtype)
+
+def _sdss_rotate_inverse(lam, eta, dtype, out):
+    """
+    rotate survey coordinates back to equatorial
+    """
+    ra, dec = _rotate_lonlat(eta, lam, _sdsspar['rotinv'],
+                             dtype=dtype, out=out)
+
+    # at the poles the longitude is set to zero
+    ra[numpy.abs(dec) == 90.0] = 0.0
+
+    return (ra,dec)
+
+def _wrap180(lon):
+    """
+    move longitudes in [0,360) to [-180,180] in place
+    """
+    numpy.subtract(lon, 360.0, out=lon, where=lon > 180.0)
+
 
 
 def dec_parse(decstring):
@@ -837,34 +963,23 @@ def dec_parse(decstring):
 
     parameters
     ----------
-    decstring: string
+    decstring: string or array of strings
         DD:MM:SS.sss the value is specified in degrees, minutes, seconds
 
         Only the degrees are required. Additional
         precision (minutes, seconds) are optional in the string (i.e. "12" or
-        "12:34" or "12:34:56" are all valid input strings)
+        "12:34" or "12:34:56" are all valid input strings).  The parts may
+        also be separated by spaces.
+
+        An array or sequence of strings can be sent, including fixed width
+        byte strings read by recfile, or an array of uint8 with the bytes
+        for each string in a row.  An array of degrees is returned.  Blank
+        strings give NaN.
 
     Corrections by Paul Ray and Dave Smith, NRL, 2013-03-19
+    The sign is applied to the minutes and seconds.
     """
-    dec = 0.0
-    sign = 1.0
-
-    # Grab sign here                                                            
-    if decstring.find("-") >= 0:
-        sign = -1.0
-    ds = decstring.split(':')
-    lds = len(ds)
-    if lds >= 1:
-        # Take sign away                                                        
-        deg = abs(float(ds[0]))
-        dec += deg
-    if lds >= 2:
-        minutes = float(ds[1])
-        dec += minutes/60.0
-    if lds >= 3:
-        sec = float(ds[2])
-        dec += sec/3600.0
-    return dec
+    return _sexagesimal_parse(decstring, 1.0)
 
 def ra_parse(rastring, hours=True):
     """
@@ -873,32 +988,225 @@ def ra_parse(rastring, hours=True):
 
     parameters
     ----------
-    rastring: string
+    rastring: string or array of strings
         "HH:MM:SS.sss" if hours is True and                                         
         "DD:MM:SS.sss" if hours is False (indicating that                           
             the value is specified in degrees, minutes, seconds)
 
         In all cases,  only the hours (or degrees) are required. Additional
         precision (minutes, seconds) are optional in the string (i.e. "12" or
-        "12:34" or "12:34:56" are all valid input strings)
+        "12:34" or "12:34:56" are all valid input strings).  The parts may
+        also be separated by spaces.
+
+        An array of strings can be sent, see dec_parse.
 
     Corrections by Paul Ray and Dave Smith, NRL, 2013-03-19
     """
-    ra = 0.0
-
-    rs = rastring.split(':')
-    lrs = len(rs)
-    if lrs >= 1:
-        ra +=  float(rs[0])
-    if lrs >= 2:
-        minutes = float(rs[1])
-        ra += minutes/60.0
-    if lrs >= 3:
-        sec = float(rs[2])
-        ra += sec/3600.0
     if hours:
-        ra *= 15
-    return ra
+        scale = 15.0
+    else:
+        scale = 1.0
+    return _sexagesimal_parse(rastring, scale)
+
+def ra_format(ra, hours=True, ndigits=2, sep=':'):
+    """
+    format right ascension in degrees as sexagesimal strings
+
+    parameters
+    ----------
+    ra: scalar or array
+        Right ascension in degrees
+    hours: bool, optional
+        If True, the default, format as HH:MM:SS.ss, otherwise as
+        DDD:MM:SS.ss
+    ndigits: int, optional
+        The number of decimals for the seconds, default 2.  The seconds
+        are rounded, carrying into the minutes and hours.
+    sep: string, optional
+        The separator, default ':'
+
+    returns
+    -------
+        A string for scalar input, otherwise an array of fixed width
+        strings.  NaN give blank strings.
+    """
+    if hours:
+        scale, ndeg = 15.0, 2
+    else:
+        scale, ndeg = 1.0, 3
+    return _sexagesimal_format(ra, scale, 360.0/scale, ndigits, False, ndeg,
+                               sep)
+
+def dec_format(dec, ndigits=1, sep=':'):
+    """
+    format declination in degrees as sexagesimal strings +DD:MM:SS.s
+
+    parameters
+    ----------
+    dec: scalar or array
+        Declination in degrees
+    ndigits: int, optional
+        The number of decimals for the seconds, default 1.  The seconds
+        are rounded, carrying into the minutes and degrees.
+    sep: string, optional
+        The separator, default ':'
+
+    returns
+    -------
+        A string for scalar input, otherwise an array of fixed width
+        strings.  NaN give blank strings, as do values too large to count
+        in units of the last digit of the seconds, about 9e18.
+    """
+    return _sexagesimal_format(dec, 1.0, 0.0, ndigits, True, 2, sep)
+
+def _sexagesimal_parse(strings, scale):
+    """
+    parse a string or array of strings, multiplying by scale
+    """
+    if isinstance(strings, basestring):
+        return _sexagesimal_parse_one(strings)*scale
+
+    arr = numpy.array(strings, ndmin=1, copy=False)
+    if arr.dtype.kind == 'u' and arr.dtype.itemsize == 1 and arr.ndim == 2:
+        # raw bytes, one string per row
+        arr = numpy.ascontiguousarray(arr).view('S%d' % arr.shape[1])
+        arr = arr.reshape(arr.shape[0])
+    elif arr.dtype.kind == 'U':
+        arr = arr.astype('S')
+    elif arr.dtype.kind != 'S':
+        raise ValueError("expected strings, got type %s" % arr.dtype)
+
+    out = numpy.zeros(arr.shape, dtype='f8')
+    if have_ccoords:
+        _coords.parse_sexagesimal(numpy.ascontiguousarray(arr), scale, out)
+    else:
+        outf = out.reshape(out.size)
+        for i,s in enumerate(arr.ravel()):
+            outf[i] = _sexagesimal_parse_one(s)*scale
+    return out
+
+def _sexagesimal_parse_one(string):
+    """
+    parse [+-]D[:M[:S]] with the sign applied to all parts; the parts may be
+    separated by colons or white space.  A blank string gives NaN
+    """
+    s = string.strip()
+    if s == '':
+        return numpy.nan
+
+    sign = 1.0
+    if s[0] in '+-':
+        if s[0] == '-':
+            sign = -1.0
+        s = s[1:]
+
+    # the sign must be attached to the number
+    parts = s.replace(':',' ').split()
+    if s[0:1] in ['',' ','\t'] or len(parts) == 0 or len(parts) > 3:
+        raise ValueError("could not parse '%s'" % string)
+
+    val = 0.0
+    div = 1.0
+    for part in parts:
+        if part[0] not in '0123456789.':
+            raise ValueError("could not parse '%s'" % string)
+        val += float(part)/div
+        div *= 60.0
+
+    return sign*val
+
+# largest value, in units of the last digit of the seconds, that fits
+# comfortably in the 64 bit integers used by the compiled code
+_sexagesimal_max = 9.0e18
+
+def _sexagesimal_format(vals, scale, wrap, ndigits, dosign, ndeg, sep):
+    """
+    format values divided by scale as sexagesimal strings
+    """
+    ndigits = int(ndigits)
+    if ndigits < 0 or ndigits > 9:
+        raise ValueError("ndigits must be in [0,9], got %s" % ndigits)
+    if len(sep) != 1:
+        raise ValueError("sep must be a single character, got '%s'" % sep)
+
+    isscalar = numpy.isscalar(vals)
+    arr = numpy.array(vals, ndmin=1, dtype='f8', order='C')
+
+    # sign, fields, separators and decimals; the first field can be wider
+    # for values without wrapping.  Values too large to format are blank
+    width = 1 + ndeg + 6 + (ndigits+1 if ndigits > 0 else 0)
+    if wrap == 0:
+        aval = numpy.abs(arr[numpy.isfinite(arr)]/scale)
+        w, = numpy.where(aval*3600.0*10**ndigits <= _sexagesimal_max)
+        amax = aval[w].max() if w.size > 0 else 0.0
+        width += max(0, len('%d' % int(amax + 1)) - ndeg)
+
+    out = numpy.zeros(arr.shape, dtype='S%d' % width)
+    if have_ccoords:
+        _coords.format_sexagesimal(arr, scale, wrap, ndigits,
+                                   1 if dosign else 0, ndeg, str(sep), out)
+    else:
+        outf = out.reshape(out.size)
+        for i,val in enumerate(arr.ravel()):
+            outf[i] = _sexagesimal_format_one(val, scale, wrap, ndigits,
+                                              dosign, ndeg, sep)
+
+    if isscalar:
+        return out[0]
+    return out
+
+def _sexagesimal_format_one(val, scale, wrap, ndigits, dosign, ndeg, sep):
+    """
+    format a single value; see _coords.format_sexagesimal
+    """
+    if not numpy.isfinite(val):
+        return ''
+
+    fac = 10**ndigits
+    nwrap = _round_half_up(wrap*3600.0*fac)
+    if nwrap > 0:
+        # reduce before dividing by the scale, which can be inexact
+        val = numpy.fmod(val, wrap*scale)
+        if val < 0:
+            val += wrap*scale
+    val = val/scale
+    if abs(val)*3600.0*fac > _sexagesimal_max:
+        return ''
+
+    total = _round_half_up(abs(val)*3600.0*fac)
+    if nwrap > 0:
+        # rounding can reach the wrap
+        total = total % nwrap
+
+    sec = total % (60*fac)
+    total //= 60*fac
+    mins = total % 60
+    deg = total//60
+
+    if dosign:
+        if val < 0 and (deg > 0 or mins > 0 or sec > 0):
+            sign = '-'
+        else:
+            sign = '+'
+    elif val < 0 and nwrap == 0:
+        sign = '-'
+    else:
+        sign = ''
+
+    res = '%s%0*d%s%02d%s%02d' % (sign, ndeg, deg, sep, mins, sep, sec//fac)
+    if ndigits > 0:
+        res += '.%0*d' % (ndigits, sec % fac)
+    return res
+
+def _round_half_up(x):
+    """
+    round a non-negative number to an int, with halves rounded up as by
+    llround in the compiled code
+    """
+    r = math.floor(x)
+    if x - r >= 0.5:
+        r += 1
+    return int(r)
 
 
 def fitsheader2dict(hdr, ext=0):
@@ -1094,12 +1402,66 @@ def randsphere(num, ra_range=None, dec_range=None, system='eq'):
         ra,dec = randsphere(2000, ra_range=[10,35], dec_range=[-25,15])
         x,y,z = randsphere(2000, system='xyz')
 
+    See randsphere_chunks to generate more points than fit into memory.
+    """
+
+    return _randsphere(numpy.random, num, ra_range=ra_range,
+                       dec_range=dec_range, system=system)
+
+def randsphere_chunks(num, chunksize=1000000, seed=None, chunks=None,
+                      ra_range=None, dec_range=None, system='eq'):
+    """
+    Generate random points on the sphere in chunks, for samples that do not
+    fit into memory.
+
+    Each chunk has its own random number generator, seeded from the seed and
+    the chunk number, so any chunk can be regenerated on its own.  This
+    allows chunks to be generated in separate processes by sending the
+    same num, chunksize and seed with different chunks=
+
+    parameters
+    ----------
+    num: integer 
+        The total number of randoms to generate
+    chunksize: integer, optional
+        The number of randoms in each chunk; the last may be smaller.
+        Default 1000000
+    seed: integer, optional
+        The seed for the sample.  If not sent one is drawn from numpy.random
+    chunks: sequence, optional
+        The chunk numbers to generate, default all.
+    ra_range, dec_range, system:
+        See randsphere
+
+    yields
+    ------
+        ra,dec or x,y,z for each chunk, as for randsphere
+
+    examples
+    --------
+        for ra,dec in randsphere_chunks(10**10, seed=35):
+            ...
+
+        # the second of four processes
+        nchunk = get_nchunks(10**10, 1000000)
+        chunks = range(1, nchunk, 4)
+        for ra,dec in randsphere_chunks(10**10, seed=35, chunks=chunks):
+            ...
+    """
+
+    for rng, n in _iter_rand_chunks(num, chunksize, seed, chunks):
+        yield _randsphere(rng, n, ra_range=ra_range, dec_range=dec_range,
+                          system=system)
+
+def _randsphere(rng, num, ra_range=None, dec_range=None, system='eq'):
+    """
+    random points on the sphere using the random_sample method of rng
     """
 
     ra_range = _check_range(ra_range, [0.0,360.0])
     dec_range = _check_range(dec_range, [-90.0,90.0])
 
-    ra = numpy.random.random(num)
+    ra = rng.random_sample(num)
     ra *= (ra_range[1]-ra_range[0])
     if ra_range[0] > 0:
         ra += ra_range[0]
@@ -1107,7 +1469,7 @@ def randsphere(num, ra_range=None, dec_range=None, system='eq'):
     # number [-1,1)
     cosdec_min = cos(deg2rad(90.0+dec_range[0]))
     cosdec_max = cos(deg2rad(90.0+dec_range[1]))
-    v = numpy.random.random(num)
+    v = rng.random_sample(num)
     v *= (cosdec_max-cosdec_min)
     v += cosdec_min
 
@@ -1143,16 +1505,55 @@ def randcap(nrand, ra, dec, rad, get_radius=False):
 
     get_radius: bool, optional
         if true, return radius of each point in radians
+
+    See randcap_chunks to generate more points than fit into memory.
+    """
+
+    return _randcap(numpy.random, nrand, ra, dec, rad, get_radius=get_radius)
+
+def randcap_chunks(nrand, ra, dec, rad, chunksize=1000000, seed=None,
+                   chunks=None, get_radius=False):
+    """
+    Generate random points in a spherical cap in chunks, for samples that do
+    not fit into memory.
+
+    The chunks are seeded independently, see randsphere_chunks for details.
+
+    parameters
+    ----------
+    nrand:
+        The total number of random points
+    ra,dec,rad,get_radius:
+        See randcap
+    chunksize: integer, optional
+        The number of randoms in each chunk; the last may be smaller.
+        Default 1000000
+    seed: integer, optional
+        The seed for the sample.  If not sent one is drawn from numpy.random
+    chunks: sequence, optional
+        The chunk numbers to generate, default all.
+
+    yields
+    ------
+        ra,dec or ra,dec,radius for each chunk, as for randcap
+    """
+
+    for rng, n in _iter_rand_chunks(nrand, chunksize, seed, chunks):
+        yield _randcap(rng, n, ra, dec, rad, get_radius=get_radius)
+
+def _randcap(rng, nrand, ra, dec, rad, get_radius=False):
+    """
+    random points in a cap using the random_sample method of rng
     """
     # generate uniformly in r**2
-    rand_r = numpy.random.random(nrand)
+    rand_r = rng.random_sample(nrand)
     rand_r = sqrt(rand_r)*rad
 
     # put in degrees
     numpy.deg2rad(rand_r,rand_r)
 
     # generate position angle uniformly 0,2*PI
-    rand_posangle = numpy.random.random(nrand)*2*PI
+    rand_posangle = rng.random_sample(nrand)*2*PI
 
     theta = numpy.array(dec, dtype='f8',ndmin=1,copy=True)
     phi = numpy.array(ra,dtype='f8',ndmin=1,copy=True)
@@ -1197,6 +1598,271 @@ def randcap(nrand, ra, dec, rad, get_radius=False):
         return rand_ra, rand_dec
 
 
+def randsphere_mask(num, htmids=None, polygon=None, seed=None, system='eq'):
+    """
+    Generate random points uniformly within a set of HTM triangles or a
+    convex polygon on the sphere.
+
+    The triangles are chosen with probability proportional to their area,
+    and the points are placed uniformly within them using the method of
+    Arvo (1995), so no points are rejected.
+
+    parameters
+    ----------
+    num: integer
+        The number of randoms to generate
+    htmids: array, optional
+        HTM ids of the triangles, for example from HTM.intersect or
+        HTM.lookup_id.  They may be at different depths, but should not
+        overlap.
+    polygon: tuple, optional
+        Tuple (ra, dec) of arrays with the vertices of a convex polygon in
+        degrees, in order around the polygon.
+    seed: integer, optional
+        A seed for the random number generator.  If not sent numpy.random
+        is used.
+    system: string
+        Default is 'eq' for the ra-dec system.  Can also be 'xyz'.
+
+    output
+    ------
+        ra,dec or x,y,z as for randsphere
+
+    examples
+    --------
+        h = esutil.htm.HTM(10)
+        ids = h.intersect(200.0, 15.0, 2.0, inclusive=False)
+        ra,dec = randsphere_mask(100000, htmids=ids)
+
+        ra,dec = randsphere_mask(100000, polygon=([10,20,20,10],[0,0,5,5]))
+
+    Use randsphere_mask_chunks for samples that do not fit into memory.
+    """
+
+    if seed is None:
+        rng = numpy.random
+    else:
+        rng = numpy.random.RandomState(seed)
+
+    tri = _get_mask_triangles(htmids, polygon)
+    return _rand_triangles(rng, num, tri, system=system)
+
+def randsphere_mask_chunks(num, htmids=None, polygon=None, chunksize=1000000,
+                           seed=None, chunks=None, system='eq'):
+    """
+    Generate random points within a set of HTM triangles or a convex polygon
+    in chunks, for samples that do not fit into memory.
+
+    The chunks are seeded independently, see randsphere_chunks for details,
+    and the mask is described in randsphere_mask
+
+    yields
+    ------
+        ra,dec or x,y,z for each chunk, as for randsphere
+    """
+
+    tri = _get_mask_triangles(htmids, polygon)
+    for rng, n in _iter_rand_chunks(num, chunksize, seed, chunks):
+        yield _rand_triangles(rng, n, tri, system=system)
+
+def get_nchunks(num, chunksize):
+    """
+    The number of chunks used to generate num points in chunks of size
+    chunksize with the *_chunks generators
+    """
+    return (num + chunksize - 1)//chunksize
+
+def _iter_rand_chunks(num, chunksize, seed, chunks):
+    """
+    yield a random number generator and the number of points for each chunk
+    """
+
+    num = int(num)
+    chunksize = int(chunksize)
+    if chunksize < 1:
+        raise ValueError("chunksize must be >= 1, got %s" % chunksize)
+
+    if seed is None:
+        seed = numpy.random.randint(0, 2**31-1)
+
+    nchunk = get_nchunks(num, chunksize)
+    if chunks is None:
+        chunks = xrange(nchunk)
+
+    for ichunk in chunks:
+        if ichunk < 0 or ichunk >= nchunk:
+            raise ValueError("chunk %s out of range [0,%s)" % (ichunk,nchunk))
+
+        rng = numpy.random.RandomState([int(seed), int(ichunk)])
+        n = min(chunksize, num - ichunk*chunksize)
+        yield rng, n
+
+def _get_mask_triangles(htmids, polygon):
+    """
+    get the triangle vertices as unit vectors, and the cumulative areas
+    """
+
+    if (htmids is None) == (polygon is None):
+        raise ValueError("send one of htmids= or polygon=")
+
+    if htmids is not None:
+        v0, v1, v2 = _htm_vertices(htmids)
+    else:
+        ra = numpy.array(polygon[0], ndmin=1, dtype='f8')
+        dec = numpy.array(polygon[1], ndmin=1, dtype='f8')
+        if ra.size != dec.size or ra.size < 3:
+            raise ValueError("polygon must have at least 3 vertices "
+                             "with the same number of ra and dec")
+        vert = _radec2vec(ra, dec)
+
+        # fan of triangles from the first vertex
+        nv = ra.size
+        v0 = vert[numpy.zeros(nv-2, dtype='i8')]
+        v1 = vert[1:nv-1]
+        v2 = vert[2:nv]
+
+    # Van Oosterom and Strackee for the area, accurate for small triangles
+    det = numpy.abs( (v0*numpy.cross(v1,v2)).sum(axis=1) )
+    denom = ( 1.0 + (v0*v1).sum(axis=1) + (v1*v2).sum(axis=1)
+             + (v2*v0).sum(axis=1) )
+    area = 2.0*arctan2(det, denom)
+
+    cumarea = area.cumsum()
+    if cumarea.size == 0 or cumarea[-1] <= 0:
+        raise ValueError("the mask has no area")
+
+    return v0, v1, v2, area, cumarea
+
+def _rand_triangles(rng, num, tri, system='eq'):
+    """
+    random points in spherical triangles, using the construction of Arvo
+    1995, "Stratified sampling of spherical triangles"
+    """
+
+    v0, v1, v2, area, cumarea = tri
+
+    # choose the triangles weighted by area
+    r = rng.random_sample(num)*cumarea[-1]
+    itri = cumarea.searchsorted(r, side='right')
+    itri.clip(0, cumarea.size-1, itri)
+
+    A = v0[itri]
+    B = v1[itri]
+    C = v2[itri]
+
+    # choose the point Chat along the edge from A to C for which the
+    # triangle A,B,Chat has a uniform random fraction of the area.  With
+    # Chat = cos(t) A + sin(t) Cperp, the Van Oosterom and Strackee formula
+    # for the area gives tan(t/2) directly, which stays accurate for small
+    # triangles where Arvo's expression for cos(t) does not
+    Cperp = _vec_ortho(C, A)
+    D = numpy.abs( (A*numpy.cross(B,Cperp)).sum(axis=1) )
+    T = numpy.tan(0.5*rng.random_sample(num)*area[itri])
+    t = 2.0*numpy.arctan( T*(1.0 + (A*B).sum(axis=1))
+                         /(D - T*(B*Cperp).sum(axis=1)) )
+
+    Chat = cos(t)[:,numpy.newaxis]*A + sin(t)[:,numpy.newaxis]*Cperp
+    C = Cperp = None
+
+    # choose the point on the arc from B to Chat, uniform in 1-cos(theta);
+    # 1-cos is calculated from the chord length for accuracy
+    chord2 = ((B-Chat)**2).sum(axis=1)
+    theta = 2.0*arcsin( sqrt(rng.random_sample(num)*chord2/4.0).clip(0.0,1.0) )
+    P = cos(theta)[:,numpy.newaxis]*B \
+        + sin(theta)[:,numpy.newaxis]*_vec_ortho(Chat, B)
+
+    ra = rad2deg(arctan2(P[:,1], P[:,0]))
+    ra %= 360.0
+    dec = rad2deg(arcsin(P[:,2].clip(-1.0,1.0)))
+
+    if system == 'xyz':
+        x,y,z = eq2xyz(ra, dec)
+        return x,y,z
+    else:
+        return ra, dec
+
+def _vec_ortho(v, a):
+    """
+    unit vector along the component of v orthogonal to a
+    """
+    o = v - (v*a).sum(axis=1)[:,numpy.newaxis]*a
+    norm = sqrt( (o**2).sum(axis=1) )
+    norm[norm == 0] = 1.0
+    o /= norm[:,numpy.newaxis]
+    return o
+
+def _radec2vec(ra, dec):
+    """
+    unit vectors for ra,dec in degrees, in the convention used by HTM
+    """
+    ra = deg2rad(ra)
+    dec = deg2rad(dec)
+    cdec = cos(dec)
+    return numpy.column_stack( (cdec*cos(ra), cdec*sin(ra), sin(dec)) )
+
+def _htm_vertices(htmids):
+    """
+    the vertices of HTM triangles as unit vectors, following the
+    subdivision in SpatialIndex
+    """
+
+    ids = numpy.array(htmids, ndmin=1, dtype='i8')
+    if ids.size == 0:
+        raise ValueError("no htm ids sent")
+    if ids.min() < 8:
+        raise ValueError("htm ids must be >= 8")
+
+    # the root id is in the top 4 bits, followed by 2 bits per level
+    nbits = numpy.zeros(ids.size, dtype='i8')
+    tmp = ids.copy()
+    while (tmp > 0).any():
+        nbits += (tmp > 0)
+        tmp >>= 1
+    if ((nbits % 2) != 0).any():
+        raise ValueError("invalid htm ids")
+    depth = (nbits-4)//2
+
+    roots = numpy.array(_htm_roots, dtype='i8')
+    root = ids >> (2*depth)
+    v0 = _htm_octahedron[roots[root-8,0]]
+    v1 = _htm_octahedron[roots[root-8,1]]
+    v2 = _htm_octahedron[roots[root-8,2]]
+
+    for level in xrange(1, depth.max()+1):
+        w, = numpy.where(depth >= level)
+        child = (ids[w] >> (2*(depth[w]-level))) & 3
+
+        a0 = v0[w]
+        a1 = v1[w]
+        a2 = v2[w]
+        w0 = _vec_normalize(a1+a2)
+        w1 = _vec_normalize(a0+a2)
+        w2 = _vec_normalize(a1+a0)
+
+        c = child[:,numpy.newaxis]
+        v0[w] = numpy.where(c == 0, a0, numpy.where(c == 1, a1,
+                            numpy.where(c == 2, a2, w0)))
+        v1[w] = numpy.where(c == 0, w2, numpy.where(c == 1, w0, w1))
+        v2[w] = numpy.where(c == 0, w1, numpy.where(c == 1, w2,
+                            numpy.where(c == 2, w0, w2)))
+
+    return v0, v1, v2
+
+def _vec_normalize(v):
+    return v/sqrt( (v**2).sum(axis=1) )[:,numpy.newaxis]
+
+# the vertices of the HTM octahedron, and the vertex numbers of the root
+# triangles S0-S3, N0-N3 with ids 8-15
+_htm_octahedron = numpy.array([[ 0.0,  0.0,  1.0],
+                               [ 1.0,  0.0,  0.0],
+                               [ 0.0,  1.0,  0.0],
+                               [-1.0,  0.0,  0.0],
+                               [ 0.0, -1.0,  0.0],
+                               [ 0.0,  0.0, -1.0]])
+_htm_roots = [[1,5,2], [2,5,3], [3,5,4], [4,5,1],
+              [1,0,4], [4,0,3], [3,0,2], [2,0,1]]
+
+
 def rect_area(lon_min, lon_max, lat_min, lat_max):
     """
     Calculate the area of a rectangle on the sphere.
@@ -1210,3 +1876,14 @@ def rect_area(lon_min, lon_max, lat_min, lat_max):
     smin = sin(deg2rad(lat_min))
     area = (smax-smin)*(lon_max-lon_min)
     return numpy.abs(area)*R2D
+
+
+# rotation from equatorial to corrected SDSS survey coordinates: the
+# longitude is measured from the node, the vector is turned so that lambda
+# is the latitude, and eta is measured from the survey pole
+_sdsspar['rot'] = numpy.dot(_rotz(-_sdsspar['etapole']),
+                            numpy.dot([[ 0.0, 1.0, 0.0],
+                                       [ 0.0, 0.0, 1.0],
+                                       [-1.0, 0.0, 0.0]],
+                                      _rotz(-_sdsspar['node'])))
+_sdsspar['rotinv'] = numpy.ascontiguousarray(_sdsspar['rot'].T)
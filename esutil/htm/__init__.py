@@ -48,6 +48,10 @@ Methods:
         look up all triangles that are contained within or intersect a circle
         centered on the input point.
 
+    intersect_many(ra, dec, radius, inclusive=True, getfull=False):
+        the same as intersect() for arrays of circles, with the results
+        packed into a single array.
+
     area():
         Return the mean area of triangles at the current depth. The units
         are square degrees.
@@ -91,6 +95,12 @@ methods
 
 get_depth(): get the depth of the HTM tree
 match(): match against a set of ra,dec points
+match_iter(): match against a set of ra,dec points, yielding the pairs
+    in chunks
+knn(): find the k nearest neighbors of a set of ra,dec points
+save(): save the points and index to a file
+load(): load a Matcher from a file written by save(), optionally memory
+    mapped
 
 """
 
@@ -63,6 +63,62 @@ class HTM(htmc.HTMC):
 
         return super(HTM,self).intersect(ra, dec, radius, inc)
 
+    def intersect_many(self, ra, dec, radius, inclusive=True, getfull=False):
+        """
+        look up the triangles that are contained within or intersect each of
+        a set of circles
+
+        This is equivalent to calling intersect() for each circle, but the
+        loop is done in C and the results are packed into a single array
+        in compressed sparse row form.
+
+        parameters
+        ----------
+        ra: scalar or array
+            RA of the central points in degrees
+        dec: scalar or array
+            DEC of the central points in degrees
+        radius: scalar or array
+            radius of the circles in degrees, a scalar or the same size as
+            ra,dec
+        inclusive: bool, optional
+            If False, only include triangles fully enclosed within the circle.
+            If True, include those that intersect as well.  Default True.
+        getfull: bool, optional
+            If True, also return a boolean array that is True for the
+            triangles fully enclosed within the circle.
+
+        returns
+        -------
+        ids, offsets or ids, offsets, full if getfull is True
+
+        The triangles for circle i are ids[offsets[i]:offsets[i+1]].
+        """
+
+        ra=numpy.array(ra, dtype='f8', ndmin=1, copy=False)
+        dec=numpy.array(dec, dtype='f8', ndmin=1, copy=False)
+        radius=numpy.array(radius, dtype='f8', ndmin=1, copy=False)
+
+        if ra.size != dec.size:
+            raise ValueError("ra size (%d) != "
+                             "dec size (%d)" % (ra.size, dec.size))
+
+        if radius.size != 1 and radius.size != ra.size:
+            raise ValueError("radius size (%d) != 1 and"
+                             " != ra,dec size (%d)" % (radius.size,ra.size))
+
+        if inclusive:
+            inc=1
+        else:
+            inc=0
+
+        ids, offsets, full = super(HTM,self).intersect_many(ra, dec, radius,
+                                                            inc)
+        if getfull:
+            return ids, offsets, full.astype('bool')
+        else:
+            return ids, offsets
+
     def match(self, ra1, dec1, ra2, dec2, radius,
               maxmatch=1, 
               htmid2=None, 
@@ -70,7 +126,9 @@ class HTM(htmc.HTMC):
               minid=None,
               maxid=None,
               file=None,
-              verbose=False):
+              verbose=False,
+              nthreads=1,
+              file_type='text'):
         """
         Match two sets of ra/dec points using the Hierarchical Triangular
         Mesh code.
@@ -108,10 +166,20 @@ class HTM(htmc.HTMC):
             The file is in text format of the form
                 i1 i2 d12
             Where i1,i2 are the match indices and d12 is the distance between
-            them in degrees
+            them in degrees.  See file_type= for a binary alternative.
 
             The file can be read using the read() method.
 
+        nthreads: int, optional
+            Number of threads to use for the matching, default 1.  The
+            result does not depend on the number of threads.  Ignored for
+            the deprecated htmrev2 method.
+
+        file_type: string, optional
+            The format of the file, 'text' (the default) or 'sfile', a
+            binary sfile with fields 'i1','i2','d12' that is much faster to
+            read and can be memory mapped.  Only for the Matcher method.
+
         returns
         -------
             m1,m2,d12: 
@@ -189,7 +257,9 @@ class HTM(htmc.HTMC):
                                  dec1,
                                  radius,
                                  maxmatch=maxmatch,
-                                 file=file)
+                                 file=file,
+                                 nthreads=nthreads,
+                                 file_type=file_type)
 
         else:
             # deprecated way
@@ -445,7 +515,7 @@ class HTM(htmc.HTMC):
         return(matchindex, angdist, zdist)
     
 
-    def read(self, filename, verbose=False):
+    def read(self, filename, memmap=False, verbose=False):
         """
         read pair info from a file written by match()
 
@@ -453,6 +523,9 @@ class HTM(htmc.HTMC):
         ----------
         filename: string
             the file name
+        memmap: bool, optional
+            return a memory map rather than reading the data.  Only for
+            files written with file_type='sfile'
         verbose: bool, optional
             print some info
 
@@ -469,7 +542,7 @@ class HTM(htmc.HTMC):
             match() program when no file is sent.
         """
 
-        return read_pairs(filename, verbose=verbose)
+        return read_pairs(filename, memmap=memmap, verbose=verbose)
 
     def bincount(self,
                  rmin, rmax, nbin, ra1, dec1, ra2, dec2, scale=None,
@@ -477,7 +550,13 @@ class HTM(htmc.HTMC):
                  htmrev2=None,
                  minid=None,
                  maxid=None,
-                 getbins=True):
+                 getbins=True,
+                 weights1=None,
+                 weights2=None,
+                 z1=None,
+                 z2=None,
+                 dz=None,
+                 nthreads=1):
         """
         Class:
             HTM
@@ -508,7 +587,13 @@ class HTM(htmc.HTMC):
                  htmrev2=None,
                  minid=None,
                  maxid=None,
-                 getbins=True)
+                 getbins=True,
+                 weights1=None,
+                 weights2=None,
+                 z1=None,
+                 z2=None,
+                 dz=None,
+                 nthreads=1)
 
         Inputs:
             rmin,rmax: Smallest and largest separations to consider.  This
@@ -532,6 +617,18 @@ class HTM(htmc.HTMC):
                 where angle is in *radians*, as opposed to degrees when scale
                 is not sent.
 
+            weights1=None, weights2=None:
+                Weights for the points in lists 1 and 2.  Each pair is
+                weighted by weights1*weights2, and the returned counts are
+                the sums of the pair weights.
+
+            z1=None, z2=None, dz=None:
+                Redshifts for the points in lists 1 and 2.  Only pairs with
+                |z1-z2| <= dz are counted.
+
+            nthreads=1:
+                The number of threads to use.
+
             htmid2=None: 
                 the htm indexes for the second list.  If not sent they are
                 generated internally.  You can generate these with 
@@ -550,6 +647,10 @@ class HTM(htmc.HTMC):
                 can save time on successive calls by generating these your
                 self.
 
+                htmid2 and htmrev2 are deprecated and not supported with
+                weights, redshifts or threads; if neither is sent an
+                htm.Matcher is used internally.
+
             getbins: 
                 If True, return a tuple 
                     rlower,rupper,counts 
@@ -613,6 +714,25 @@ class HTM(htmc.HTMC):
         """
 
 
+        if htmid2 is None and htmrev2 is None:
+            # new way using a Matcher
+            matcher=Matcher(self.get_depth(), ra2, dec2)
+            return matcher.bincount(rmin, rmax, nbin, ra1, dec1,
+                                    scale=scale,
+                                    weights1=weights1,
+                                    weights2=weights2,
+                                    z1=z1,
+                                    z2=z2,
+                                    dz=dz,
+                                    nthreads=nthreads,
+                                    getbins=getbins)
+
+        # deprecated way
+        if (weights1 is not None or weights2 is not None
+                or z1 is not None or z2 is not None or nthreads != 1):
+            raise ValueError("weights, redshifts and threads are not "
+                             "supported with htmid2/htmrev2")
+
         if htmid2 is None:
             stdout.write("Generating HTM ids\n")
             htmid2 = self.lookup_id(ra2, dec2)
@@ -661,7 +781,7 @@ class Matcher(htmc.Matcher):
             raise ValueError("ra size (%d) != "
                              "dec size (%d)" % (ra.size, dec.size))
 
-        super(Matcher, self).__init__(depth, ra, dec)
+        super(Matcher, self).__init__(depth, ra, dec, None, None, None)
 
     def get_depth(self):
         """
@@ -670,7 +790,8 @@ class Matcher(htmc.Matcher):
         return super(Matcher,self).get_depth()
     depth=get_depth
 
-    def match(self, ra, dec, radius, maxmatch=1, file=None):
+    def match(self, ra, dec, radius, maxmatch=1, file=None, nthreads=1,
+              file_type='text'):
         """
         match to the input set of ra,dec points
 
@@ -687,12 +808,21 @@ class Matcher(htmc.Matcher):
         file: string, optional
             If sent, write pairs to the file instead of returning the pair
             data.  This can use much less memory for large match sets.
-            The file is in text format of the form
-                i1 i2 d12
-            Where i1,i2 are the match indices and d12 is the distance between
-            them in degrees
+            See file_type= for the format.
 
             The file can be read using the read() method.
+        nthreads: int, optional
+            Number of threads to use, default 1.  The input points are split
+            among the threads; the result is identical to that from a single
+            thread.
+        file_type: string, optional
+            The format of the file, either 'text' or 'sfile'.  Default is
+            'text', of the form
+                i1 i2 d12
+            Where i1,i2 are the match indices and d12 is the distance between
+            them in degrees.  'sfile' is a binary sfile holding a structured
+            array with fields 'i1','i2','d12'.  It is much smaller and faster
+            to read, and can be memory mapped.
 
         returns
         -------
@@ -708,6 +838,98 @@ class Matcher(htmc.Matcher):
         if file= is sent then then number of matches is returned.
         """
 
+        ra, dec, radius, nthreads = \
+                self._prepare_match_input(ra, dec, radius, nthreads)
+
+        if file_type not in _pair_file_types:
+            raise ValueError("file_type must be one "
+                             "of %s, got '%s'" % (_pair_file_types,file_type))
+
+        file=check_filename(file)
+        if file is not None and file_type == 'sfile':
+            return self._match_sfile(ra, dec, radius, maxmatch, file, nthreads)
+
+        return super(Matcher, self).match(ra, dec, radius, maxmatch, file,
+                                          nthreads)
+
+    def match_iter(self, ra, dec, radius, maxmatch=1, chunksize=100000,
+                   nthreads=1):
+        """
+        match to the input set of ra,dec points, yielding the pairs in chunks
+
+        This is a generator, useful when the full set of pairs would not fit
+        into memory.  The results are identical to those of match(), split
+        into pieces.
+
+        parameters
+        ----------
+        ra, dec, radius, maxmatch, nthreads:
+            See the match() method
+        chunksize: int, optional
+            The number of input ra,dec points to match for each chunk,
+            default 100000
+
+        yields
+        ------
+        A tuple (m1, m2, d) for each chunk of input points, as returned by
+        match().  m1 are indices into the full ra,dec arrays.
+        """
+
+        ra, dec, radius, nthreads = \
+                self._prepare_match_input(ra, dec, radius, nthreads)
+
+        chunksize=int(chunksize)
+        if chunksize < 1:
+            raise ValueError("chunksize must be >= 1, got %d" % chunksize)
+
+        for start in xrange(0, ra.size, chunksize):
+            stop=start+chunksize
+
+            if radius.size == 1:
+                this_radius=radius
+            else:
+                this_radius=radius[start:stop]
+
+            m1,m2,d12 = super(Matcher, self).match(ra[start:stop],
+                                                   dec[start:stop],
+                                                   this_radius,
+                                                   maxmatch,
+                                                   None,
+                                                   nthreads)
+            m1 += start
+            yield m1, m2, d12
+
+    def _match_sfile(self, ra, dec, radius, maxmatch, file, nthreads):
+        """
+        match and write the pairs to a binary sfile in chunks
+        """
+        from esutil.sfile import SFile
+
+        npairs=0
+        with SFile(file, mode='w+') as sfout:
+            # always write a header, even if there are no matches
+            sfout.write(numpy.zeros(0, dtype=_pair_dtype))
+
+            for m1,m2,d12 in self.match_iter(ra, dec, radius,
+                                             maxmatch=maxmatch,
+                                             nthreads=nthreads):
+                if m1.size == 0:
+                    continue
+
+                pairs=numpy.zeros(m1.size, dtype=_pair_dtype)
+                pairs['i1'] = m1
+                pairs['i2'] = m2
+                pairs['d12'] = d12
+                sfout.write(pairs)
+
+                npairs += pairs.size
+
+        return npairs
+
+    def _prepare_match_input(self, ra, dec, radius, nthreads):
+        """
+        convert and check the inputs to match()
+        """
         ra=numpy.array(ra, dtype='f8', ndmin=1, copy=False)
         dec=numpy.array(dec, dtype='f8', ndmin=1, copy=False)
         radius=numpy.array(radius, dtype='f8', ndmin=1, copy=False)
@@ -720,17 +942,272 @@ class Matcher(htmc.Matcher):
             raise ValueError("radius size (%d) != 1 and"
                              " != ra,dec size (%d)" % (radius.size,ra.size))
 
-        file=check_filename(file)
-        return super(Matcher, self).match(ra, dec, radius, maxmatch, file)
+        nthreads=int(nthreads)
+        if nthreads < 1:
+            raise ValueError("nthreads must be >= 1, got %d" % nthreads)
+
+        return ra, dec, radius, nthreads
+
+    def knn(self, ra, dec, k, max_radius=None, nthreads=1):
+        """
+        find the k nearest neighbors of each input point
+
+        The search radius is grown outward until k neighbors are found, so
+        no radius need be guessed in advance.
 
-def read_pairs(filename, verbose=False):
+        parameters
+        ----------
+        ra: scalar or array
+            right ascension in degrees
+        dec: scalar or array
+            declination in degrees
+        k: int
+            The number of neighbors to find for each point
+        max_radius: float, optional
+            Only look for neighbors within this radius in degrees.  Default
+            is no limit.
+        nthreads: int, optional
+            Number of threads to use, default 1.
+
+        returns
+        -------
+        A tuple (ind, dist), each with shape (n, k)
+            ind:
+                The indices of the neighbors in the internal ra,dec of
+                the Matcher object, ordered by distance.
+            dist:
+                Distance to the neighbors in degrees
+
+        If fewer than k neighbors are found for a point, the remaining
+        entries are -1 for ind and inf for dist.
+        """
+
+        ra=numpy.array(ra, dtype='f8', ndmin=1, copy=False)
+        dec=numpy.array(dec, dtype='f8', ndmin=1, copy=False)
+
+        if ra.size != dec.size:
+            raise ValueError("ra size (%d) != "
+                             "dec size (%d)" % (ra.size, dec.size))
+
+        k=int(k)
+        if k < 1:
+            raise ValueError("k must be >= 1, got %d" % k)
+
+        if max_radius is None:
+            max_radius=180.0
+        max_radius=float(max_radius)
+        if max_radius <= 0:
+            raise ValueError("max_radius must be > 0, got %g" % max_radius)
+
+        nthreads=int(nthreads)
+        if nthreads < 1:
+            raise ValueError("nthreads must be >= 1, got %d" % nthreads)
+
+        ind, dist = super(Matcher, self).knn(ra, dec, k, max_radius, nthreads)
+        return ind.reshape(ra.size, k), dist.reshape(ra.size, k)
+
+    def bincount(self, rmin, rmax, nbin, ra, dec, scale=None,
+                 weights1=None, weights2=None,
+                 z1=None, z2=None, dz=None,
+                 nthreads=1, getbins=True):
+        """
+        Count pairs between the input ra,dec and the points in the Matcher as
+        a function of their separation.  The binning is equally spaced in the
+        log10 of the separation.  By default the bins are in degrees, unless
+        scale= is sent, in which case the units are angle*scale with angle in
+        radians.
+
+        parameters
+        ----------
+        rmin,rmax: float
+            Smallest and largest separations to consider.
+        nbin: int
+            The number of bins.
+        ra,dec: scalar or array
+            The points to count around, in degrees
+        scale: scalar or array, optional
+            A scale to apply to the angular separations, a scalar or the
+            same size as ra,dec.  For example the angular diameter distance
+            to the objects in ra,dec.
+        weights1: array, optional
+            Weights for the input points.  Each pair is weighted by
+            weights1*weights2.  Must be sent with weights2.
+        weights2: array, optional
+            Weights for the points in the Matcher.
+        z1,z2: array, optional
+            Redshifts for the input points and the points in the Matcher.
+            Only pairs with |z1-z2| <= dz are counted.  Must be sent
+            together with dz.
+        dz: float, optional
+            The redshift window.
+        nthreads: int, optional
+            Number of threads to use, default 1.  Each thread keeps its own
+            histogram, and these are summed at the end.
+        getbins: bool, optional
+            If True, return a tuple rlower,rupper,counts.  Default True.
+
+        returns
+        -------
+        if getbins=True:
+            rlower,rupper,counts: rlower,rupper are the lower and upper
+            limits of each bin.
+        if getbins=False:
+            counts: The pair counts in each bin.
+
+        If weights are sent the counts are the sum of the pair weights.
+        """
+
+        ra=numpy.array(ra, dtype='f8', ndmin=1, copy=False)
+        dec=numpy.array(dec, dtype='f8', ndmin=1, copy=False)
+
+        if ra.size != dec.size:
+            raise ValueError("ra size (%d) != "
+                             "dec size (%d)" % (ra.size, dec.size))
+
+        npoints = self.get_arrays()[0].size
+
+        if scale is not None:
+            scale=numpy.array(scale, dtype='f8', ndmin=1, copy=False)
+            if scale.size != 1 and scale.size != ra.size:
+                raise ValueError("scale size (%d) != 1 and"
+                                 " != ra,dec size (%d)" % (scale.size,ra.size))
+
+        if (weights1 is None) != (weights2 is None):
+            raise ValueError("send both weights1 and weights2 or neither")
+        if weights1 is not None:
+            weights1=_get_point_data(weights1, ra.size, 'weights1')
+            weights2=_get_point_data(weights2, npoints, 'weights2')
+
+        if (z1 is None) != (z2 is None) or (z1 is None) != (dz is None):
+            raise ValueError("send all of z1, z2 and dz or none")
+        if z1 is not None:
+            z1=_get_point_data(z1, ra.size, 'z1')
+            z2=_get_point_data(z2, npoints, 'z2')
+            dz=float(dz)
+
+        nthreads=int(nthreads)
+        if nthreads < 1:
+            raise ValueError("nthreads must be >= 1, got %d" % nthreads)
+
+        counts, wcounts = super(Matcher,self).bincount(rmin, rmax, nbin,
+                                                       ra, dec, scale,
+                                                       weights1, weights2,
+                                                       z1, z2, dz,
+                                                       nthreads)
+        if weights1 is not None:
+            counts=wcounts
+
+        if getbins:
+            lower,upper = log_bins(rmin, rmax, nbin)
+            return lower,upper,counts
+        else:
+            return counts
+
+    def save(self, filename):
+        """
+        Save the points and the leaf index to a binary file
+
+        The file can be loaded with Matcher.load(), optionally memory
+        mapped, which avoids rebuilding the index.
+
+        parameters
+        ----------
+        filename: string
+            The file to write.  The format is a short text header followed
+            by the little-endian arrays
+                ra, dec, perm: (npoints,)
+                leafids: (nleaf,)
+                offsets: (nleaf+1,)
+        """
+
+        filename=check_filename(filename)
+
+        ra, dec, leafids, offsets, perm = self.get_arrays()
+
+        hdr=['ESUTIL_HTM_MATCHER',
+             'VERSION = %d' % _MATCHER_FILE_VERSION,
+             'DEPTH = %d' % self.get_depth(),
+             'NPOINTS = %d' % ra.size,
+             'NLEAF = %d' % leafids.size,
+             'END']
+        hdr='\n'.join(hdr)+'\n'
+
+        with open(filename,'wb') as fobj:
+            fobj.write(hdr)
+            fobj.write(' '*(_matcher_data_start(len(hdr))-len(hdr)))
+
+            for arr,dt in [(ra,'<f8'),(dec,'<f8'),(perm,'<i8'),
+                           (leafids,'<i8'),(offsets,'<i8')]:
+                numpy.array(arr, dtype=dt, copy=False).tofile(fobj)
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        """
+        Load a Matcher written by the save() method
+
+        parameters
+        ----------
+        filename: string
+            The file to read.
+        mmap: bool, optional
+            If True, memory map the arrays rather than reading them.  The
+            data are read from disk only when needed, and the pages are
+            shared between processes loading the same file.  Default True.
+
+        returns
+        -------
+        A Matcher object
+        """
+
+        filename=check_filename(filename)
+
+        with open(filename,'rb') as fobj:
+            hdr=_read_matcher_header(fobj, filename)
+            data_start=_matcher_data_start(fobj.tell())
+
+            npoints=hdr['NPOINTS']
+            nleaf=hdr['NLEAF']
+            layout=[('<f8',npoints),('<f8',npoints),('<i8',npoints),
+                    ('<i8',nleaf),('<i8',nleaf+1)]
+
+            # memmap would fail with an obscure error on a short file
+            nbytes=data_start + 8*(3*npoints + 2*nleaf + 1)
+            fobj.seek(0, 2)
+            if npoints < 0 or nleaf < 0 or fobj.tell() < nbytes:
+                raise IOError("file %s is truncated" % filename)
+
+            arrays=[]
+            offset=data_start
+            for dt,count in layout:
+                if mmap and count > 0:
+                    arr=numpy.memmap(filename, dtype=dt, mode='r',
+                                     offset=offset, shape=(count,))
+                else:
+                    fobj.seek(offset)
+                    arr=numpy.fromfile(fobj, dtype=dt, count=count)
+                    if arr.size != count:
+                        raise IOError("file %s is truncated" % filename)
+                arrays.append(arr)
+                offset += count*8
+
+        ra, dec, perm, leafids, offsets = arrays
+
+        self=cls.__new__(cls)
+        htmc.Matcher.__init__(self, hdr['DEPTH'], ra, dec,
+                              leafids, offsets, perm)
+        return self
+
+def read_pairs(filename, memmap=False, verbose=False):
     """
     Read the pair info written by the match code
 
     parameters
     -----------
     filename: string
-        filename holding the pair data
+        filename holding the pair data, either text or a binary sfile
+    memmap: bool, optional
+        If True, return a memory map of the data rather than reading it.
+        Only supported for sfile format.
     verbose: bool, optional
         print what is happening
     returns
@@ -754,17 +1231,24 @@ def read_pairs(filename, verbose=False):
         data = esutil.htm.read_pairs('some-path')
     """
 
-    import esutil as eu
+    from esutil import sfile
     from esutil.recfile import Recfile
 
-    dtype=[('i1','i8'),('i2','i8'),('d12','f8')]
-
     if verbose:
         stdout.write("Reading pairs from file: %s\n" % filename)
 
     filename=check_filename(filename)
-    with Recfile(filename, "r", dtype=dtype, delim=' ') as robj:
-        data=robj.read()
+
+    with open(filename) as fobj:
+        is_sfile = fobj.readline().startswith('SIZE')
+
+    if is_sfile:
+        data=sfile.read(filename, memmap=memmap)
+    else:
+        if memmap:
+            raise ValueError("memmap is only supported for sfile pair files")
+        with Recfile(filename, "r", dtype=_pair_dtype, delim=' ') as robj:
+            data=robj.read()
 
     if verbose:
         stdout.write("    read %d pairs\n" % data.size)
@@ -799,6 +1283,51 @@ def log_bins(rmin, rmax, nbin):
     #print 'gmean: ',gm
     return lower_edges, upper_edges
 
+_pair_dtype=[('i1','i8'),('i2','i8'),('d12','f8')]
+_pair_file_types=['text','sfile']
+
+_MATCHER_FILE_VERSION=1
+
+def _matcher_data_start(hdr_size):
+    """
+    the data in a saved Matcher start on a 64 byte boundary
+    """
+    return ((hdr_size+63)//64)*64
+
+def _read_matcher_header(fobj, filename):
+    """
+    read the header of a file written by Matcher.save()
+    """
+    line=fobj.readline()
+    if line.strip() != 'ESUTIL_HTM_MATCHER':
+        raise IOError("file %s is not a saved Matcher" % filename)
+
+    hdr={}
+    while True:
+        line=fobj.readline()
+        if line == '':
+            raise IOError("file %s has an unterminated header" % filename)
+        line=line.strip()
+        if line == 'END':
+            break
+        key,val=line.split('=')
+        hdr[key.strip()] = int(val)
+
+    if hdr.get('VERSION',None) != _MATCHER_FILE_VERSION:
+        raise IOError("unsupported Matcher file version: "
+                      "%s" % hdr.get('VERSION',None))
+    return hdr
+
+def _get_point_data(data, npoints, name):
+    """
+    get per-point data as a double array, checking the size
+    """
+    data=numpy.array(data, dtype='f8', ndmin=1, copy=False)
+    if data.size != npoints:
+        raise ValueError("%s size (%d) != number "
+                         "of points (%d)" % (name,data.size,npoints))
+    return data
+
 def check_filename(filename):
     if filename is not None:
         if isinstance(filename,unicode):
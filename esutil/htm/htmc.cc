@@ -6,6 +6,8 @@
 #include "htmc.h"
 #include "NumpyVector.h"
 #include <algorithm> // for transform
+#include <pthread.h>
+#include <limits>
 
 
 // A couple of utility functions
@@ -137,6 +139,91 @@ PyObject* HTMC::intersect(
 	return idlist_pyobj;
 }
 
+// intersect for many circles at once.  The trixels for circle i are
+// ids[offsets[i]:offsets[i+1]], full trixels first then partial ones
+// as in intersect(), and full[j] is 1 for trixels entirely within the
+// circle
+PyObject* HTMC::intersect_many(
+		PyObject* ra_array, // all in degrees
+        PyObject* dec_array,
+		PyObject* radius_array, // degrees
+        PyObject* inclusive_obj
+        ) throw (const char *) {
+
+	static const double D2R=0.0174532925199433;
+
+	NumpyVector<double> ra(ra_array);
+	NumpyVector<double> dec(dec_array);
+	NumpyVector<double> radius(radius_array);
+	NumpyVector<int64_t> inclusiveVec(inclusive_obj);
+	int64_t inclusive = inclusiveVec[0];
+
+	npy_intp num = ra.size();
+	npy_intp nrad = radius.size();
+	if (dec.size() != num) {
+		throw "ra and dec must be the same size";
+	}
+	if (nrad != 1 && nrad != num) {
+		throw "radius must be scalar or same size as ra,dec";
+	}
+
+	// This is used in the basic calculations
+	const SpatialIndex &index = mHtmInterface.index();
+
+	std::vector<int64_t> ids;
+	std::vector<npy_int8> full;
+	NumpyVector<int64_t> offsets(num+1);
+
+	// radius may be empty when there are no circles
+	double d = 0.0;
+	if (num > 0) {
+		d = cos( radius[0]*D2R );
+	}
+	for (npy_intp i=0; i<num; i++) {
+		if (nrad > 1) {
+			d = cos( radius[i]*D2R );
+		}
+
+		// Declare the domain and the lists
+		SpatialDomain domain;    // initialize empty domain
+		ValVec<uint64> plist, flist;	// List results
+
+		// Find the triangles around this point
+		domain.setRaDecD(ra[i],dec[i],d);
+		domain.intersect(&index,plist,flist);
+
+		// ----------- FULL NODES -------------
+		for(size_t j = 0; j < flist.length(); j++)
+		{  
+			ids.push_back(flist(j));
+			full.push_back(1);
+		}
+		if (inclusive) {
+			// ----------- Partial Nodes ----------
+			for(size_t j = 0; j < plist.length(); j++)
+			{  
+				ids.push_back(plist(j));
+				full.push_back(0);
+			}
+		}
+		offsets[i+1] = ids.size();
+	}
+
+	npy_intp ntot = ids.size();
+	NumpyVector<int64_t> ids_out(ntot);
+	NumpyVector<npy_int8> full_out(ntot);
+	if (ntot > 0) {
+		std::copy(ids.begin(), ids.end(), ids_out.ptr());
+		std::copy(full.begin(), full.end(), full_out.ptr());
+	}
+
+	PyObject* output_tuple = PyTuple_New(3);
+	PyTuple_SetItem(output_tuple, 0, ids_out.getref());
+	PyTuple_SetItem(output_tuple, 1, offsets.getref());
+	PyTuple_SetItem(output_tuple, 2, full_out.getref());
+	return output_tuple;
+}
+
 
 
 
@@ -561,7 +648,10 @@ PyObject* HTMC::cbincount(
 
 Matcher::Matcher(int depth,
                  PyObject* ra_input,
-                 PyObject* dec_input) throw (const char *)
+                 PyObject* dec_input,
+                 PyObject* leafids_input,
+                 PyObject* offsets_input,
+                 PyObject* perm_input) throw (const char *)
 {
     this->depth = depth;
     this->htm_interface.init(depth);
@@ -570,192 +660,525 @@ Matcher::Matcher(int depth,
 	// no copy is made if the are already double arrays
 	this->ra.init(ra_input);
 	this->dec.init(dec_input);
-    
-    init_hmap();
+
+    if (leafids_input == Py_None) {
+        init_index();
+    } else {
+        // a previously built index, e.g. memory mapped from a file.  No
+        // copies are made if they are native int64 arrays
+        leafids.init(leafids_input);
+        offsets.init(offsets_input);
+        perm.init(perm_input);
+        check_index();
+    }
 }
-void Matcher::init_hmap(void)
+
+// Make sure an index sent from outside is consistent with the points.  The
+// matching code uses raw pointers so the arrays must be contiguous
+void Matcher::check_index(void) throw (const char *)
 {
-    std::map<int64_t,std::vector<int64_t> >::iterator iter;
-    int64_t htmid=0;
-    int64_t num=ra.size();
-    for (int64_t i=0; i<num; i++) {
-        htmid = htm_interface.lookupID(ra[i], dec[i]);
-
-        iter=hmap.find(htmid);
-
-        if (iter==hmap.end()) {
-            std::vector<int64_t> v;
-            v.push_back(i);
-            hmap[htmid] = v;
-        } else {
-            iter->second.push_back(i);
+    npy_intp num=ra.size();
+    if (dec.size() != num) {
+        throw "ra and dec must be the same size";
+    }
+    if (perm.size() != num) {
+        throw "perm must be the same size as ra,dec";
+    }
+    if (offsets.size() != leafids.size()+1) {
+        throw "offsets must have size nleaf+1";
+    }
+    if ( (leafids.size() > 1 && leafids.stride() != sizeof(int64_t))
+            || (offsets.size() > 1 && offsets.stride() != sizeof(int64_t))
+            || (perm.size() > 1 && perm.stride() != sizeof(int64_t)) ) {
+        throw "leafids, offsets and perm must be contiguous";
+    }
+    if (offsets[0] != 0 || offsets[offsets.size()-1] != num) {
+        throw "offsets must start at zero and end at the number of points";
+    }
+
+    // a corrupt index would send the matching code outside the arrays
+    npy_intp nleaf=leafids.size();
+    for (npy_intp i=0; i<nleaf; i++) {
+        if (offsets[i+1] < offsets[i]) {
+            throw "offsets must not decrease";
+        }
+        if (i > 0 && leafids[i] <= leafids[i-1]) {
+            throw "leafids must be sorted and unique";
+        }
+    }
+    for (npy_intp i=0; i<num; i++) {
+        if (perm[i] < 0 || perm[i] >= num) {
+            throw "perm values must be in [0,npoints)";
         }
     }
 }
 
-PyObject* Matcher::match(
-		PyObject* ra_array, // all in degrees
-        PyObject* dec_array,
-		PyObject* radius_array, // degrees
-        PyObject* maxmatch_obj,
-        PyObject* filename_obj) throw (const char *) {
+// Get the points and the leaf index as a tuple
+//     (ra, dec, leafids, offsets, perm)
+PyObject* Matcher::get_arrays(void) throw (const char *)
+{
+    PyObject* output_tuple = PyTuple_New(5);
+    PyTuple_SetItem(output_tuple, 0, ra.getref());
+    PyTuple_SetItem(output_tuple, 1, dec.getref());
+    PyTuple_SetItem(output_tuple, 2, leafids.getref());
+    PyTuple_SetItem(output_tuple, 3, offsets.getref());
+    PyTuple_SetItem(output_tuple, 4, perm.getref());
+    return output_tuple;
+}
 
-    std::map<int64_t,std::vector<int64_t> >::iterator iter;
+// Build the leaf index.  The points are grouped by the HTM leaf they fall
+// in; leafids holds the distinct leaves in sorted order, and the points
+// in leaf leafids[i] are perm[offsets[i]] ... perm[offsets[i+1]-1], in
+// increasing order.  This is much more compact than one container per leaf.
+void Matcher::init_index(void)
+{
+    npy_intp num=ra.size();
 
-	// no copies made if already double vectors
+    // sort by leaf and then by index
+    std::vector< std::pair<int64_t,int64_t> > id_index(num);
+    for (npy_intp i=0; i<num; i++) {
+        id_index[i].first = htm_interface.lookupID(ra[i], dec[i]);
+        id_index[i].second = i;
+    }
+    std::sort(id_index.begin(), id_index.end());
 
-	NumpyVector<double> ra(ra_array);
-	NumpyVector<double> dec(dec_array);
+    npy_intp nleaf=0;
+    for (npy_intp i=0; i<num; i++) {
+        if (i == 0 || id_index[i].first != id_index[i-1].first) {
+            nleaf++;
+        }
+    }
 
-	NumpyVector<double> radius(radius_array);
-	npy_intp nrad = radius.size();
+    leafids.init(nleaf);
+    offsets.init(nleaf+1);
+    perm.init(num);
 
-	// get as NumpyVectors even though they are only length 1
-	// because it does a good job with conversions
-	NumpyVector<int64_t> maxmatchVec(maxmatch_obj);
-	int64_t maxmatch = maxmatchVec[0];
+    int64_t* leafids_ptr = leafids.ptr();
+    int64_t* offsets_ptr = offsets.ptr();
+    int64_t* perm_ptr = perm.ptr();
 
-	// These will temporarily hold the results
-	std::vector<int64_t> m1;
-	std::vector<int64_t> m2;
-	std::vector<double> d12;
+    npy_intp ileaf=0;
+    for (npy_intp i=0; i<num; i++) {
+        if (i == 0 || id_index[i].first != id_index[i-1].first) {
+            leafids_ptr[ileaf] = id_index[i].first;
+            offsets_ptr[ileaf] = i;
+            ileaf++;
+        }
+        perm_ptr[i] = id_index[i].second;
+    }
+    offsets_ptr[nleaf] = num;
+}
 
-	// total number of pairs
-	int64_t ntotal = 0;
+// Find all points in the Matcher within rad degrees of the input point,
+// appending the pairs to pair_info.  This does not use any python objects so
+// it is safe to call without holding the GIL.
+void Matcher::find_within(
+        int64_t i_input,
+        double ra_input,
+        double dec_input,
+        double rad,
+        std::vector<PAIR_INFO>& pair_info)
+{
+	static const double
+		D2R=0.0174532925199433;
 
-	FILE* fptr=NULL;
-	if (PyString_Check(filename_obj)) {
-		char* filename=PyString_AsString(filename_obj);
-		fptr = fopen(filename, "w");
-		if (fptr==NULL) 
-		{
-			std::stringstream err;
-			err<<"Cannot open file: "<<filename<<" : "<<strerror(errno);
-			throw err.str().c_str();
-		}
+	// the leaf index; see init_index
+	npy_intp nleaf = leafids.size();
+	const int64_t* leafids_ptr = leafids.ptr();
+	const int64_t* leafids_end = leafids_ptr + nleaf;
+	const int64_t* offsets_ptr = offsets.ptr();
+	const int64_t* perm_ptr = perm.ptr();
+
+	// This is used in the basic calculations
+	const SpatialIndex &index = this->htm_interface.index();
+
+	double d = cos( rad*D2R );
+
+	// Declare the domain and the lists
+	SpatialDomain domain;    // initialize empty domain
+	ValVec<uint64> plist, flist;	// List results
+
+	// Find the triangles around this point
+	domain.setRaDecD(ra_input,dec_input,d); //put in ra,dec,d E.S.S.
+	domain.intersect(&index,plist,flist);	  // intersect with list
+
+
+	// number of triangles found
+	npy_intp nfound = flist.length() + plist.length();
+	std::vector<int64_t> idlist(nfound);
+	npy_intp idcount=0;
+
+	// We could speed this up when no distance is needed by
+	// just keeping everything in the full nodes without
+	// doing a distance calculation
+
+	// ----------- FULL NODES -------------
+	for(size_t i = 0; i < flist.length(); i++)
+	{  
+		idlist[idcount] = flist(i);
+		idcount++;
+	}
+	// ----------- Partial Nodes ----------
+	for(size_t i = 0; i < plist.length(); i++)
+	{  
+		idlist[idcount] = plist(i);
+		idcount++;
 	}
 
+	for (npy_intp j=0; j<nfound; j++) {
 
+		int64_t htmid = idlist[j];
 
-	static const double
-		D2R=0.0174532925199433;
+        const int64_t* leafptr = std::lower_bound(leafids_ptr,
+                                                  leafids_end,
+                                                  htmid);
+        if (leafptr != leafids_end && *leafptr == htmid) {
 
-	// This is used in the basic calculations
-	const SpatialIndex &index = this->htm_interface.index();
+            npy_intp ileafbin = leafptr - leafids_ptr;
+            int64_t leafstart = offsets_ptr[ileafbin];
+            int64_t leafstop = offsets_ptr[ileafbin+1];
+            for (int64_t ileaf=leafstart; ileaf<leafstop; ileaf++) {
+                int64_t i_this = perm_ptr[ileaf];
 
+                // Returns distance in degrees
+                double dis = gcirc(ra_input,
+                                   dec_input,
+                                   this->ra[i_this],
+                                   this->dec[i_this],true);
 
-	double rad=0, d=0;
+                // Turns out, this pushing is not a bottleneck!
+                // Time is negligible compared to the leaf finding
+                // and the gcirc.
+                if (dis <= rad) {
+                    PAIR_INFO pi;
+                    pi.i1 = i_input;
+                    pi.i2 = i_this;
+                    pi.d12 = dis;
+                    pair_info.push_back(pi);
+                } // Within max distance 
+
+            } // loop over objects in leaf 
+
+        } // any in leaf?
+
+	} // loop over leaves
+
+}
+
+// Match the points [start,stop) of the input ra,dec to the points in the
+// Matcher, appending the pairs to the pair_info vector.  For each point the
+// pairs are sorted by distance and truncated to maxmatch.
+void Matcher::match_range(
+        NumpyVector<double>& ra_input,
+        NumpyVector<double>& dec_input,
+        NumpyVector<double>& radius,
+        int64_t maxmatch,
+        npy_intp start,
+        npy_intp stop,
+        std::vector<PAIR_INFO>& pair_info)
+{
+
+	npy_intp nrad = radius.size();
+
+	double rad=0;
 	if (nrad == 1) {
 		rad = radius[0];
-		d = cos( rad*D2R );
 	}
 
-	npy_intp ninput = ra.size();
-	for (npy_intp i_input=0; i_input<ninput; i_input++) {
-		// Declare the domain and the lists
-		SpatialDomain domain;    // initialize empty domain
-		ValVec<uint64> plist, flist;	// List results
+	// temporary vector to hold matches to each point
+	std::vector<PAIR_INFO> this_pair_info;
+
+	for (npy_intp i_input=start; i_input<stop; i_input++) {
 
 		if (nrad > 1) {
 			rad = radius[i_input];
-			d = cos( rad*D2R );
 		}
 
-		// Find the triangles around this point
-		domain.setRaDecD(ra[i_input],dec[i_input],d); //put in ra,dec,d E.S.S.
-		domain.intersect(&index,plist,flist);	  // intersect with list
+		this_pair_info.clear();
+		find_within(i_input, ra_input[i_input], dec_input[i_input], rad,
+		            this_pair_info);
 
+		npy_intp nkeep = this_pair_info.size();
+		if ( nkeep > 0 ) {
 
-		// number of triangles found
-		npy_intp nfound = flist.length() + plist.length();
-		std::vector<int64_t> idlist(nfound);
-		npy_intp idcount=0;
+			// Sort the result by distance
+			std::sort( this_pair_info.begin(), this_pair_info.end(), PAIR_INFO_ORDERING());
 
-		// We could speed this up when no distance is needed by
-		// just keeping everything in the full nodes without
-		// doing a distance calculation
+			if ((maxmatch > 0) ) {
+				// setting maxmatch to zero is same as "keep all matches"
+				if (nkeep > maxmatch) {
+					nkeep=maxmatch;
+				}
+			}
+			pair_info.insert(pair_info.end(),
+			                 this_pair_info.begin(),
+			                 this_pair_info.begin()+nkeep);
+		}
 
-		// ----------- FULL NODES -------------
-		for(size_t i = 0; i < flist.length(); i++)
-		{  
-			idlist[idcount] = flist(i);
-			idcount++;
+	} // loop over list 1
+
+}
+
+// order by distance, and by index for equal distances, so the k nearest
+// neighbors are uniquely defined
+struct PAIR_INFO_KNN_ORDERING {
+	bool operator()(PAIR_INFO const& pi1, PAIR_INFO const& pi2) {
+		if (pi1.d12 == pi2.d12) {
+			return pi1.i2 < pi2.i2;
 		}
-		// ----------- Partial Nodes ----------
-		for(size_t i = 0; i < plist.length(); i++)
-		{  
-			idlist[idcount] = plist(i);
-			idcount++;
+		return pi1.d12 < pi2.d12;
+	}
+};
+
+// Find the k nearest neighbors of the input points [start,stop).  The
+// results go in rows of the (n,k) index and distance arrays, which are
+// padded with -1 and infinity if fewer than k are found within max_radius.
+//
+// The search radius starts at the radius that worked for the previous point,
+// and is doubled until at least k points are found within it.  All points
+// within the radius are found, so the result is exact.
+void Matcher::knn_range(
+        NumpyVector<double>& ra_input,
+        NumpyVector<double>& dec_input,
+        npy_intp k,
+        double max_radius,
+        double start_radius,
+        npy_intp start,
+        npy_intp stop,
+        int64_t* ind,
+        double* dist)
+{
+	std::vector<PAIR_INFO> this_pair_info;
+
+	double rad = start_radius;
+	for (npy_intp i_input=start; i_input<stop; i_input++) {
+
+		npy_intp nfound=0;
+		while (1) {
+			this_pair_info.clear();
+			find_within(i_input, ra_input[i_input], dec_input[i_input], rad,
+			            this_pair_info);
+			nfound = this_pair_info.size();
+
+			if (nfound >= k || rad >= max_radius) {
+				break;
+			}
+			rad *= 2;
+			if (rad > max_radius) {
+				rad = max_radius;
+			}
 		}
 
+		npy_intp nkeep = nfound < k ? nfound : k;
+		std::partial_sort(this_pair_info.begin(),
+		                  this_pair_info.begin()+nkeep,
+		                  this_pair_info.end(),
+		                  PAIR_INFO_KNN_ORDERING());
+
+		int64_t* this_ind = ind + i_input*k;
+		double* this_dist = dist + i_input*k;
+		for (npy_intp ik=0; ik<k; ik++) {
+			if (ik < nkeep) {
+				this_ind[ik] = this_pair_info[ik].i2;
+				this_dist[ik] = this_pair_info[ik].d12;
+			} else {
+				this_ind[ik] = -1;
+				this_dist[ik] = std::numeric_limits<double>::infinity();
+			}
+		}
 
-		// these are temporary vectors to hold matches to this point
+		// shrink for the next point if we found too many
+		if (nfound > 4*k) {
+			rad /= 2;
+		}
+	}
+}
 
-		std::vector<PAIR_INFO> pair_info;
+// the work assigned to a single thread in Matcher::match
+struct MATCH_THREAD_INFO {
+	Matcher* matcher;
+	NumpyVector<double>* ra;
+	NumpyVector<double>* dec;
+	NumpyVector<double>* radius;
+	int64_t maxmatch;
+	npy_intp start;
+	npy_intp stop;
+	std::vector<PAIR_INFO> pair_info;
+	int failed;
+};
+
+static void* match_thread(void* arg)
+{
+	MATCH_THREAD_INFO* info = (MATCH_THREAD_INFO*) arg;
+
+	// exceptions cannot propagate out of a thread, and we are not holding
+	// the GIL, so just record the failure
+	try {
+		info->matcher->match_range(*info->ra, *info->dec, *info->radius,
+		                           info->maxmatch,
+		                           info->start, info->stop,
+		                           info->pair_info);
+	} catch (...) {
+		info->failed=1;
+	}
+	return NULL;
+}
 
-		for (npy_intp j=0; j<nfound; j++) {
 
-			int64_t htmid = idlist[j];
+// Run func on each element of info in its own thread.  Each element must
+// have start and stop members; those with no work are skipped.  If a thread
+// cannot be created, the work is done in the calling thread, which also does
+// the first chunk.
+template <class T>
+static void run_threads(std::vector<T>& info, void* (*func)(void*))
+{
+	npy_intp nthreads = info.size();
+	std::vector<pthread_t> threads(nthreads);
+	std::vector<int> started(nthreads);
+
+	for (npy_intp it=0; it<nthreads; it++) {
+		started[it]=0;
+		if (it > 0 && info[it].start < info[it].stop) {
+			started[it] = (pthread_create(&threads[it], NULL,
+			                              func, &info[it]) == 0);
+		}
+	}
+	for (npy_intp it=0; it<nthreads; it++) {
+		// run in this thread if no thread was started
+		if (!started[it] && info[it].start < info[it].stop) {
+			func(&info[it]);
+		}
+	}
+	for (npy_intp it=0; it<nthreads; it++) {
+		if (started[it]) {
+			pthread_join(threads[it], NULL);
+		}
+	}
+}
 
-            iter=this->hmap.find(htmid);
-            if (iter != this->hmap.end()) {
+// number of input points given to each thread at a time.  The results
+// for a block are written out before the next is started, so this bounds
+// the memory used when writing to a file
+#define MATCH_THREAD_BLOCKSIZE 100000
 
-                int64_t nleaf =iter->second.size();
-                for (int64_t ileaf=0; ileaf<nleaf; ileaf++) {
-                    int64_t i_this = iter->second[ileaf];
+PyObject* Matcher::match(
+		PyObject* ra_array, // all in degrees
+        PyObject* dec_array,
+		PyObject* radius_array, // degrees
+        PyObject* maxmatch_obj,
+        PyObject* filename_obj,
+        PyObject* nthreads_obj) throw (const char *) {
 
-                    // Returns distance in degrees
-                    double dis = gcirc(ra[i_input],
-                                       dec[i_input],
-                                       this->ra[i_this],
-                                       this->dec[i_this],true);
+	// no copies made if already double vectors
 
-                    // Turns out, this pushing is not a bottleneck!
-                    // Time is negligible compared to the leaf finding
-                    // and the gcirc.
-                    if (dis <= rad) {
-                        PAIR_INFO pi;
-                        pi.i1 = i_input;
-                        pi.i2 = i_this;
-                        pi.d12 = dis;
-                        pair_info.push_back(pi);
-                    } // Within max distance 
+	NumpyVector<double> ra(ra_array);
+	NumpyVector<double> dec(dec_array);
 
-                } // loop over objects in leaf 
+	NumpyVector<double> radius(radius_array);
 
-            } // any in leaf?
+	// get as NumpyVectors even though they are only length 1
+	// because it does a good job with conversions
+	NumpyVector<int64_t> maxmatchVec(maxmatch_obj);
+	int64_t maxmatch = maxmatchVec[0];
 
-		} // loop over input ra,dec
+	NumpyVector<int64_t> nthreadsVec(nthreads_obj);
+	npy_intp nthreads = nthreadsVec[0];
+	if (nthreads < 1) {
+		throw "nthreads must be >= 1";
+	}
 
-		npy_intp nkeep = pair_info.size();
-		if ( nkeep > 0 ) {
+	// These will temporarily hold the results
+	std::vector<int64_t> m1;
+	std::vector<int64_t> m2;
+	std::vector<double> d12;
 
-			// Sort the result by distance
-			std::sort( pair_info.begin(), pair_info.end(), PAIR_INFO_ORDERING());
+	// total number of pairs
+	int64_t ntotal = 0;
 
-			if ((maxmatch > 0) ) {
-				// setting maxmatch to zero is same as "keep all matches"
-				if (nkeep > maxmatch) {
-					nkeep=maxmatch;
-				}
+	FILE* fptr=NULL;
+	if (PyString_Check(filename_obj)) {
+		char* filename=PyString_AsString(filename_obj);
+		fptr = fopen(filename, "w");
+		if (fptr==NULL) 
+		{
+			std::stringstream err;
+			err<<"Cannot open file: "<<filename<<" : "<<strerror(errno);
+			throw err.str().c_str();
+		}
+	}
+
+	npy_intp ninput = ra.size();
+	if (nthreads > ninput) {
+		nthreads = ninput > 0 ? ninput : 1;
+	}
+
+	// each thread gets its own contiguous chunk of list 1 and its own
+	// output buffer.  The buffers are copied out in order, so the result
+	// is identical to the serial case
+	std::vector<MATCH_THREAD_INFO> info(nthreads);
+	int failed=0;
+
+	npy_intp blocksize = nthreads*MATCH_THREAD_BLOCKSIZE;
+
+	for (npy_intp block_start=0; block_start<ninput; block_start += blocksize) {
+		npy_intp block_stop = block_start + blocksize;
+		if (block_stop > ninput) {
+			block_stop = ninput;
+		}
+		npy_intp nper = (block_stop-block_start + nthreads - 1)/nthreads;
+
+		// no python objects are used while matching, so let other
+		// python threads run
+		PyThreadState* save = PyEval_SaveThread();
+
+		for (npy_intp it=0; it<nthreads; it++) {
+			MATCH_THREAD_INFO& ti = info[it];
+			ti.matcher = this;
+			ti.ra = &ra;
+			ti.dec = &dec;
+			ti.radius = &radius;
+			ti.maxmatch = maxmatch;
+			ti.start = std::min(block_start + it*nper, block_stop);
+			ti.stop = std::min(ti.start + nper, block_stop);
+			ti.pair_info.clear();
+			ti.failed = 0;
+		}
+		run_threads(info, match_thread);
+
+		for (npy_intp it=0; it<nthreads; it++) {
+			MATCH_THREAD_INFO& ti = info[it];
+			if (ti.failed) {
+				failed=1;
+				break;
 			}
+			npy_intp nkeep = ti.pair_info.size();
 			for (npy_intp ci=0; ci<nkeep; ci++) {
 				if (fptr) {
                     fprintf(fptr, "%ld %ld %.16g\n", 
-                            pair_info[ci].i1,
-                            pair_info[ci].i2,
-                            pair_info[ci].d12);
+                            ti.pair_info[ci].i1,
+                            ti.pair_info[ci].i2,
+                            ti.pair_info[ci].d12);
 				} else {
-					m1.push_back(pair_info[ci].i1);
-					m2.push_back(pair_info[ci].i2);
-					d12.push_back(pair_info[ci].d12);
+					m1.push_back(ti.pair_info[ci].i1);
+					m2.push_back(ti.pair_info[ci].i2);
+					d12.push_back(ti.pair_info[ci].d12);
 				}
-				// keep track of the total number actually saved or written
-				ntotal += 1;
 			}
+			// keep track of the total number actually saved or written
+			ntotal += nkeep;
+			std::vector<PAIR_INFO>().swap(ti.pair_info);
 		}
 
-	} // loop over list 1
+		PyEval_RestoreThread(save);
+
+		if (failed) {
+			if (fptr) {
+				fclose(fptr);
+			}
+			throw "error matching points";
+		}
+
+	} // loop over blocks of list 1
 
 
 	// This will hold the tuple of match1 and match2 and possibly
@@ -796,3 +1219,321 @@ PyObject* Matcher::match(
 
 } // Matcher::match
 
+// the work assigned to a single thread in Matcher::knn
+struct KNN_THREAD_INFO {
+	Matcher* matcher;
+	NumpyVector<double>* ra;
+	NumpyVector<double>* dec;
+	npy_intp k;
+	double max_radius;
+	double start_radius;
+	npy_intp start;
+	npy_intp stop;
+	int64_t* ind;
+	double* dist;
+	int failed;
+};
+
+static void* knn_thread(void* arg)
+{
+	KNN_THREAD_INFO* info = (KNN_THREAD_INFO*) arg;
+
+	try {
+		info->matcher->knn_range(*info->ra, *info->dec,
+		                         info->k, info->max_radius,
+		                         info->start_radius,
+		                         info->start, info->stop,
+		                         info->ind, info->dist);
+	} catch (...) {
+		info->failed=1;
+	}
+	return NULL;
+}
+
+PyObject* Matcher::knn(
+		PyObject* ra_array, // all in degrees
+        PyObject* dec_array,
+        PyObject* k_obj,
+		PyObject* max_radius_obj, // degrees
+        PyObject* nthreads_obj) throw (const char *) {
+
+	static const double
+		R2D=57.29577951308232;
+
+	NumpyVector<double> ra_input(ra_array);
+	NumpyVector<double> dec_input(dec_array);
+
+	NumpyVector<int64_t> kVec(k_obj);
+	npy_intp k = kVec[0];
+	if (k < 1) {
+		throw "k must be >= 1";
+	}
+
+	NumpyVector<double> max_radiusVec(max_radius_obj);
+	double max_radius = max_radiusVec[0];
+	if (max_radius <= 0) {
+		throw "max_radius must be > 0";
+	}
+
+	NumpyVector<int64_t> nthreadsVec(nthreads_obj);
+	npy_intp nthreads = nthreadsVec[0];
+	if (nthreads < 1) {
+		throw "nthreads must be >= 1";
+	}
+
+	npy_intp ninput = ra_input.size();
+	if (nthreads > ninput) {
+		nthreads = ninput > 0 ? ninput : 1;
+	}
+
+	// flattened (ninput,k) outputs
+	NumpyVector<int64_t> ind(ninput*k);
+	NumpyVector<double> dist(ninput*k);
+
+	// first guess for the search radius: the radius of a circle expected to
+	// hold k points if they were spread over the whole sky.  This is adapted
+	// as we go
+	double start_radius = max_radius;
+	npy_intp num = ra.size();
+	if (num > 0) {
+		start_radius = sqrt(4.0*k/num)*R2D;
+		if (start_radius > max_radius) {
+			start_radius = max_radius;
+		}
+	}
+
+	std::vector<KNN_THREAD_INFO> info(nthreads);
+	npy_intp nper = (ninput + nthreads - 1)/nthreads;
+	for (npy_intp it=0; it<nthreads; it++) {
+		KNN_THREAD_INFO& ti = info[it];
+		ti.matcher = this;
+		ti.ra = &ra_input;
+		ti.dec = &dec_input;
+		ti.k = k;
+		ti.max_radius = max_radius;
+		ti.start_radius = start_radius;
+		ti.start = std::min(it*nper, ninput);
+		ti.stop = std::min(ti.start + nper, ninput);
+		ti.ind = ind.ptr();
+		ti.dist = dist.ptr();
+		ti.failed = 0;
+	}
+
+	// no python objects are used, so let other python threads run
+	PyThreadState* save = PyEval_SaveThread();
+	run_threads(info, knn_thread);
+	PyEval_RestoreThread(save);
+
+	for (npy_intp it=0; it<nthreads; it++) {
+		if (info[it].failed) {
+			throw "error finding nearest neighbors";
+		}
+	}
+
+	PyObject* output_tuple = PyTuple_New(2);
+	PyTuple_SetItem(output_tuple, 0, ind.getref());
+	PyTuple_SetItem(output_tuple, 1, dist.getref());
+	return output_tuple;
+
+} // Matcher::knn
+
+// Count the pairs for the input points [info.start,info.stop) in log spaced
+// bins of separation.  The separation is in degrees, or in radians*scale if
+// scale is sent.  Each pair is weighted by weights1*weights2 in the weighted
+// counts, and pairs with |z1-z2| > dz are not counted if z is sent.
+void Matcher::bincount_range(BINCOUNT_INFO& info)
+{
+	static const double
+		R2D=57.29577951308232;
+
+	double logrmin = log10(info.rmin);
+	double logrmax = log10(info.rmax);
+	double log_binsize = (logrmax-logrmin)/info.nbin;
+
+	npy_intp nscale = info.scale ? info.scale->size() : 0;
+	double scale=1, logscale=0;
+	if (nscale == 1) {
+		scale = (*info.scale)[0];
+		logscale = log10(scale);
+	}
+
+	std::vector<PAIR_INFO> pair_info;
+
+	for (npy_intp i1=info.start; i1<info.stop; i1++) {
+
+		if (nscale > 1) {
+			scale = (*info.scale)[i1];
+			logscale = log10(scale);
+		}
+
+		// max search radius in degrees for this point
+		double maxangle = info.rmax/scale;
+		if (nscale > 0) {
+			maxangle *= R2D;
+		}
+
+		pair_info.clear();
+		find_within(i1, (*info.ra)[i1], (*info.dec)[i1], maxangle, pair_info);
+
+		double w1 = info.weights1 ? (*info.weights1)[i1] : 1.0;
+		double this_z1 = info.z1 ? (*info.z1)[i1] : 0.0;
+
+		npy_intp npair = pair_info.size();
+		for (npy_intp ipair=0; ipair<npair; ipair++) {
+			int64_t i2 = pair_info[ipair].i2;
+
+			if (info.z1) {
+				if (fabs(this_z1 - (*info.z2)[i2]) > info.dz) {
+					continue;
+				}
+			}
+
+			double dis = pair_info[ipair].d12;
+			if (nscale > 0) {
+				dis /= R2D;
+			}
+			double logr = logscale + log10(dis);
+			if (logr < logrmin) {
+				continue;
+			}
+
+			npy_intp radbin = (npy_intp) ( (logr-logrmin)/log_binsize );
+			if (radbin < info.nbin) {
+				double w2 = info.weights2 ? (*info.weights2)[i2] : 1.0;
+				info.counts[radbin] += 1;
+				info.wsum[radbin] += w1*w2;
+			}
+		}
+	}
+}
+
+static void* bincount_thread(void* arg)
+{
+	BINCOUNT_INFO* info = (BINCOUNT_INFO*) arg;
+
+	try {
+		info->matcher->bincount_range(*info);
+	} catch (...) {
+		info->failed=1;
+	}
+	return NULL;
+}
+
+PyObject* Matcher::bincount(
+		PyObject* rmin_obj,
+		PyObject* rmax_obj,
+		PyObject* nbin_obj,
+		PyObject* ra_array, // degrees
+		PyObject* dec_array,
+		PyObject* scale_obj,
+		PyObject* weights1_obj,
+		PyObject* weights2_obj,
+		PyObject* z1_obj,
+		PyObject* z2_obj,
+		PyObject* dz_obj,
+		PyObject* nthreads_obj) throw (const char *) {
+
+	// get these as numpyvectors even though they are only length 1
+	// because it does a good job with conversions
+	NumpyVector<double> rminVec(rmin_obj);
+	NumpyVector<double> rmaxVec(rmax_obj);
+	NumpyVector<int64_t> nbinVec(nbin_obj);
+	NumpyVector<int64_t> nthreadsVec(nthreads_obj);
+
+	double rmin = rminVec[0];
+	double rmax = rmaxVec[0];
+	npy_intp nbin = nbinVec[0];
+	npy_intp nthreads = nthreadsVec[0];
+
+	if (rmin <= 0 || rmax <= rmin) {
+		throw "require 0 < rmin < rmax";
+	}
+	if (nbin < 1) {
+		throw "nbin must be >= 1";
+	}
+	if (nthreads < 1) {
+		throw "nthreads must be >= 1";
+	}
+
+	NumpyVector<double> ra_input(ra_array);
+	NumpyVector<double> dec_input(dec_array);
+	npy_intp ninput = ra_input.size();
+	npy_intp num = ra.size();
+
+	NumpyVector<double> scale, weights1, weights2, z1, z2;
+	double dz=0;
+
+	if (scale_obj != Py_None) {
+		scale.init(scale_obj);
+		if (scale.size() != 1 && scale.size() != ninput) {
+			throw "scale must be scalar or same size as ra,dec";
+		}
+	}
+	if (weights1_obj != Py_None) {
+		weights1.init(weights1_obj);
+		weights2.init(weights2_obj);
+		if (weights1.size() != ninput || weights2.size() != num) {
+			throw "weights1,weights2 must match the sizes of the point lists";
+		}
+	}
+	if (z1_obj != Py_None) {
+		z1.init(z1_obj);
+		z2.init(z2_obj);
+		if (z1.size() != ninput || z2.size() != num) {
+			throw "z1,z2 must match the sizes of the point lists";
+		}
+		NumpyVector<double> dzVec(dz_obj);
+		dz = dzVec[0];
+	}
+
+	if (nthreads > ninput) {
+		nthreads = ninput > 0 ? ninput : 1;
+	}
+
+	// each thread gets its own histogram; these are summed at the end
+	std::vector<BINCOUNT_INFO> info(nthreads);
+	npy_intp nper = (ninput + nthreads - 1)/nthreads;
+	for (npy_intp it=0; it<nthreads; it++) {
+		BINCOUNT_INFO& ti = info[it];
+		ti.matcher = this;
+		ti.ra = &ra_input;
+		ti.dec = &dec_input;
+		ti.scale = (scale_obj != Py_None) ? &scale : NULL;
+		ti.weights1 = (weights1_obj != Py_None) ? &weights1 : NULL;
+		ti.weights2 = (weights1_obj != Py_None) ? &weights2 : NULL;
+		ti.z1 = (z1_obj != Py_None) ? &z1 : NULL;
+		ti.z2 = (z1_obj != Py_None) ? &z2 : NULL;
+		ti.rmin = rmin;
+		ti.rmax = rmax;
+		ti.dz = dz;
+		ti.nbin = nbin;
+		ti.start = std::min(it*nper, ninput);
+		ti.stop = std::min(ti.start + nper, ninput);
+		ti.counts.assign(nbin, 0);
+		ti.wsum.assign(nbin, 0.0);
+		ti.failed = 0;
+	}
+
+	// no python objects are used, so let other python threads run
+	PyThreadState* save = PyEval_SaveThread();
+	run_threads(info, bincount_thread);
+	PyEval_RestoreThread(save);
+
+	NumpyVector<int64_t> counts(nbin);
+	NumpyVector<double> wsum(nbin);
+	for (npy_intp it=0; it<nthreads; it++) {
+		if (info[it].failed) {
+			throw "error counting pairs";
+		}
+		for (npy_intp i=0; i<nbin; i++) {
+			counts[i] += info[it].counts[i];
+			wsum[i] += info[it].wsum[i];
+		}
+	}
+
+	PyObject* output_tuple = PyTuple_New(2);
+	PyTuple_SetItem(output_tuple, 0, counts.getref());
+	PyTuple_SetItem(output_tuple, 1, wsum.getref());
+	return output_tuple;
+
+} // Matcher::bincount
@@ -5,7 +5,6 @@
 #include "SpatialInterface.h"
 #include <stdint.h>
 #include <vector>
-#include <map>
 #include "numpy/arrayobject.h"
 
 typedef struct {
@@ -45,6 +44,15 @@ class HTMC {
                             int inclusive
                            ) throw (const char *);
 
+        // intersect for arrays of circles, returning the trixel ids in
+        // compressed form
+        PyObject* intersect_many(
+                            PyObject* ra_array, // all in degrees
+                            PyObject* dec_array,
+                            PyObject* radius_array, // degrees
+                            PyObject* inclusive_obj
+                           ) throw (const char *);
+
 
         // this requires the reverse indices must already be created,
         // and other obscure inputs. The python wrapper takes care of
@@ -91,28 +99,115 @@ class HTMC {
         int mDepth;
 };
 
+// inputs and per-thread outputs for Matcher::bincount.  Optional
+// inputs are NULL if not used
+class Matcher;
+struct BINCOUNT_INFO {
+	Matcher* matcher;
+	NumpyVector<double>* ra;
+	NumpyVector<double>* dec;
+	NumpyVector<double>* scale;
+	NumpyVector<double>* weights1;
+	NumpyVector<double>* weights2;
+	NumpyVector<double>* z1;
+	NumpyVector<double>* z2;
+	double rmin;
+	double rmax;
+	double dz;
+	npy_intp nbin;
+	npy_intp start;
+	npy_intp stop;
+	std::vector<int64_t> counts;
+	std::vector<double> wsum;
+	int failed;
+};
+
 class Matcher {
 	public:
 
+        // if leafids is None the leaf index is built, otherwise
+        // the sent index is used
         Matcher(int depth,
                 PyObject* ra,
-                PyObject* dec) throw (const char *);
+                PyObject* dec,
+                PyObject* leafids,
+                PyObject* offsets,
+                PyObject* perm) throw (const char *);
         ~Matcher() {};
 
         int get_depth() {
             return depth;
         }
 
-        PyObject* match(PyObject* radius_array, // degrees
-                        PyObject* ra_array, // degrees
+        // tuple (ra, dec, leafids, offsets, perm)
+        PyObject* get_arrays(void) throw (const char *);
+
+        PyObject* match(PyObject* ra_array, // degrees
                         PyObject* dec_array,
+                        PyObject* radius_array, // degrees
                         PyObject* maxmatch_obj,
-                        PyObject* filename_obj) throw (const char *);
+                        PyObject* filename_obj,
+                        PyObject* nthreads_obj) throw (const char *);
+
+        // k nearest neighbors; flattened (n,k) index and distance arrays
+        PyObject* knn(PyObject* ra_array, // degrees
+                      PyObject* dec_array,
+                      PyObject* k_obj,
+                      PyObject* max_radius_obj, // degrees
+                      PyObject* nthreads_obj) throw (const char *);
+
+        // count pairs in log spaced bins of separation; tuple of counts
+        // and weighted counts
+        PyObject* bincount(PyObject* rmin_obj,
+                           PyObject* rmax_obj,
+                           PyObject* nbin_obj,
+                           PyObject* ra_array, // degrees
+                           PyObject* dec_array,
+                           PyObject* scale_obj,
+                           PyObject* weights1_obj,
+                           PyObject* weights2_obj,
+                           PyObject* z1_obj,
+                           PyObject* z2_obj,
+                           PyObject* dz_obj,
+                           PyObject* nthreads_obj) throw (const char *);
+
+        // match a range of the input points, used by the threads in match()
+        void match_range(NumpyVector<double>& ra_input,
+                         NumpyVector<double>& dec_input,
+                         NumpyVector<double>& radius,
+                         int64_t maxmatch,
+                         npy_intp start,
+                         npy_intp stop,
+                         std::vector<PAIR_INFO>& pair_info);
+
+        // find the k nearest neighbors of a range of the input points,
+        // used by the threads in knn()
+        void knn_range(NumpyVector<double>& ra_input,
+                       NumpyVector<double>& dec_input,
+                       npy_intp k,
+                       double max_radius,
+                       double start_radius,
+                       npy_intp start,
+                       npy_intp stop,
+                       int64_t* ind,
+                       double* dist);
+
+        // count pairs for a range of the input points, used by the
+        // threads in bincount()
+        void bincount_range(BINCOUNT_INFO& info);
 
 
     private:
 
-        void init_hmap(void);
+        void init_index(void);
+
+        // find all points within rad degrees of the input point
+        void find_within(int64_t i_input,
+                         double ra_input,
+                         double dec_input,
+                         double rad,
+                         std::vector<PAIR_INFO>& pair_info);
+        void check_index(void) throw (const char *);
 
         int depth;
         htmInterface htm_interface;
@@ -120,7 +215,11 @@ class Matcher {
         NumpyVector<double> ra;
         NumpyVector<double> dec;
 
-        std::map<int64_t, std::vector<int64_t> > hmap;
+        // leaf index: sorted distinct leaf ids, offsets into perm for each
+        // leaf, and the indices of the points grouped by leaf
+        NumpyVector<int64_t> leafids;
+        NumpyVector<int64_t> offsets;
+        NumpyVector<int64_t> perm;
 
 };
 
@@ -70,6 +70,57 @@ Revision History:
                             int inclusive
                            ) throw (const char *);
 
+        // intersect for arrays of circles, returning the trixel ids in
+        // compressed form
+#ifdef SWIG
+%feature("docstring") intersect_many
+"
+Class:
+    HTM
+
+Method Name:
+    intersect_many
+
+Purpose:
+
+    Find the triangles at the current htm depth that are contained within or
+    intersect each of a set of circles.  This is the low level routine used
+    by HTM.intersect_many, which checks and converts the inputs.
+
+Calling Sequence:
+
+    import esutil
+    h=esutil.htm.HTM(depth)
+    ids, offsets, full = h.intersect_many(ra, dec, radius, inclusive)
+
+Inputs:
+    ra,dec:  Arrays of equal length, the centers of the circles in degrees.
+    radius:  Array of length one or the same length as ra,dec, in degrees.
+    inclusive:  If 0, only include triangles fully enclosed within the
+        circle.  If 1, include those that intersect as well.
+
+Outputs:
+    ids:  An array with the htm ids for all circles.
+    offsets:  An array of length len(ra)+1.  The ids for circle i are
+        ids[offsets[i]:offsets[i+1]].
+    full:  An int8 array the same length as ids, 1 for triangles fully
+        enclosed within the circle.
+
+Example:
+
+    >>> import esutil
+    >>> h=esutil.htm.HTM(depth)
+    >>> ids, offsets, full = h.intersect_many(ra, dec, radius, 1)
+
+";
+#endif
+        PyObject* intersect_many(
+                            PyObject* ra_array, // all in degrees
+                            PyObject* dec_array,
+                            PyObject* radius_array, // degrees
+                            PyObject* inclusive_obj
+                           ) throw (const char *);
+
 
         // this requires the reverse indices must already be created,
         // and other obscure inputs. The python wrapper takes care of
@@ -116,9 +167,14 @@ Revision History:
 class Matcher {
     public:
 
+        // if leafids is None the leaf index is built, otherwise
+        // the sent index is used
         Matcher(int depth,
                 PyObject* ra,
-                PyObject* dec) throw (const char *);
+                PyObject* dec,
+                PyObject* leafids,
+                PyObject* offsets,
+                PyObject* perm) throw (const char *);
         ~Matcher() {};
 
 
@@ -126,11 +182,37 @@ class Matcher {
             return depth;
         }
 
-        PyObject* match(PyObject* radius_array, // degrees
-                        PyObject* ra_array, // degrees
+        // tuple (ra, dec, leafids, offsets, perm)
+        PyObject* get_arrays(void) throw (const char *);
+
+        PyObject* match(PyObject* ra_array, // degrees
                         PyObject* dec_array,
+                        PyObject* radius_array, // degrees
                         PyObject* maxmatch_obj,
-                        PyObject* filename_obj) throw (const char *);
+                        PyObject* filename_obj,
+                        PyObject* nthreads_obj) throw (const char *);
+
+        // k nearest neighbors; flattened (n,k) index and distance arrays
+        PyObject* knn(PyObject* ra_array, // degrees
+                      PyObject* dec_array,
+                      PyObject* k_obj,
+                      PyObject* max_radius_obj, // degrees
+                      PyObject* nthreads_obj) throw (const char *);
+
+        // count pairs in log spaced bins of separation; tuple of counts
+        // and weighted counts
+        PyObject* bincount(PyObject* rmin_obj,
+                           PyObject* rmax_obj,
+                           PyObject* nbin_obj,
+                           PyObject* ra_array, // degrees
+                           PyObject* dec_array,
+                           PyObject* scale_obj,
+                           PyObject* weights1_obj,
+                           PyObject* weights2_obj,
+                           PyObject* z1_obj,
+                           PyObject* z2_obj,
+                           PyObject* dz_obj,
+                           PyObject* nthreads_obj) throw (const char *);
 
 
 };
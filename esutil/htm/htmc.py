@@ -156,6 +156,48 @@ class HTMC(_object):
         """
         return _htmc.HTMC_intersect(self, *args)
 
+    def intersect_many(self, *args):
+        """
+        Class:
+            HTM
+
+        Method Name:
+            intersect_many
+
+        Purpose:
+
+            Find the triangles at the current htm depth that are contained within or
+            intersect each of a set of circles.  This is the low level routine used
+            by HTM.intersect_many, which checks and converts the inputs.
+
+        Calling Sequence:
+
+            import esutil
+            h=esutil.htm.HTM(depth)
+            ids, offsets, full = h.intersect_many(ra, dec, radius, inclusive)
+
+        Inputs:
+            ra,dec:  Arrays of equal length, the centers of the circles in degrees.
+            radius:  Array of length one or the same length as ra,dec, in degrees.
+            inclusive:  If 0, only include triangles fully enclosed within the
+                circle.  If 1, include those that intersect as well.
+
+        Outputs:
+            ids:  An array with the htm ids for all circles.
+            offsets:  An array of length len(ra)+1.  The ids for circle i are
+                ids[offsets[i]:offsets[i+1]].
+            full:  An int8 array the same length as ids, 1 for triangles fully
+                enclosed within the circle.
+
+        Example:
+
+            >>> import esutil
+            >>> h=esutil.htm.HTM(depth)
+            >>> ids, offsets, full = h.intersect_many(ra, dec, radius, 1)
+
+        """
+        return _htmc.HTMC_intersect_many(self, *args)
+
     def cmatch(self, *args):
         """
         Class:
@@ -283,7 +325,10 @@ class Matcher(_object):
     __swig_destroy__ = _htmc.delete_Matcher
     __del__ = lambda self : None;
     def get_depth(self): return _htmc.Matcher_get_depth(self)
+    def get_arrays(self): return _htmc.Matcher_get_arrays(self)
     def match(self, *args): return _htmc.Matcher_match(self, *args)
+    def knn(self, *args): return _htmc.Matcher_knn(self, *args)
+    def bincount(self, *args): return _htmc.Matcher_bincount(self, *args)
 Matcher_swigregister = _htmc.Matcher_swigregister
 Matcher_swigregister(Matcher)
 
@@ -3510,6 +3510,48 @@ fail:
 }
 
 
+SWIGINTERN PyObject *_wrap_HTMC_intersect_many(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  HTMC *arg1 = (HTMC *) 0 ;
+  PyObject *arg2 = (PyObject *) 0 ;
+  PyObject *arg3 = (PyObject *) 0 ;
+  PyObject *arg4 = (PyObject *) 0 ;
+  PyObject *arg5 = (PyObject *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject * obj1 = 0 ;
+  PyObject * obj2 = 0 ;
+  PyObject * obj3 = 0 ;
+  PyObject * obj4 = 0 ;
+  PyObject *result = 0 ;
+  
+  if (!PyArg_ParseTuple(args,(char *)"OOOOO:HTMC_intersect_many",&obj0,&obj1,&obj2,&obj3,&obj4)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_HTMC, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "HTMC_intersect_many" "', argument " "1"" of type '" "HTMC *""'"); 
+  }
+  arg1 = reinterpret_cast< HTMC * >(argp1);
+  arg2 = obj1;
+  arg3 = obj2;
+  arg4 = obj3;
+  arg5 = obj4;
+  try {
+    result = (PyObject *)(arg1)->intersect_many(arg2,arg3,arg4,arg5);
+  }
+  catch(char const *_e) {
+    PyErr_SetString(PyExc_RuntimeError, _e);
+    SWIG_fail;
+    
+  }
+  
+  resultobj = result;
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
 SWIGINTERN PyObject *_wrap_HTMC_cmatch(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
   PyObject *resultobj = 0;
   HTMC *arg1 = (HTMC *) 0 ;
@@ -3828,14 +3870,20 @@ SWIGINTERN PyObject *_wrap_new_Matcher(PyObject *SWIGUNUSEDPARM(self), PyObject
   int arg1 ;
   PyObject *arg2 = (PyObject *) 0 ;
   PyObject *arg3 = (PyObject *) 0 ;
+  PyObject *arg4 = (PyObject *) 0 ;
+  PyObject *arg5 = (PyObject *) 0 ;
+  PyObject *arg6 = (PyObject *) 0 ;
   int val1 ;
   int ecode1 = 0 ;
   PyObject * obj0 = 0 ;
   PyObject * obj1 = 0 ;
   PyObject * obj2 = 0 ;
+  PyObject * obj3 = 0 ;
+  PyObject * obj4 = 0 ;
+  PyObject * obj5 = 0 ;
   Matcher *result = 0 ;
   
-  if (!PyArg_ParseTuple(args,(char *)"OOO:new_Matcher",&obj0,&obj1,&obj2)) SWIG_fail;
+  if (!PyArg_ParseTuple(args,(char *)"OOOOOO:new_Matcher",&obj0,&obj1,&obj2,&obj3,&obj4,&obj5)) SWIG_fail;
   ecode1 = SWIG_AsVal_int(obj0, &val1);
   if (!SWIG_IsOK(ecode1)) {
     SWIG_exception_fail(SWIG_ArgError(ecode1), "in method '" "new_Matcher" "', argument " "1"" of type '" "int""'");
@@ -3843,8 +3891,11 @@ SWIGINTERN PyObject *_wrap_new_Matcher(PyObject *SWIGUNUSEDPARM(self), PyObject
   arg1 = static_cast< int >(val1);
   arg2 = obj1;
   arg3 = obj2;
+  arg4 = obj3;
+  arg5 = obj4;
+  arg6 = obj5;
   try {
-    result = (Matcher *)new Matcher(arg1,arg2,arg3);
+    result = (Matcher *)new Matcher(arg1,arg2,arg3,arg4,arg5,arg6);
   }
   catch(char const *_e) {
     PyErr_SetString(PyExc_RuntimeError, _e);
@@ -3902,6 +3953,36 @@ fail:
 }
 
 
+SWIGINTERN PyObject *_wrap_Matcher_get_arrays(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  Matcher *arg1 = (Matcher *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject *result = 0 ;
+  
+  if (!PyArg_ParseTuple(args,(char *)"O:Matcher_get_arrays",&obj0)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_Matcher, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "Matcher_get_arrays" "', argument " "1"" of type '" "Matcher *""'"); 
+  }
+  arg1 = reinterpret_cast< Matcher * >(argp1);
+  try {
+    result = (PyObject *)(arg1)->get_arrays();
+  }
+  catch(char const *_e) {
+    PyErr_SetString(PyExc_RuntimeError, _e);
+    SWIG_fail;
+    
+  }
+  
+  resultobj = result;
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
 SWIGINTERN PyObject *_wrap_Matcher_match(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
   PyObject *resultobj = 0;
   Matcher *arg1 = (Matcher *) 0 ;
@@ -3910,6 +3991,7 @@ SWIGINTERN PyObject *_wrap_Matcher_match(PyObject *SWIGUNUSEDPARM(self), PyObjec
   PyObject *arg4 = (PyObject *) 0 ;
   PyObject *arg5 = (PyObject *) 0 ;
   PyObject *arg6 = (PyObject *) 0 ;
+  PyObject *arg7 = (PyObject *) 0 ;
   void *argp1 = 0 ;
   int res1 = 0 ;
   PyObject * obj0 = 0 ;
@@ -3918,9 +4000,10 @@ SWIGINTERN PyObject *_wrap_Matcher_match(PyObject *SWIGUNUSEDPARM(self), PyObjec
   PyObject * obj3 = 0 ;
   PyObject * obj4 = 0 ;
   PyObject * obj5 = 0 ;
+  PyObject * obj6 = 0 ;
   PyObject *result = 0 ;
   
-  if (!PyArg_ParseTuple(args,(char *)"OOOOOO:Matcher_match",&obj0,&obj1,&obj2,&obj3,&obj4,&obj5)) SWIG_fail;
+  if (!PyArg_ParseTuple(args,(char *)"OOOOOOO:Matcher_match",&obj0,&obj1,&obj2,&obj3,&obj4,&obj5,&obj6)) SWIG_fail;
   res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_Matcher, 0 |  0 );
   if (!SWIG_IsOK(res1)) {
     SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "Matcher_match" "', argument " "1"" of type '" "Matcher *""'"); 
@@ -3931,8 +4014,120 @@ SWIGINTERN PyObject *_wrap_Matcher_match(PyObject *SWIGUNUSEDPARM(self), PyObjec
   arg4 = obj3;
   arg5 = obj4;
   arg6 = obj5;
+  arg7 = obj6;
   try {
-    result = (PyObject *)(arg1)->match(arg2,arg3,arg4,arg5,arg6);
+    result = (PyObject *)(arg1)->match(arg2,arg3,arg4,arg5,arg6,arg7);
+  }
+  catch(char const *_e) {
+    PyErr_SetString(PyExc_RuntimeError, _e);
+    SWIG_fail;
+    
+  }
+  
+  resultobj = result;
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
+SWIGINTERN PyObject *_wrap_Matcher_knn(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  Matcher *arg1 = (Matcher *) 0 ;
+  PyObject *arg2 = (PyObject *) 0 ;
+  PyObject *arg3 = (PyObject *) 0 ;
+  PyObject *arg4 = (PyObject *) 0 ;
+  PyObject *arg5 = (PyObject *) 0 ;
+  PyObject *arg6 = (PyObject *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject * obj1 = 0 ;
+  PyObject * obj2 = 0 ;
+  PyObject * obj3 = 0 ;
+  PyObject * obj4 = 0 ;
+  PyObject * obj5 = 0 ;
+  PyObject *result = 0 ;
+  
+  if (!PyArg_ParseTuple(args,(char *)"OOOOOO:Matcher_knn",&obj0,&obj1,&obj2,&obj3,&obj4,&obj5)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_Matcher, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "Matcher_knn" "', argument " "1"" of type '" "Matcher *""'"); 
+  }
+  arg1 = reinterpret_cast< Matcher * >(argp1);
+  arg2 = obj1;
+  arg3 = obj2;
+  arg4 = obj3;
+  arg5 = obj4;
+  arg6 = obj5;
+  try {
+    result = (PyObject *)(arg1)->knn(arg2,arg3,arg4,arg5,arg6);
+  }
+  catch(char const *_e) {
+    PyErr_SetString(PyExc_RuntimeError, _e);
+    SWIG_fail;
+    
+  }
+  
+  resultobj = result;
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
+SWIGINTERN PyObject *_wrap_Matcher_bincount(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  Matcher *arg1 = (Matcher *) 0 ;
+  PyObject *arg2 = (PyObject *) 0 ;
+  PyObject *arg3 = (PyObject *) 0 ;
+  PyObject *arg4 = (PyObject *) 0 ;
+  PyObject *arg5 = (PyObject *) 0 ;
+  PyObject *arg6 = (PyObject *) 0 ;
+  PyObject *arg7 = (PyObject *) 0 ;
+  PyObject *arg8 = (PyObject *) 0 ;
+  PyObject *arg9 = (PyObject *) 0 ;
+  PyObject *arg10 = (PyObject *) 0 ;
+  PyObject *arg11 = (PyObject *) 0 ;
+  PyObject *arg12 = (PyObject *) 0 ;
+  PyObject *arg13 = (PyObject *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject * obj1 = 0 ;
+  PyObject * obj2 = 0 ;
+  PyObject * obj3 = 0 ;
+  PyObject * obj4 = 0 ;
+  PyObject * obj5 = 0 ;
+  PyObject * obj6 = 0 ;
+  PyObject * obj7 = 0 ;
+  PyObject * obj8 = 0 ;
+  PyObject * obj9 = 0 ;
+  PyObject * obj10 = 0 ;
+  PyObject * obj11 = 0 ;
+  PyObject * obj12 = 0 ;
+  PyObject *result = 0 ;
+  
+  if (!PyArg_ParseTuple(args,(char *)"OOOOOOOOOOOOO:Matcher_bincount",&obj0,&obj1,&obj2,&obj3,&obj4,&obj5,&obj6,&obj7,&obj8,&obj9,&obj10,&obj11,&obj12)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_Matcher, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "Matcher_bincount" "', argument " "1"" of type '" "Matcher *""'"); 
+  }
+  arg1 = reinterpret_cast< Matcher * >(argp1);
+  arg2 = obj1;
+  arg3 = obj2;
+  arg4 = obj3;
+  arg5 = obj4;
+  arg6 = obj5;
+  arg7 = obj6;
+  arg8 = obj7;
+  arg9 = obj8;
+  arg10 = obj9;
+  arg11 = obj10;
+  arg12 = obj11;
+  arg13 = obj12;
+  try {
+    result = (PyObject *)(arg1)->bincount(arg2,arg3,arg4,arg5,arg6,arg7,arg8,arg9,arg10,arg11,arg12,arg13);
   }
   catch(char const *_e) {
     PyErr_SetString(PyExc_RuntimeError, _e);
@@ -4027,6 +4222,45 @@ static PyMethodDef SwigMethods[] = {
 		"    2010-03-03:  SWIG wrapper completed.  Erin Sheldon, BNL.\n"
 		"\n"
 		""},
+	 { (char *)"HTMC_intersect_many", _wrap_HTMC_intersect_many, METH_VARARGS, (char *)"\n"
+		"Class:\n"
+		"    HTM\n"
+		"\n"
+		"Method Name:\n"
+		"    intersect_many\n"
+		"\n"
+		"Purpose:\n"
+		"\n"
+		"    Find the triangles at the current htm depth that are contained within or\n"
+		"    intersect each of a set of circles.  This is the low level routine used\n"
+		"    by HTM.intersect_many, which checks and converts the inputs.\n"
+		"\n"
+		"Calling Sequence:\n"
+		"\n"
+		"    import esutil\n"
+		"    h=esutil.htm.HTM(depth)\n"
+		"    ids, offsets, full = h.intersect_many(ra, dec, radius, inclusive)\n"
+		"\n"
+		"Inputs:\n"
+		"    ra,dec:  Arrays of equal length, the centers of the circles in degrees.\n"
+		"    radius:  Array of length one or the same length as ra,dec, in degrees.\n"
+		"    inclusive:  If 0, only include triangles fully enclosed within the\n"
+		"        circle.  If 1, include those that intersect as well.\n"
+		"\n"
+		"Outputs:\n"
+		"    ids:  An array with the htm ids for all circles.\n"
+		"    offsets:  An array of length len(ra)+1.  The ids for circle i are\n"
+		"        ids[offsets[i]:offsets[i+1]].\n"
+		"    full:  An int8 array the same length as ids, 1 for triangles fully\n"
+		"        enclosed within the circle.\n"
+		"\n"
+		"Example:\n"
+		"\n"
+		"    >>> import esutil\n"
+		"    >>> h=esutil.htm.HTM(depth)\n"
+		"    >>> ids, offsets, full = h.intersect_many(ra, dec, radius, 1)\n"
+		"\n"
+		""},
 	 { (char *)"HTMC_cmatch", _wrap_HTMC_cmatch, METH_VARARGS, (char *)"\n"
 		"Class:\n"
 		"    HTM\n"
@@ -4133,7 +4367,10 @@ static PyMethodDef SwigMethods[] = {
 	 { (char *)"new_Matcher", _wrap_new_Matcher, METH_VARARGS, NULL},
 	 { (char *)"delete_Matcher", _wrap_delete_Matcher, METH_VARARGS, NULL},
 	 { (char *)"Matcher_get_depth", _wrap_Matcher_get_depth, METH_VARARGS, NULL},
+	 { (char *)"Matcher_get_arrays", _wrap_Matcher_get_arrays, METH_VARARGS, NULL},
 	 { (char *)"Matcher_match", _wrap_Matcher_match, METH_VARARGS, NULL},
+	 { (char *)"Matcher_knn", _wrap_Matcher_knn, METH_VARARGS, NULL},
+	 { (char *)"Matcher_bincount", _wrap_Matcher_bincount, METH_VARARGS, NULL},
 	 { (char *)"Matcher_swigregister", Matcher_swigregister, METH_VARARGS, NULL},
 	 { NULL, NULL, 0, NULL }
 };
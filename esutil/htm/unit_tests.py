@@ -54,6 +54,39 @@ def test():
     tests += 1
 
 
+    # batch intersect should agree with intersect for each circle
+    stdout.write('Intersecting many circles, expect same as intersect....')
+    ra = numpy.array([200.0, 115.25, 10.0])
+    dec = numpy.array([0.0, 24.3, -85.0])
+    radius = numpy.array([0.1, 0.5, 1.0])
+    ids, offsets = h.intersect_many(ra, dec, radius)
+
+    ok = (offsets.size == ra.size+1)
+    for i in range(ra.size):
+        ids1 = h.intersect(ra[i], dec[i], radius[i])
+        ok = ok and ids[offsets[i]:offsets[i+1]].tolist() == ids1.tolist()
+
+    # the fully enclosed triangles are those from intersect with
+    # inclusive=False
+    ids, offsets, full = h.intersect_many(ra, dec, radius, getfull=True)
+    ok = ok and full.dtype == numpy.bool_ and full.size == ids.size
+    for i in range(ra.size):
+        ids1 = h.intersect(ra[i], dec[i], radius[i], inclusive=False)
+        full1 = full[offsets[i]:offsets[i+1]]
+        ok = ok and sorted(ids[offsets[i]:offsets[i+1]][full1]) == sorted(ids1)
+    ok = ok and full.any()
+
+    # no circles
+    ids, offsets = h.intersect_many([], [], [])
+    ok = ok and ids.size == 0 and offsets.tolist() == [0]
+    if not ok:
+        stdout.write('Error\n')
+        errors += 1
+    else:
+        stdout.write('OK\n')
+    tests += 1
+
+
     # try the matching
     stdout.write('Matching by ra/dec, expect 10 matches ordered by distance....')
     stdout.flush()
@@ -111,6 +144,67 @@ def test():
         stdout.write('%s %s %s\n' % (m1[i],m2[i],d12[i]))
 
 
+    # threaded matching must give the same answer as serial
+    stdout.write('Matching with nthreads=3, expect same as nthreads=1....')
+    numpy.random.seed(35)
+    ra3 = 200.0 + numpy.random.uniform(size=1000)
+    dec3 = 24.0 + numpy.random.uniform(size=1000)
+    ra4 = 200.0 + numpy.random.uniform(size=1000)
+    dec4 = 24.0 + numpy.random.uniform(size=1000)
+    rad = 100.0/3600.
+
+    m1,m2,d12 = h.match(ra3,dec3,ra4,dec4,rad,maxmatch=0)
+    m1t,m2t,d12t = h.match(ra3,dec3,ra4,dec4,rad,maxmatch=0,nthreads=3)
+
+    if (m1.size == 0 or m1.size != m1t.size
+            or (m1 != m1t).any() or (m2 != m2t).any() or (d12 != d12t).any()):
+        stdout.write('Error\n')
+        errors += 1
+    else:
+        stdout.write('OK\n')
+    tests += 1
+
+
+    # a saved and loaded Matcher must give the same answer
+    stdout.write('Saving and loading a Matcher, expect same matches....')
+    matcher = htm.Matcher(depth, ra4, dec4)
+    fname='/tmp/test-matcher.bin'
+    matcher.save(fname)
+    matcher_loaded = htm.Matcher.load(fname)
+    m1l,m2l,d12l = matcher_loaded.match(ra3,dec3,rad,maxmatch=0)
+
+    # a corrupt index must be rejected
+    ra_,dec_,leafids,offsets,perm = matcher.get_arrays()
+    perm = perm.copy()
+    perm[0] = perm.size
+    try:
+        htm.htmc.Matcher.__init__(htm.Matcher.__new__(htm.Matcher), depth,
+                                  ra4, dec4, leafids, offsets, perm)
+        bad_rejected = False
+    except RuntimeError:
+        bad_rejected = True
+
+    if (m1.size != m1l.size or not bad_rejected
+            or (m1 != m1l).any() or (m2 != m2l).any() or (d12 != d12l).any()):
+        stdout.write('Error\n')
+        errors += 1
+    else:
+        stdout.write('OK\n')
+    tests += 1
+
+
+    # nearest neighbors should agree with matching out to a large radius
+    stdout.write('Finding 3 nearest neighbors, expect same as maxmatch=3....')
+    ind,dist = matcher.knn(ra3[0:50],dec3[0:50],3)
+    m1,m2,d12 = matcher.match(ra3[0:50],dec3[0:50],2.0,maxmatch=3)
+
+    if (ind.shape != (50,3) or m2.size != 150
+            or (ind.ravel() != m2).any() or (dist.ravel() != d12).any()):
+        stdout.write('Error\n')
+        errors += 1
+    else:
+        stdout.write('OK\n')
+    tests += 1
 
 
     # try the matching
@@ -138,6 +232,22 @@ def test():
     for i in range(res.size):
         stdout.write('%s %s %s\n' % (res['i1'][i],res['i2'][i],res['d12'][i]))
 
+    stdout.write('Writing matched to binary file, expect same as in memory....')
+    fname='/tmp/test-pairs.sf'
+    m1,m2,d12 = h.match(ra1,dec1,ra2,dec2,two,maxmatch=0)
+    nmatch = h.match(ra1,dec1,ra2,dec2,two,file=fname,maxmatch=0,
+                     file_type='sfile')
+
+    res = h.read(fname, memmap=True)
+
+    if (nmatch != 10 or res.size != 10 or (res['i1'] != m1).any()
+            or (res['i2'] != m2).any() or (res['d12'] != d12).any()):
+        stdout.write('Error\n')
+        errors += 1
+    else:
+        stdout.write('OK\n')
+    tests += 1
+
 
     # try counts in radial bins
     stdout.write("\nTesting bincount....\n\n")
@@ -168,6 +278,18 @@ def test():
         stdout.write('    ....OK\n')
     tests += 1
 
+    stdout.write('Testing weighted bincount with nthreads=2, expect 4 times the counts....')
+    w1 = numpy.zeros(ra1.size) + 2.0
+    w2 = numpy.zeros(ra2.size) + 2.0
+    wcounts = h.bincount(rmin,rmax,nbin,ra1,dec1,ra2,dec2,getbins=False,
+                         weights1=w1, weights2=w2, nthreads=2)
+    if (wcounts != 4*counts_truth).any():
+        stdout.write('Error\n')
+        errors += 1
+    else:
+        stdout.write('OK\n')
+    tests += 1
+
 
 
     stdout.write('\n' + '-'*50 + '\n')
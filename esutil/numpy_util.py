@@ -100,28 +100,36 @@ Utilities for using and manipulating numerical python arrays (NumPy).
         method which does not update the dtype to reflect the new byte
         ordering.
 
-    unique(arr, values=False)
+    unique(arr, values=False, keep='first', return_counts=False,
+           return_inverse=False)
         Return indices of unique elements of a numpy array, or optionally
-        the unique values.  This is not order preserving.  This is currently
-        implemented in a slow fashion, should be updated.
+        the unique values.  This is not order preserving.
 
-    rem_dup(arr, flag, values=False)
+    rem_dup(arr, flag, values=False, keep='max_flag', return_counts=False,
+            return_inverse=False)
         Return indices of unique values of an array, selecting the one (when
-        duplicates exist) with the largest value of flag.  Optionally returns
-        the values in the array as well as their indices.
+        duplicates exist) with the largest value of flag, or according to
+        the keep= policy.  Optionally returns the values in the array as
+        well as their indices.
 
-    match(arr1, arr2)
+    match(arr1, arr2, method='sort')
         match two numpy arrays.  Return the indices of the matches or [-1] if
         no matches are found.  This means arr1[ind1] == arr2[ind2] is true for
-        all corresponding pairs. Arrays must contain only unique elements
+        all corresponding pairs. Arrays must contain only unique elements.
+        For integer types method='hash' uses a compiled hash join.
 
     strmatch(arr, regex)
         Match the string array to the input regular expression.  Returns
         a boolean array.
 
-    match_multi(arr1, arr2)
+    match_multi(arr1, arr2, method='histogram')
         Match two numpy integer arrays, one of which may be non-unique
 
+    match_sorted_chunks(chunks1, chunks2)
+        Match two sorted sequences of keys delivered in chunks, e.g.
+        read from files too large to fit in memory.  A generator
+        yielding the matched indices.
+
     dict2array(dict, sort=False, keys=None)
         Convert a dictionary to a numpy array.  Works for simple typs such as
         strings, integers, floating.
@@ -165,6 +173,13 @@ except:
 
 from . import misc as eu_misc
 
+# compiled routines, e.g. hash matching
+try:
+    from . import _numpy_util
+    have_cnumpy_util=True
+except:
+    have_cnumpy_util=False
+
 # for backwards compatibility
 from .random import random_indices as random_subset
 from .random import randind
@@ -1385,139 +1400,260 @@ def byteswap(array, inplace=False, keep_dtype=False):
 
     return outdata
       
-def unique(arr, values=False):
+def unique(arr, values=False, keep='first', 
+           return_counts=False, return_inverse=False):
     """
     NAME:
         unique
     
     CALLING SEQUENCE:
-        un = unique(arr, values=False)
+        un = unique(arr, values=False, keep='first',
+                    return_counts=False, return_inverse=False)
 
     PURPOSE:
         Return indices of unique elements of a numpy array, or optionally
-        the unique values.  This is not order preserving. This is currently
-        implemented in a slow fashion, should be updated.
+        the unique values.  The output is ordered by value, so this is not
+        order preserving.
 
     KEYWORDS:
         values:  Default False.  If True, return the unique values as
             opposed to just the indices which is the default.
+        keep: Default 'first'.  Which index to return when there are
+            duplicates, 'first' or 'last' in the array.
+        return_counts: Default False.  If True, also return the number of
+            times each unique value occurs.
+        return_inverse: Default False.  If True, also return the indices
+            into the output that reconstruct the input, such that
+            arr == arr[un][inverse]
+
+        If return_counts or return_inverse are True, a tuple is returned
+        with these appended in that order.
 
     REVISION HISTORY:
         Created 2009, Erin Sheldon, NYU.
+        Vectorized, added keep, return_counts, return_inverse
     """
-    n = arr.size
-    keep = numpy.zeros(n, dtype='i8')
+    if keep not in ['first','last']:
+        raise ValueError("keep should be 'first' or 'last', "
+                         "got '%s'" % keep)
 
-    s = arr.argsort()
+    arr = numpy.array(arr, ndmin=1, copy=False)
+
+    s, starts, counts, ind = _get_unique_groups(arr, keep)
 
-    val = arr[0]
-    i=1
-    nkeep = 0
-    while i < n:
-        ind = s[i]
-        if arr[ind] != val:
-            val = arr[ind]
-            nkeep += 1
-            keep[nkeep] = ind
-        i += 1
-
-    keep = keep[0:nkeep+1]
     if values:
-        return arr[keep]
+        res = [arr[ind]]
+    else:
+        res = [ind]
+
+    if return_counts:
+        res.append(counts)
+    if return_inverse:
+        res.append(_get_unique_inverse(s, starts, counts))
+
+    if len(res) == 1:
+        return res[0]
     else:
-        return keep
+        return tuple(res)
 
 
-def rem_dup(arr, flag, values=False):
+def rem_dup(arr, flag=None, values=False, keep='max_flag',
+            return_counts=False, return_inverse=False):
     """
     NAME:
         rem_dup
     
     CALLING SEQUENCE:
-        indices = rem_dup(arr, flag, values=False)
+        indices = rem_dup(arr, flag, values=False, keep='max_flag',
+                          return_counts=False, return_inverse=False)
         indices, values = rem_dup(arr, flag, values=True)
 
     PURPOSE:
-        Return unique values of an array, and optionally their
-        indices in the array.  Keep the duplicate with the
-        largest value of flag.
-        (If flag is not needed, use numpy.unique() instead.)
+        Return indices of the unique values of an array, and optionally the
+        values.  By default keep the duplicate with the largest value of flag.
+        The indices are sorted.
+
+    KEYWORDS:
+        values:  Default False.  If True, also return the unique values.
+        keep: Which of the duplicates to keep.  Default 'max_flag'.
+            'first': The one that appears first in the array.
+            'last': The one that appears last in the array.
+            'max_flag': The one with the largest value of flag.  Ties are
+                resolved in favor of the first in the array.
+            'min_flag': The one with the smallest value of flag.  Ties are
+                resolved in favor of the first in the array.
+        return_counts: Default False.  If True, also return the number of
+            times each unique value occurs.
+        return_inverse: Default False.  If True, also return the indices
+            into the output that reconstruct the input, such that
+            arr == arr[indices][inverse]
+
+        If return_counts or return_inverse are True, they are appended to the
+        returned tuple in that order.
 
     REVISION HISTORY:
         Created 2013, Amy Kimball, CASS.
+        Vectorized, added keep, return_counts, return_inverse
     """
 
-    n = arr.size
-    if n==1:
-        if values:
-            return 0, arr
-        else:
-            return 0
+    if keep not in _rem_dup_keep:
+        raise ValueError("keep should be one of %s, "
+                         "got '%s'" % (_rem_dup_keep, keep))
 
-    s = arr.argsort()   # sort indices
-    sarr = arr[s]       # sorted array
-    
-    keep = numpy.zeros(n, dtype='i8')  # indices of values to keep
-    nkeep = 0
-    sflag = flag[s]  # flags to match sorted array
-    
-    val = sarr[0]    # first value to process
-    f = sflag[0]     # flag for first value
-    
-    for i in range(1,n):
-        if sarr[i] != val:
-            val = sarr[i]
-            f = sflag[i]
-            nkeep += 1
-            keep[nkeep] = i
-        else:
-            if sflag[i] > f:
-                f = sflag[i]
-                keep[nkeep] = i
+    arr = numpy.array(arr, ndmin=1, copy=False)
+
+    if keep in ['max_flag','min_flag']:
+        if flag is None:
+            raise ValueError("send flag for keep='%s'" % keep)
+        flag = numpy.array(flag, ndmin=1, copy=False)
+        if flag.size != arr.size:
+            raise ValueError("flag must be same size as arr, got "
+                             "%d and %d" % (flag.size, arr.size))
+
+    s, starts, counts, ind = _get_unique_groups(arr, keep, flag=flag)
 
-    keep = keep[0:nkeep+1]
-    s = s[keep]
-    s.sort()
+    # order by index in the array
+    order = ind.argsort()
+    ind = ind[order]
+
+    res = [ind]
     if values:
-        return s, arr[s]
+        res.append(arr[ind])
+    if return_counts:
+        res.append(counts[order])
+    if return_inverse:
+        rank = numpy.zeros(order.size, dtype='i8')
+        rank[order] = numpy.arange(order.size)
+        inverse = _get_unique_inverse(s, starts, counts)
+        res.append(rank[inverse])
+
+    if len(res) == 1:
+        return res[0]
+    else:
+        return tuple(res)
+
+_rem_dup_keep=['first','last','max_flag','min_flag']
+
+def _get_unique_groups(arr, keep, flag=None):
+    """
+    Find the groups of equal values in the array, and the index to keep for
+    each group.
+
+    returns
+    -------
+    s: the sort index
+    starts: start of each group in the sorted array
+    counts: number of elements in each group
+    ind: the index to keep for each group
+    """
+
+    # the sort need not be stable, we find the first/last index
+    # in each group with a reduction
+    s = arr.argsort()
+    n = s.size
+    if n == 0:
+        empty = numpy.zeros(0, dtype='i8')
+        return s, empty, empty, empty
+
+    sarr = arr[s]
+
+    isstart = numpy.ones(n, dtype='bool')
+    # not_equal has no ufunc loop for strings, so no out= here
+    isstart[1:] = sarr[1:] != sarr[0:-1]
+    starts, = numpy.where(isstart)
+
+    counts = numpy.diff( numpy.append(starts, n) )
+
+    if keep == 'first':
+        ind = numpy.minimum.reduceat(s, starts)
+    elif keep == 'last':
+        ind = numpy.maximum.reduceat(s, starts)
     else:
-        return s
+        sflag = flag[s]
+        if keep == 'max_flag':
+            best = numpy.maximum.reduceat(sflag, starts)
+        else:
+            best = numpy.minimum.reduceat(sflag, starts)
+
+        # first index in each group that has the best flag value; n is
+        # larger than any index
+        isbest = (sflag == best.repeat(counts))
+        candidates = numpy.where(isbest, s, n)
+        ind = numpy.minimum.reduceat(candidates, starts)
+
+    return s, starts, counts, ind
+
+def _get_unique_inverse(s, starts, counts):
+    """
+    group index for each element of the original array
+    """
+    inverse = numpy.zeros(s.size, dtype='i8')
+    inverse[s] = numpy.arange(starts.size, dtype='i8').repeat(counts)
+    return inverse
 
 
-def match(arr1input, arr2input):
+def match(arr1input, arr2input, method='sort'):
     """
     NAME:
         match
 
     CALLING SEQUENCE:
-        ind1,ind2 = match(arr1, arr2)
+        ind1,ind2 = match(arr1, arr2, method='sort')
 
     PURPOSE:
         match two numpy arrays.  Return the indices of the matches or empty
         arrays if no matches are found.  This means arr1[ind1] == arr2[ind2] is
         true for all corresponding pairs. Arrays must contain only unique
-        elements
+        elements, except for method='hash' which returns all pairs of equal
+        elements.
 
-    METHOD:
-        This is the "sort" method as borrowed from the Goddard idl astronomy
-        library routine match.pro
-    TODO:
-        Implement the histogram method, which is faster but uses more
-        memory.
+    KEYWORDS:
+        method: string, optional
+            'sort': The "sort" method as borrowed from the Goddard idl
+                astronomy library routine match.pro. Works for any type.
+                This is the default.
+            'hash': Build a hash table from the smaller array and probe it
+                with the larger, using the compiled extension.  Integer
+                types only.  This is much faster and uses less memory
+                than 'sort' for large arrays.  The pairs are ordered by
+                their position in the larger array rather than as for
+                'sort', and duplicates are not an error.
+            'histogram': Use the histogram method from match_multi.
+                Integer types only.  Fast for dense ids, but the memory
+                usage scales with the range of the data.
+            'auto': Use 'hash' for integer types if the extension is
+                available, otherwise 'sort'.
 
     REVISION HISTORY:
         Created 2009, Erin Sheldon, NYU.
         Make return arrays empty when no matches are found, as opposed
             to [-1]. This way one can just check match.size > 0
             2010-05-14
+        Added method= keyword, hash method.
     """
 
-    # since where returns i8, we are kind of forced into this
-    dtype='i8'
-
     arr1 = numpy.array(arr1input, ndmin=1, copy=False)
     arr2 = numpy.array(arr2input, ndmin=1, copy=False)
 
+    method = _get_match_method(method, arr1, arr2, 'sort')
+
+    if method=='hash':
+        return _match_hash(arr1, arr2)
+    elif method=='histogram':
+        _check_integer_types(arr1, arr2)
+        _check_unique(arr1)
+        return _match_histogram(arr1, arr2)
+    else:
+        return _match_sort(arr1, arr2)
+
+def _match_sort(arr1, arr2):
+    """
+    The "sort" method as borrowed from the Goddard idl astronomy library
+    routine match.pro
+    """
+    # since where returns i8, we are kind of forced into this
+    dtype='i8'
+
     n1 = len(arr1)
     n2 = len(arr2)
 
@@ -1584,12 +1720,66 @@ def match(arr1input, arr2input):
     sub2 = ind[ numpy.where( vec != 0 ) ]
     return sub1, sub2
 
-def match_multi(arr1input, arr2input):
+def _match_hash(arr1, arr2):
+    """
+    Join the two integer arrays using a hash table built from the smaller
+    one.  All pairs of equal elements are returned, so duplicates are
+    allowed in either array.
+    """
+    _check_integer_types(arr1, arr2)
+
+    a1 = numpy.ascontiguousarray(arr1, dtype='i8')
+    a2 = numpy.ascontiguousarray(arr2, dtype='i8')
+
+    if a1.size <= a2.size:
+        sub1, sub2 = _numpy_util.hash_join(a1, a2)
+    else:
+        sub2, sub1 = _numpy_util.hash_join(a2, a1)
+
+    return sub1, sub2
+
+def _get_match_method(method, arr1, arr2, fallback):
+    """
+    check the requested match method, choosing one for method='auto'
+    """
+    if method not in _match_methods:
+        raise ValueError("method should be one "
+                         "of %s, got '%s'" % (_match_methods, method))
+
+    if method == 'auto':
+        if (have_cnumpy_util
+                and issubclass(arr1.dtype.type,numpy.integer)
+                and issubclass(arr2.dtype.type,numpy.integer)):
+            method='hash'
+        else:
+            method=fallback
+    elif method == 'hash' and not have_cnumpy_util:
+        raise RuntimeError("method='hash' requires the compiled "
+                           "_numpy_util extension")
+
+    return method
+
+_match_methods=['auto','hash','sort','histogram']
+
+def _check_integer_types(arr1, arr2):
+    if (not issubclass(arr1.dtype.type,numpy.integer) or
+            not issubclass(arr2.dtype.type,numpy.integer)) :
+        mess="Error: only works with integer types, got %s %s"
+        mess = mess % (arr1.dtype.type,arr2.dtype.type)
+        raise ValueError(mess)
+
+def _check_unique(arr1):
+    # confirm that arr1 is single-valued
+    test=numpy.unique(arr1)
+    if test.size != arr1.size:
+        raise ValueError("Error: the first array must be unique")
+
+def match_multi(arr1input, arr2input, method='histogram'):
     """
     Match two numpy integer arrays, one of which may be non-unique
     
     The first array must be unique, but the second array may have multiple
-    entries.
+    entries.  With method='hash' both arrays may have multiple entries.
         
     Returns the indices of the matches or empty arrays if no matches are found.
     This means arr1[sub1] == arr2[sub2] is true for all corresponding pairs.
@@ -1600,42 +1790,86 @@ def match_multi(arr1input, arr2input):
         An integer numpy array, must be unique.
     arr2: numpy array, integer type
         An integer numpy array, may have duplicate entries.
+    method: string, optional
+        'hash': Build a hash table from the smaller array and probe it
+            with the larger, using the compiled extension.  Duplicates
+            are allowed in both arrays.  The pairs are ordered by their
+            position in the larger array.
+        'sort': Sort the first array and look up the elements of the
+            second with a binary search.  Pairs are ordered by position
+            in the second array.
+        'histogram': The histogram method; fast for dense ids, but the
+            memory usage scales with the range of the data, so this
+            should not be used for sparse 64-bit ids.  This is the
+            default.
+        'auto': Use 'hash' if the compiled extension is available,
+            otherwise 'sort'.  The first array must still be unique.
 
     method
     ------
-    This uses the method from match_multi.pro from sdssidl.
+    The histogram method is from match_multi.pro from sdssidl.
 
     revision history
     ----------------
     Created 12-12-2013, Eli Rykoff, SLAC
     12-12-2013 raise ValueError for wrong input. Some style changes.
                Use numpy-style doc.  Erin Sheldon, BNL 
+    Added method= keyword, hash and sort methods.
+
+    """
 
+    arr1 = numpy.array(arr1input, ndmin=1, copy=False)
+    arr2 = numpy.array(arr2input, ndmin=1, copy=False)
+
+    # only works for integer data
+    _check_integer_types(arr1, arr2)
+
+    # duplicates in the first array are only allowed when asking
+    # for the hash join explicitly
+    allow_dups = (method == 'hash')
+    method = _get_match_method(method, arr1, arr2, 'sort')
+    if not allow_dups:
+        _check_unique(arr1)
+
+    if method=='hash':
+        return _match_hash(arr1, arr2)
+    elif method=='sort':
+        return _match_multi_sort(arr1, arr2)
+    else:
+        return _match_histogram(arr1, arr2)
+
+def _match_multi_sort(arr1, arr2):
+    """
+    Look up each element of arr2 in the sorted, unique arr1
+    """
+    if arr1.size == 0 or arr2.size == 0:
+        return numpy.array([],dtype='i8'), numpy.array([],dtype='i8')
+
+    s1 = arr1.argsort()
+    sarr1 = arr1[s1]
+
+    pos = sarr1.searchsorted(arr2)
+    pos.clip(0, sarr1.size-1, out=pos)
+
+    sub2, = numpy.where(sarr1[pos] == arr2)
+    sub1 = s1[pos[sub2]]
+    return sub1, sub2
+
+def _match_histogram(arr1, arr2):
+    """
+    The histogram method from match_multi.pro from sdssidl.  arr1 must be
+    unique
     """
 
     dtype = 'i8'
     sub1 = numpy.array([])
     sub2 = numpy.array([])
     
-    arr1 = numpy.array(arr1input, ndmin=1, copy=False)
-    arr2 = numpy.array(arr2input, ndmin=1, copy=False)
+    _check_integer_types(arr1, arr2)
 
     n1 = len(arr1)
     n2 = len(arr2)
 
-    # only works for integer data
-
-    if (not issubclass(arr1.dtype.type,numpy.integer) or
-            not issubclass(arr2.dtype.type,numpy.integer)) :
-        mess="Error: only works with integer types, got %s %s"
-        mess = mess % (arr1.dtype.type,arr2.dtype.type)
-        raise ValueError(mess)
-
-    # confirm that arr1 is single-valued
-    test=numpy.unique(arr1)
-    if test.size != n1:
-        raise ValueError("Error: the first array must be unique")
-
     # check for single-element array
     if (n1 == 1) or (n2 == 1) :
         if (n2 > 1) :
@@ -1691,6 +1925,141 @@ def match_multi(arr1input, arr2input):
     return sub1,sub2
     
 
+def match_sorted_chunks(chunks1, chunks2):
+    """
+    Match two sorted sequences of keys that are delivered in chunks, for
+    example read from files too large to fit in memory.
+
+    This is a generator; for each set of matches found, a tuple (ind1, ind2)
+    is yielded.  The indices are into the full sequences, e.g. the row
+    numbers in the files, so that keys1[ind1] == keys2[ind2].  Only a few
+    chunks are held in memory at any time.
+
+    Duplicates are allowed in both sequences, in which case all pairs of
+    equal keys are returned.
+
+    parameters
+    ----------
+    chunks1: iterable
+        An iterable yielding 1-d arrays of keys.  The concatenation of the
+        chunks must be sorted in ascending order.  Chunks may have different
+        sizes.
+    chunks2: iterable
+        Same for the second sequence.
+
+    examples
+    --------
+    # the keys in both files must be sorted
+    sf1=esutil.sfile.Open(file1)
+    sf2=esutil.sfile.Open(file2)
+    for ind1,ind2 in match_sorted_chunks(sf1.read_chunks(fields='id'),
+                                         sf2.read_chunks(fields='id')):
+        ...
+
+    See also esutil.sfile.match_sorted, which writes the pairs to a file.
+    """
+
+    s1 = _SortedChunkBuffer(chunks1)
+    s2 = _SortedChunkBuffer(chunks2)
+
+    while True:
+        s1.fill()
+        s2.fill()
+
+        if s1.empty() or s2.empty():
+            break
+
+        # keys below this value are complete in both buffers
+        limit = None
+        if not s1.exhausted:
+            limit = s1.keys[-1]
+        if not s2.exhausted:
+            if limit is None or s2.keys[-1] < limit:
+                limit = s2.keys[-1]
+
+        if limit is None:
+            n1 = s1.keys.size
+            n2 = s2.keys.size
+        else:
+            n1 = s1.keys.searchsorted(limit, side='left')
+            n2 = s2.keys.searchsorted(limit, side='left')
+
+        if n1 == 0 and n2 == 0:
+            # all keys in the limiting buffer are equal, need more data
+            if not s1.exhausted and s1.keys[-1] == limit:
+                s1.extend()
+            if not s2.exhausted and s2.keys[-1] == limit:
+                s2.extend()
+            continue
+
+        ind1, ind2 = _match_sorted_many(s1.keys[0:n1], s2.keys[0:n2])
+        if ind1.size > 0:
+            yield ind1 + s1.start, ind2 + s2.start
+
+        s1.drop(n1)
+        s2.drop(n2)
+
+def _match_sorted_many(keys1, keys2):
+    """
+    All pairs of equal elements in two sorted arrays
+    """
+    left = keys2.searchsorted(keys1, side='left')
+    right = keys2.searchsorted(keys1, side='right')
+    counts = right-left
+
+    ntot = counts.sum()
+    if ntot == 0:
+        return numpy.zeros(0, dtype='i8'), numpy.zeros(0, dtype='i8')
+
+    ind1 = numpy.arange(keys1.size, dtype='i8').repeat(counts)
+
+    # position within each run of duplicates in keys2
+    starts = counts.cumsum() - counts
+    ind2 = numpy.arange(ntot, dtype='i8')
+    ind2 += (left-starts).repeat(counts)
+
+    return ind1, ind2
+
+class _SortedChunkBuffer(object):
+    """
+    Buffer sorted keys from an iterator of chunks, checking the order
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.keys = None
+        self.start = 0
+        self.exhausted = False
+
+    def empty(self):
+        return self.keys is None or self.keys.size == 0
+
+    def fill(self):
+        while self.empty() and not self.exhausted:
+            self.extend()
+
+    def extend(self):
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.exhausted=True
+            return
+
+        chunk = numpy.array(chunk, ndmin=1, copy=False)
+        if chunk.size == 0:
+            return
+
+        if (chunk.size > 1 and (chunk[1:] < chunk[0:-1]).any()) \
+                or (not self.empty() and chunk[0] < self.keys[-1]):
+            raise ValueError("keys must be sorted in ascending order")
+
+        if self.keys is None:
+            self.keys = chunk
+        else:
+            self.keys = numpy.concatenate( (self.keys, chunk) )
+
+    def drop(self, n):
+        self.keys = self.keys[n:]
+        self.start += n
 
 
 def strmatch(arr, regex):
@@ -10,6 +10,8 @@ functions:
         decomposition.  Uses the CholeskySampler
     random_indices:
         Get a unique random selection of indices in [0,imax)
+    reservoir_sample:
+        Draw a random sample from a stream of arrays of unknown length
 
 Classes:
 
@@ -25,6 +27,10 @@ Classes:
     CholeskySampler
         sample a multivariate covariant distribution using cholesky
         decomposition
+
+    ReservoirSampler
+        Accumulate a random sample of fixed size from chunks of data, for
+        example from read_chunks, in a single pass.
 """
 try:
     import numpy
@@ -224,7 +230,12 @@ class Generator(object):
         elif self.method == 'cut':
             return self.genrand_cut(numrand, seed=None)
 
-    def genrand_accum(self, numrand, seed=None):
+    def genrand_accum(self, numrand, seed=None, out=None):
+        """
+        Generate randoms by interpolating the inverse of the cumulative
+        distribution.  Send out= to write into an existing float32 or
+        float64 array of size numrand.
+        """
         if seed is not None:
             numpy.random.seed(seed=seed)
 
@@ -232,8 +243,11 @@ class Generator(object):
         urand = numpy.random.random(numrand)
 
         # to get randoms from the distribution, we interpolate the x(pcum) at
-        # the test rand values.  Clever!
-        rand = stat.interplin(self.xvals, self.pcum, urand)
+        # the test rand values.  Clever!  The interpolator is reused for
+        # all calls
+        if not hasattr(self, 'interp'):
+            self.interp = stat.Interpolator(self.pcum, self.xvals)
+        rand = self.interp(urand, out=out)
 
         return rand
 
@@ -1116,18 +1130,165 @@ def random_indices(imax, nrand, **keys):
         If False, the sample will have replacement, and nrand
         can be greater than imax
     seed: int
-        A seed for the random number generator
+        A seed for the random number generator.  If not sent, a seed
+        is drawn from numpy.random.
+    sort: bool, optional
+        If True, the default, the indices are returned sorted, otherwise in
+        random order.  Only used for unique=True
+
+    The unique indices are drawn with Vitter's method D, so the time taken
+    is proportional to nrand rather than imax.
     """
     unique = keys.get('unique',True)
     seed=keys.get('seed',None)
+    sort=keys.get('sort',True)
     if seed is None:
-        import time
-        seed=int( time.time() )
+        seed=numpy.random.randint(0, 2**31-1)
 
     if not unique:
         return numpy.random.randint(0, imax, nrand)
     else:
-        return stat._stat_util.random_sample(imax, nrand, seed)
+        return stat._stat_util.random_sample(imax, nrand, seed,
+                                             1 if sort else 0)
+
+class ReservoirSampler(object):
+    """
+    Accumulate a random sample of fixed size from a stream of data of
+    unknown length, in a single pass.  Each element of the stream has the
+    same chance of being in the sample.
+
+    The data are sent in chunks with update(), for example from
+    Recfile.read_chunks, and the sample is retrieved with result().  Uses
+    Li's algorithm L, which draws the number of elements to skip before
+    the next replacement, so the cost is dominated by the number of
+    replacements, of order nrand*log(n/nrand), rather than the length n of
+    the stream.
+
+    parameters
+    ----------
+    nrand: int
+        The size of the sample.
+    seed: int, optional
+        A seed for the random number generator
+
+    example
+    -------
+    rs=ReservoirSampler(10000, seed=35)
+    for data in rec.read_chunks(chunksize=1000000):
+        rs.update(data)
+
+    sample, indices = rs.result()
+    """
+    def __init__(self, nrand, seed=None):
+        nrand=int(nrand)
+        if nrand < 1:
+            raise ValueError("nrand must be >= 1, got %s" % nrand)
+        self.nrand=nrand
+        self.rng=numpy.random.RandomState(seed)
+
+        self.nseen=0
+        self.nfilled=0
+        self.sample=None
+        self.indices=numpy.zeros(nrand, dtype='i8')
+
+    def update(self, data):
+        """
+        Add the next chunk of the stream.  data should be an array
+        """
+        data=numpy.asanyarray(data)
+        n=len(data)
+        if n == 0:
+            return
+
+        if self.sample is None:
+            self.sample=numpy.zeros(self.nrand, dtype=data.dtype)
+            if data.ndim > 1:
+                self.sample=numpy.zeros( (self.nrand,)+data.shape[1:],
+                                        dtype=data.dtype)
+
+        start=0
+        if self.nfilled < self.nrand:
+            nfill=min(self.nrand-self.nfilled, n)
+            self.sample[self.nfilled:self.nfilled+nfill] = data[0:nfill]
+            self.indices[self.nfilled:self.nfilled+nfill] = \
+                    self.nseen + numpy.arange(nfill)
+            self.nfilled += nfill
+            start=nfill
+
+            if self.nfilled == self.nrand:
+                self._w=numpy.exp(numpy.log(self._uniform())/self.nrand)
+                self._next=self.nseen+nfill-1 + self._get_skip()
+
+        if self.nfilled == self.nrand:
+            stop=self.nseen+n
+            while self._next < stop:
+                islot=self.rng.randint(0, self.nrand)
+                self.sample[islot] = data[self._next-self.nseen]
+                self.indices[islot] = self._next
+
+                self._w *= numpy.exp(numpy.log(self._uniform())/self.nrand)
+                self._next += self._get_skip()
+
+        self.nseen += n
+
+    def result(self, sort=True):
+        """
+        Get the sample and the indices of the sampled elements in the
+        stream.  If fewer than nrand elements were seen, all of them are
+        returned.
+
+        parameters
+        ----------
+        sort: bool, optional
+            If True, the default, sort the sample by position in the stream.
+        """
+        if self.sample is None:
+            raise RuntimeError("no data have been added")
+
+        sample=self.sample[0:self.nfilled]
+        indices=self.indices[0:self.nfilled]
+        if sort:
+            s=indices.argsort()
+            sample=sample[s]
+            indices=indices[s]
+        else:
+            sample=sample.copy()
+            indices=indices.copy()
+        return sample, indices
+
+    def _uniform(self):
+        # in (0,1] so the log is defined
+        return 1.0-self.rng.random_sample()
+
+    def _get_skip(self):
+        return int( numpy.floor( numpy.log(self._uniform())
+                                /numpy.log1p(-self._w) ) ) + 1
+
+def reservoir_sample(chunks, nrand, seed=None, sort=True):
+    """
+    Draw a random sample of fixed size from a stream of data of unknown
+    length, in a single pass.  See ReservoirSampler for details.
+
+    parameters
+    ----------
+    chunks: iterable
+        An iterable yielding arrays, for example Recfile.read_chunks
+    nrand: int
+        The size of the sample.
+    seed: int, optional
+        A seed for the random number generator
+    sort: bool, optional
+        If True, the default, sort the sample by position in the stream.
+
+    returns
+    -------
+    sample, indices:
+        The sampled elements, and their indices in the stream.
+    """
+    rs=ReservoirSampler(nrand, seed=seed)
+    for data in chunks:
+        rs.update(data)
+    return rs.result(sort=sort)
 
 def randind(nmax, nrand, dtype=None):
     """
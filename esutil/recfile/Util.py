@@ -110,6 +110,10 @@ Useful Recfile Class Methods:
         file can be specified with the keywords.  Fields must be unique but
         can be in any order.
 
+    read_chunks(chunksize=, fields=):
+        A generator returning the data in chunks of rows, for
+        files that do not fit into memory.
+
     write(numpy_array):
         Write the input numpy array to the file.  The array must have
         field names defined.
@@ -478,6 +482,45 @@ class Recfile(object):
         else:
             return result
 
+    def read_chunks(self, chunksize=1000000, fields=None, columns=None,
+                    view=None, split=False):
+        """
+        Class:
+            Recfile
+        Method:
+            read_chunks
+        Purpose:
+            A generator to read the records in chunks of rows, for
+            processing files that do not fit into memory.
+        Syntax:
+            r=recfile.Open(...)
+            for data in r.read_chunks(chunksize=1000000,
+                                      fields=None, columns=None,
+                                      view=None, split=False):
+                ...
+
+        Inputs:
+            chunksize: The number of rows to read at a time. The last
+                chunk may be smaller.
+            fields or columns: A scalar, sequence, or array indicating
+                a subset of field to read. Only these fields are read
+                from the file.
+            view, split: Same meaning as for the read() method.
+        """
+
+        if self.fobj is None:
+            raise ValueError("You have not yet opened a file")
+
+        chunksize=int(chunksize)
+        if chunksize < 1:
+            raise ValueError("chunksize must be >= 1, got %s" % chunksize)
+
+        for start in xrange(0, self.nrows, chunksize):
+            stop = min(start+chunksize, self.nrows)
+            rows = numpy.arange(start, stop, dtype='intp')
+            yield self.read(rows=rows, fields=fields, columns=columns,
+                            view=view, split=split)
+
     def write(self, data):
         """
         Class:
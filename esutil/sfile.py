@@ -36,6 +36,9 @@ Convenience functions:
         from the simple file format. Uses an SFile instance internally.
     write(): A convenience function to write data to the simple file format,
         including an ascii header. Uses an SFile instance internally.
+    match_sorted(): Match two tables on a sorted key field, reading in
+        chunks so the tables need not fit into memory.  The matched row
+        numbers are written to a binary file in this format.
 
     For more docs, check the docs for the individual functions.
 
@@ -571,6 +574,37 @@ class SFile:
         else:
             return result
 
+    def read_chunks(self, chunksize=1000000, fields=None, columns=None,
+                    view=None, split=False, reduce=False):
+        """
+        A generator to read the data in chunks of rows.  Useful for
+        processing files that do not fit into memory.  Only the requested
+        fields are read.  Only works for record types.
+
+        for data in sf.read_chunks(chunksize=1000000, fields=['id']):
+            ...
+        """
+        if not self.has_fields:
+            raise RuntimeError("For simple arrays, use a memmap "
+                               "object returned by get_memmap()")
+        if not have_recfile:
+            raise ImportError("recfile package not found.  recfile is "
+                              "required for reading in chunks")
+
+        if self.fobj.tell() != self.data_start:
+            self.fobj.seek(self.data_start)
+
+        fields2read = self._get_fields2read(fields, columns=columns)
+
+        robj = recfile.Open(self.fobj, nrows=self.size, mode='r', 
+                            offset=self.data_start,
+                            dtype=self.dtype, delim=self.delim)
+        for data in robj.read_chunks(chunksize=chunksize, fields=fields2read,
+                                     view=view, split=split):
+            if reduce:
+                data = reduce_array(data)
+            yield data
+
     def __getitem__(self, arg):
         """
 
@@ -1198,6 +1232,109 @@ def read(infile, **keys):
 
     
 
+def match_sorted(input1, input2, outfile, 
+                 field1=None, field2=None, 
+                 chunksize=1000000, header=None, verbose=False):
+    """
+    Name:
+        sfile.match_sorted()
+
+    Calling Sequence:
+        npairs = sfile.match_sorted(input1, input2, outfile, 
+                                    field1=None, field2=None, 
+                                    chunksize=1000000, header=None,
+                                    verbose=False)
+
+    Match two tables on a key field that is sorted in both, writing the
+    indices of the matched rows to a binary sfile.  The inputs are read in
+    chunks so tables larger than memory can be matched.  Only the key field
+    is read from the inputs.
+
+    Duplicate keys are allowed in both tables, in which case all pairs of
+    equal keys are written.
+
+    Inputs:
+        input1, input2: 
+            File names, SFile or Recfile objects, or any iterable yielding
+            arrays of keys.  The keys must be sorted in ascending order.
+        outfile: A string or file pointer for the output file.
+
+    Optional Inputs:
+        field1: The name of the key field in input1. Required when input1
+            is a file.
+        field2: The name of the key field in input2.  Default is the same
+            as field1.
+        chunksize: The number of rows to read at a time.  Default 1000000.
+        header=: A dictionary containing keyword-value pairs to be added to
+            the header of the output file.
+        verbose=False: Write informative messages.
+
+    Outputs:
+        The number of pairs written.  The output file holds a structured
+        array with fields
+            'i1': The row numbers of matches in input1
+            'i2': The row numbers of matches in input2
+        such that keys1[i1] == keys2[i2].  It can be read or memory
+        mapped back using sfile.read()
+
+    Examples:
+        n=sfile.match_sorted('cat1.rec', 'cat2.rec', 'pairs.rec',
+                             field1='id')
+        pairs=sfile.read('pairs.rec', memmap=True)
+    """
+    from .numpy_util import match_sorted_chunks
+
+    if field2 is None:
+        field2=field1
+
+    chunks1, sf1 = _get_key_chunks(input1, field1, chunksize, verbose)
+    chunks2, sf2 = _get_key_chunks(input2, field2, chunksize, verbose)
+
+    dtype=[('i1','i8'),('i2','i8')]
+
+    npairs=0
+    with SFile(outfile, mode='w+', verbose=verbose) as sfout:
+        # always write a header, even if there are no matches
+        sfout.write(numpy.zeros(0, dtype=dtype), header=header)
+
+        for ind1,ind2 in match_sorted_chunks(chunks1, chunks2):
+            pairs = numpy.zeros(ind1.size, dtype=dtype)
+            pairs['i1'] = ind1
+            pairs['i2'] = ind2
+            sfout.write(pairs)
+
+            npairs += pairs.size
+            if verbose:
+                stdout.write("\tmatched %s pairs\n" % npairs)
+
+    for sf in [sf1,sf2]:
+        if sf is not None:
+            sf.close()
+
+    return npairs
+
+def _get_key_chunks(input, field, chunksize, verbose):
+    """
+    Get an iterator of key chunks from the input.  If we opened a file,
+    return the SFile object as well so it can be closed.
+    """
+    sf=None
+    if isstring(input):
+        sf=SFile(input, verbose=verbose)
+        input=sf
+
+    if isinstance(input, SFile) or (have_recfile 
+                                    and isinstance(input, recfile.Recfile)):
+        if field is None:
+            raise ValueError("send the name of the key field "
+                             "when matching files")
+        chunks = input.read_chunks(chunksize=chunksize, fields=field)
+        chunks = (data[field] for data in chunks)
+    else:
+        chunks = input
+
+    return chunks, sf
+
 def read_header(infile, verbose=False):
     """
     Name:
@@ -1,58 +1,1394 @@
 #include <Python.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <pthread.h>
 #include <numpy/arrayobject.h> 
 
+/*
+ * xoshiro256** generator, seeded from a single integer with splitmix64
+ */
+struct xoshiro {
+    npy_uint64 s[4];
+};
+
+static inline npy_uint64 rotl64(npy_uint64 x, int k)
+{
+    return (x << k) | (x >> (64 - k));
+}
+
+static void xoshiro_seed(struct xoshiro *self, npy_uint64 seed)
+{
+    int i=0;
+    npy_uint64 z=0;
+    for (i=0; i<4; i++) {
+        seed += 0x9e3779b97f4a7c15ull;
+        z = seed;
+        z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ull;
+        z = (z ^ (z >> 27)) * 0x94d049bb133111ebull;
+        self->s[i] = z ^ (z >> 31);
+    }
+}
+
+static inline npy_uint64 xoshiro_next(struct xoshiro *self)
+{
+    npy_uint64 *s=self->s;
+    npy_uint64 result = rotl64(s[1] * 5, 7) * 9;
+    npy_uint64 t = s[1] << 17;
+
+    s[2] ^= s[0];
+    s[3] ^= s[1];
+    s[1] ^= s[2];
+    s[0] ^= s[3];
+    s[2] ^= t;
+    s[3] = rotl64(s[3], 45);
+    return result;
+}
+
+// uniform in the open interval (0,1), so the log is always defined
+static inline double xoshiro_uniform(struct xoshiro *self)
+{
+    return ((xoshiro_next(self) >> 11) + 0.5) * (1.0/9007199254740992.0);
+}
+
+/*
+ * Vitter's Method A, sequential sampling of n of the next N indices after
+ * "current", used by method D when n is a large fraction of N
+ */
+static void vitter_a(struct xoshiro *rng, npy_int64 n, npy_int64 N,
+                     npy_int64 current, npy_intp *out)
+{
+    double top=N-n, Nreal=N, V=0, quot=0;
+    npy_int64 S=0;
+
+    while (n >= 2) {
+        V = xoshiro_uniform(rng);
+        S=0;
+        quot = top/Nreal;
+        while (quot > V) {
+            S++;
+            top -= 1.0;
+            Nreal -= 1.0;
+            quot = (quot*top)/Nreal;
+        }
+        current += S+1;
+        *out++ = current;
+        Nreal -= 1.0;
+        n--;
+    }
+    S = (npy_int64) floor(Nreal*xoshiro_uniform(rng));
+    current += S+1;
+    *out = current;
+}
+
+/*
+ * Vitter's Method D (Vitter 1987, ACM Trans. Math. Softw. 13, 58),
+ * sequential sampling of n indices from [0,N) without replacement.
+ *
+ * The gaps between selected indices are drawn directly, so the work is
+ * proportional to n rather than N.  The indices come out sorted.
+ */
+static void vitter_d(struct xoshiro *rng, npy_int64 n, npy_int64 N,
+                     npy_intp *out)
+{
+    const npy_int64 negalphainv=-13;
+    double nreal=n, ninv=1.0/n, Nreal=N, nmin1inv=0;
+    double Vprime=0, qu1real=0, X=0, U=0, negSreal=0;
+    double y1=0, y2=0, top=0, bottom=0;
+    npy_int64 qu1=0, threshold=-negalphainv*n, S=0, limit=0, t=0;
+    npy_int64 current=-1;
+
+    Vprime = exp(log(xoshiro_uniform(rng))*ninv);
+    qu1 = N-n+1;
+    qu1real = Nreal-nreal+1.0;
+
+    while (n > 1 && threshold < N) {
+        nmin1inv = 1.0/(nreal-1.0);
+        while (1) {
+            // generate a candidate gap S
+            while (1) {
+                X = Nreal*(1.0-Vprime);
+                S = (npy_int64) X;
+                if (S < qu1) {
+                    break;
+                }
+                Vprime = exp(log(xoshiro_uniform(rng))*ninv);
+            }
+            U = xoshiro_uniform(rng);
+            negSreal = -S;
+
+            // quick acceptance test
+            y1 = exp(log(U*Nreal/qu1real)*nmin1inv);
+            Vprime = y1*(1.0-X/Nreal)*(qu1real/(negSreal+qu1real));
+            if (Vprime <= 1.0) {
+                break;
+            }
+
+            // full acceptance test
+            y2 = 1.0;
+            top = Nreal-1.0;
+            if (n-1 > S) {
+                bottom = Nreal-nreal;
+                limit = N-S;
+            } else {
+                bottom = Nreal+negSreal-1.0;
+                limit = qu1;
+            }
+            for (t=N-1; t>=limit; t--) {
+                y2 = (y2*top)/bottom;
+                top -= 1.0;
+                bottom -= 1.0;
+            }
+            if (Nreal/(Nreal-X) >= y1*exp(log(y2)*nmin1inv)) {
+                Vprime = exp(log(xoshiro_uniform(rng))*nmin1inv);
+                break;
+            }
+            Vprime = exp(log(xoshiro_uniform(rng))*ninv);
+        }
+
+        current += S+1;
+        *out++ = current;
+
+        N = N-S-1;
+        Nreal = Nreal+negSreal-1.0;
+        n--;
+        nreal -= 1.0;
+        ninv = nmin1inv;
+        qu1 -= S;
+        qu1real += negSreal;
+        threshold += negalphainv;
+    }
+
+    if (n > 1) {
+        vitter_a(rng, n, N, current, out);
+    } else {
+        S = (npy_int64) (N*Vprime);
+        current += S+1;
+        *out = current;
+    }
+}
+
+/*
+ * Draw a unique random sample of nrand indices from [0,nmax) using
+ * Vitter's method D.  The indices are sorted unless dosort is zero, in
+ * which case they are shuffled into random order.
+ */
 static PyObject *
 PyStatUtil_random_sample(PyObject *self, PyObject *args) 
 {
     PyObject* randind_obj=NULL;
-    npy_intp *randind=NULL;
-    long int nmax=0, nrand=0, seed=0;
+    npy_intp *randind=NULL, tmp=0;
+    long long nmax=0, nrand=0, seed=0;
     npy_intp dims[1];
-    long int i=0, ntoselect=0, ntocheck=0;
-    double prob=0;
-    if (!PyArg_ParseTuple(args, (char*)"lll", &nmax, &nrand, &seed)) {
+    npy_int64 i=0, j=0;
+    int dosort=1;
+    struct xoshiro rng;
+
+    if (!PyArg_ParseTuple(args, (char*)"LLL|i", &nmax, &nrand, &seed, &dosort)) {
         return NULL;
     }
 
     if (nmax <= 0 || nrand <= 0) {
-        PyErr_Format(PyExc_ValueError,"nmax/nrand must be >= 0, got %ld/%ld", nmax, nrand);
+        PyErr_Format(PyExc_ValueError,"nmax/nrand must be > 0, got %lld/%lld", nmax, nrand);
         return NULL;
     }
     if (nrand > nmax) {
-        PyErr_Format(PyExc_ValueError,"nrand must be <= nmax, got %ld/%ld", nmax, nrand);
+        PyErr_Format(PyExc_ValueError,"nrand must be <= nmax, got %lld/%lld", nmax, nrand);
         return NULL;
     }
 
-
-    srand48(seed);
-
     dims[0] = nrand;
     randind_obj = PyArray_SimpleNew(1, dims, NPY_INTP);
-    randind = PyArray_DATA(randind_obj);
+    if (randind_obj == NULL) {
+        return NULL;
+    }
+    randind = PyArray_DATA((PyArrayObject*)randind_obj);
+
+    Py_BEGIN_ALLOW_THREADS
+
+    xoshiro_seed(&rng, (npy_uint64) seed);
+    vitter_d(&rng, nrand, nmax, randind);
+
+    if (!dosort) {
+        // Fisher-Yates shuffle
+        for (i=nrand-1; i>0; i--) {
+            j = (npy_int64) floor((i+1)*xoshiro_uniform(&rng));
+            tmp = randind[i];
+            randind[i] = randind[j];
+            randind[j] = tmp;
+        }
+    }
+
+    Py_END_ALLOW_THREADS
+
+    return randind_obj;
+}
+
+
+/*
+ * Histogram the data with a counting sort, optionally calculating the
+ * reverse indices in the same format as the chist module.
+ *
+ * Only data in the range [dmin,dmax] are used.  One pass counts the data
+ * in each bin, a prefix sum of the histogram gives the start of each bin in
+ * the reverse indices, and a second pass scatters the indices into place,
+ * so no sort of the data is needed.
+ *
+ * The histogram and the reverse index offsets are the same as those found by
+ * running chist on the sorted data.  Within each bin the indices are in
+ * increasing order rather than sorted by value.  As for chist, data in the
+ * range whose bin number is not in [0,nbin) are placed at the end of the
+ * reverse indices and are not counted in the histogram.
+ *
+ * Returns a tuple (hist, rev, nuse) where rev is None if not requested and
+ * nuse is the number of data in [dmin,dmax]
+ */
+static PyObject *
+PyStatUtil_hist_rev(PyObject *self, PyObject *args) 
+{
+    PyObject *data_obj=NULL, *hist_obj=NULL, *rev_obj=NULL, *output_tuple=NULL;
+    const double *data=NULL;
+    npy_int64 *hist=NULL, *rev=NULL, *pos=NULL;
+    double dmin=0, dmax=0, binsize=0, val=0;
+    long int nbin=0;
+    int dorev=0;
+    npy_intp ndata=0, nuse=0, nin=0, revsize=0, outpos=0, i=0;
+    npy_int64 binnum=0, lastbin=-1, offset=0;
+    npy_intp dims[1];
+
+    if (!PyArg_ParseTuple(args, (char*)"O!dddli", 
+                          &PyArray_Type, &data_obj,
+                          &dmin, &dmax, &binsize, &nbin, &dorev)) {
+        return NULL;
+    }
+    if (PyArray_TYPE((PyArrayObject*)data_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)data_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "data must be a contiguous, aligned, native float64 array");
+        return NULL;
+    }
+    if (nbin <= 0) {
+        PyErr_Format(PyExc_ValueError,"nbin must be > 0, got %ld", nbin);
+        return NULL;
+    }
+
+    data = PyArray_DATA((PyArrayObject*)data_obj);
+    ndata = PyArray_SIZE((PyArrayObject*)data_obj);
 
-    ntoselect=nrand;
-    ntocheck=nmax;
+    dims[0] = nbin;
+    hist_obj = PyArray_ZEROS(1, dims, NPY_INT64, 0);
+    if (hist_obj == NULL) {
+        return NULL;
+    }
+    hist = PyArray_DATA((PyArrayObject*)hist_obj);
 
-    ntocheck=nmax;
-    for (i=0; i<nmax; i++) {
+    Py_BEGIN_ALLOW_THREADS
+    for (i=0; i<ndata; i++) {
+        val = data[i];
+        if (val >= dmin && val <= dmax) {
+            nuse++;
+            binnum = (npy_int64)( (val-dmin)/binsize );
+            if (binnum >= 0 && binnum < nbin) {
+                hist[binnum] += 1;
+                nin++;
+            }
+        }
+    }
+    Py_END_ALLOW_THREADS
 
-        prob = ( (double) ntoselect ) / ((double) ntocheck );
-        if (drand48() < prob) {
-            randind[nrand-ntoselect] = i;
-            ntoselect -= 1;
+    if (dorev) {
+        revsize = nuse + nbin + 1;
+        dims[0] = revsize;
+        rev_obj = PyArray_SimpleNew(1, dims, NPY_INT64);
+        pos = malloc(nbin*sizeof(npy_int64));
+        if (rev_obj == NULL || pos == NULL) {
+            Py_DECREF(hist_obj);
+            Py_XDECREF(rev_obj);
+            free(pos);
+            return PyErr_NoMemory();
         }
-        if (ntoselect == 0) {
+        rev = PyArray_DATA((PyArrayObject*)rev_obj);
+
+        Py_BEGIN_ALLOW_THREADS
+
+        for (binnum=0; binnum<nbin; binnum++) {
+            if (hist[binnum] > 0) {
+                lastbin = binnum;
+            }
+        }
+
+        // bins past the last filled one point to the end of the array, so
+        // the last filled bin also takes any data outside of the bins
+        offset = nbin+1;
+        for (binnum=0; binnum<=nbin; binnum++) {
+            if (binnum <= lastbin) {
+                rev[binnum] = offset;
+                pos[binnum] = offset;
+                offset += hist[binnum];
+            } else {
+                rev[binnum] = revsize;
+            }
+        }
+
+        outpos = nbin + 1 + nin;
+        for (i=0; i<ndata; i++) {
+            val = data[i];
+            if (val >= dmin && val <= dmax) {
+                binnum = (npy_int64)( (val-dmin)/binsize );
+                if (binnum >= 0 && binnum < nbin) {
+                    rev[pos[binnum]] = i;
+                    pos[binnum] += 1;
+                } else {
+                    rev[outpos] = i;
+                    outpos++;
+                }
+            }
+        }
+
+        Py_END_ALLOW_THREADS
+
+        free(pos);
+    } else {
+        Py_INCREF(Py_None);
+        rev_obj = Py_None;
+    }
+
+    output_tuple = PyTuple_New(3);
+    PyTuple_SetItem(output_tuple, 0, hist_obj);
+    PyTuple_SetItem(output_tuple, 1, rev_obj);
+    PyTuple_SetItem(output_tuple, 2, PyLong_FromSsize_t(nuse));
+    return output_tuple;
+}
+
+
+/*
+ * Partially sort the array so that element k is the k-th smallest, with
+ * smaller or equal elements before it.  Quickselect with a median of three
+ * pivot.
+ */
+static void select_kth(double *a, npy_intp n, npy_intp k)
+{
+    npy_intp lo=0, hi=n-1, mid=0, i=0, j=0;
+    double pivot=0, tmp=0;
+
+    while (hi > lo) {
+        mid = lo + (hi-lo)/2;
+        if (a[mid] < a[lo]) { tmp=a[mid]; a[mid]=a[lo]; a[lo]=tmp; }
+        if (a[hi] < a[lo])  { tmp=a[hi];  a[hi]=a[lo];  a[lo]=tmp; }
+        if (a[hi] < a[mid]) { tmp=a[hi];  a[hi]=a[mid]; a[mid]=tmp; }
+        pivot = a[mid];
+
+        i=lo;
+        j=hi;
+        while (i <= j) {
+            while (a[i] < pivot) i++;
+            while (a[j] > pivot) j--;
+            if (i <= j) {
+                tmp=a[i]; a[i]=a[j]; a[j]=tmp;
+                i++;
+                j--;
+            }
+        }
+        if (k <= j) {
+            hi=j;
+        } else if (k >= i) {
+            lo=i;
+        } else {
             break;
         }
+    }
+}
 
-        ntocheck -= 1;
+/*
+ * Median of each segment of the data, where segment i is
+ * data[offsets[i]:offsets[i+1]].  The median of an even number of elements
+ * is the mean of the two middle elements, as for numpy.median.  Each
+ * segment of a copy of the data is partially sorted, so this is linear in
+ * the number of elements.  Empty segments get NaN.
+ */
+static PyObject *
+PyStatUtil_segment_median(PyObject *self, PyObject *args) 
+{
+    PyObject *data_obj=NULL, *offsets_obj=NULL, *median_obj=NULL;
+    const double *data=NULL;
+    const npy_int64 *offsets=NULL;
+    double *median=NULL, *work=NULL, *seg=NULL, lowmax=0;
+    npy_intp ndata=0, nseg=0, i=0, j=0, n=0, k=0;
+    npy_intp dims[1];
+
+    if (!PyArg_ParseTuple(args, (char*)"O!O!", 
+                          &PyArray_Type, &data_obj,
+                          &PyArray_Type, &offsets_obj)) {
+        return NULL;
     }
-    return randind_obj;
+    if (PyArray_TYPE((PyArrayObject*)data_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)data_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "data must be a contiguous, aligned, native float64 array");
+        return NULL;
+    }
+    if (PyArray_TYPE((PyArrayObject*)offsets_obj) != NPY_INT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)offsets_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "offsets must be a contiguous, aligned, native int64 array");
+        return NULL;
+    }
+
+    data = PyArray_DATA((PyArrayObject*)data_obj);
+    ndata = PyArray_SIZE((PyArrayObject*)data_obj);
+    offsets = PyArray_DATA((PyArrayObject*)offsets_obj);
+    nseg = PyArray_SIZE((PyArrayObject*)offsets_obj) - 1;
+    if (nseg < 0) {
+        PyErr_Format(PyExc_ValueError,"offsets must have at least one element");
+        return NULL;
+    }
+    for (i=0; i<nseg; i++) {
+        if (offsets[i] < 0 || offsets[i+1] < offsets[i] || offsets[i+1] > ndata) {
+            PyErr_Format(PyExc_ValueError,
+                         "offsets must be non-decreasing and within the data, "
+                         "got [%ld,%ld] for segment %ld",
+                         (long)offsets[i], (long)offsets[i+1], (long)i);
+            return NULL;
+        }
+    }
+
+    dims[0] = nseg;
+    median_obj = PyArray_SimpleNew(1, dims, NPY_FLOAT64);
+    work = malloc((ndata > 0 ? ndata : 1)*sizeof(double));
+    if (median_obj == NULL || work == NULL) {
+        Py_XDECREF(median_obj);
+        free(work);
+        return PyErr_NoMemory();
+    }
+    median = PyArray_DATA((PyArrayObject*)median_obj);
+
+    Py_BEGIN_ALLOW_THREADS
+    memcpy(work, data, ndata*sizeof(double));
+    for (i=0; i<nseg; i++) {
+        seg = work + offsets[i];
+        n = offsets[i+1] - offsets[i];
+        if (n == 0) {
+            median[i] = Py_NAN;
+            continue;
+        }
+
+        k = n/2;
+        select_kth(seg, n, k);
+        if ( (n % 2) == 1 ) {
+            median[i] = seg[k];
+        } else {
+            // the other middle element is the largest of the lower part
+            lowmax = seg[0];
+            for (j=1; j<k; j++) {
+                if (seg[j] > lowmax) {
+                    lowmax = seg[j];
+                }
+            }
+            median[i] = (lowmax + seg[k])/2.;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    free(work);
+    return median_obj;
+}
+
+
+/*
+ * Mean, error and standard deviation of n elements, unweighted or
+ * weighted as for esutil.stat.wmom with calcerr=True, sdev=True
+ */
+static void clip_stats(const double *x, const double *w, npy_intp n,
+                       double *mean, double *err, double *sdev)
+{
+    npy_intp i=0;
+    double sum=0, wsum=0, diff=0, var=0, werr2=0;
+
+    if (w == NULL) {
+        for (i=0; i<n; i++) {
+            sum += x[i];
+        }
+        *mean = sum/n;
+        for (i=0; i<n; i++) {
+            diff = x[i] - *mean;
+            var += diff*diff;
+        }
+        *sdev = sqrt(var/n);
+        *err = *sdev/sqrt( (double) n);
+    } else {
+        for (i=0; i<n; i++) {
+            sum += w[i]*x[i];
+            wsum += w[i];
+        }
+        *mean = sum/wsum;
+        for (i=0; i<n; i++) {
+            diff = x[i] - *mean;
+            var += w[i]*diff*diff;
+            werr2 += w[i]*w[i]*diff*diff;
+        }
+        *sdev = sqrt(var/wsum);
+        *err = sqrt(werr2)/wsum;
+    }
+}
+
+struct sigma_clip_info {
+    double *x;
+    double *w;
+    const npy_int64 *offsets;
+    npy_intp start;
+    npy_intp stop;
+    long int niter;
+    double nsig;
+    double *mean;
+    double *err;
+    double *sdev;
+    npy_int64 *nuse;
+};
+
+/*
+ * Sigma clip the segments [start,stop).  The data for each segment are
+ * partitioned in place, so the data kept are always at the front.
+ */
+static void *sigma_clip_range(void *arg)
+{
+    struct sigma_clip_info *info = arg;
+    npy_intp iseg=0, i=0, n=0, nkeep=0;
+    long int iter=0;
+    double *x=NULL, *w=NULL, m=0, e=0, s=0, clip=0, tmp=0;
+
+    for (iseg=info->start; iseg<info->stop; iseg++) {
+        x = info->x + info->offsets[iseg];
+        w = NULL;
+        if (info->w != NULL) {
+            w = info->w + info->offsets[iseg];
+        }
+        n = info->offsets[iseg+1] - info->offsets[iseg];
+        if (n == 0) {
+            info->mean[iseg] = info->err[iseg] = info->sdev[iseg] = Py_NAN;
+            info->nuse[iseg] = 0;
+            continue;
+        }
+
+        clip_stats(x, w, n, &m, &e, &s);
+        for (iter=1; iter<=info->niter; iter++) {
+            clip = info->nsig*s;
+
+            nkeep=0;
+            for (i=0; i<n; i++) {
+                if (fabs(x[i]-m) < clip) {
+                    tmp=x[nkeep]; x[nkeep]=x[i]; x[i]=tmp;
+                    if (w != NULL) {
+                        tmp=w[nkeep]; w[nkeep]=w[i]; w[i]=tmp;
+                    }
+                    nkeep++;
+                }
+            }
+
+            // everything clipped or nothing changed
+            if (nkeep == 0 || nkeep == n) {
+                break;
+            }
+            n = nkeep;
+            clip_stats(x, w, n, &m, &e, &s);
+        }
+
+        info->mean[iseg] = m;
+        info->err[iseg] = e;
+        info->sdev[iseg] = s;
+        info->nuse[iseg] = n;
+    }
+    return NULL;
+}
+
+/*
+ * Sigma clip each segment data[offsets[i]:offsets[i+1]] with the same
+ * algorithm as esutil.stat.sigma_clip, optionally using threads.  The
+ * segments are split between threads with about the same number of
+ * elements in each.
+ *
+ * Returns a tuple (mean, stdev, err, nuse); empty segments have NaN
+ * statistics and nuse 0
+ */
+static PyObject *
+PyStatUtil_sigma_clip_segments(PyObject *self, PyObject *args) 
+{
+    PyObject *data_obj=NULL, *weights_obj=NULL, *offsets_obj=NULL;
+    PyObject *mean_obj=NULL, *err_obj=NULL, *sdev_obj=NULL, *nuse_obj=NULL;
+    PyObject *output_tuple=NULL;
+    const npy_int64 *offsets=NULL;
+    double *x=NULL, *w=NULL, nsig=0;
+    long int niter=0, nthreads=1;
+    npy_intp ndata=0, nseg=0, i=0, ithread=0, iseg=0;
+    npy_intp dims[1];
+    struct sigma_clip_info *info=NULL;
+    pthread_t *threads=NULL;
+    int status=1;
+
+    if (!PyArg_ParseTuple(args, (char*)"O!OO!ldl", 
+                          &PyArray_Type, &data_obj,
+                          &weights_obj,
+                          &PyArray_Type, &offsets_obj,
+                          &niter, &nsig, &nthreads)) {
+        return NULL;
+    }
+    if (PyArray_TYPE((PyArrayObject*)data_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)data_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "data must be a contiguous, aligned, native float64 array");
+        return NULL;
+    }
+    ndata = PyArray_SIZE((PyArrayObject*)data_obj);
+    if (weights_obj != Py_None) {
+        if (!PyArray_Check(weights_obj)
+                || PyArray_TYPE((PyArrayObject*)weights_obj) != NPY_FLOAT64
+                || !PyArray_ISCARRAY_RO((PyArrayObject*)weights_obj)
+                || PyArray_SIZE((PyArrayObject*)weights_obj) != ndata) {
+            PyErr_Format(PyExc_ValueError,
+                         "weights must be None or a contiguous, aligned, "
+                         "native float64 array the same size as data");
+            return NULL;
+        }
+    }
+    if (PyArray_TYPE((PyArrayObject*)offsets_obj) != NPY_INT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)offsets_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "offsets must be a contiguous, aligned, native int64 array");
+        return NULL;
+    }
+    if (nthreads < 1) {
+        PyErr_Format(PyExc_ValueError,"nthreads must be >= 1, got %ld", nthreads);
+        return NULL;
+    }
+
+    offsets = PyArray_DATA((PyArrayObject*)offsets_obj);
+    nseg = PyArray_SIZE((PyArrayObject*)offsets_obj) - 1;
+    if (nseg < 0) {
+        PyErr_Format(PyExc_ValueError,"offsets must have at least one element");
+        return NULL;
+    }
+    for (i=0; i<nseg; i++) {
+        if (offsets[i] < 0 || offsets[i+1] < offsets[i] || offsets[i+1] > ndata) {
+            PyErr_Format(PyExc_ValueError,
+                         "offsets must be non-decreasing and within the data, "
+                         "got [%ld,%ld] for segment %ld",
+                         (long)offsets[i], (long)offsets[i+1], (long)i);
+            return NULL;
+        }
+    }
+    if (nthreads > nseg) {
+        nthreads = nseg > 0 ? nseg : 1;
+    }
+
+    dims[0] = nseg;
+    mean_obj = PyArray_SimpleNew(1, dims, NPY_FLOAT64);
+    err_obj = PyArray_SimpleNew(1, dims, NPY_FLOAT64);
+    sdev_obj = PyArray_SimpleNew(1, dims, NPY_FLOAT64);
+    nuse_obj = PyArray_SimpleNew(1, dims, NPY_INT64);
+
+    // work copies, partitioned in place while clipping
+    x = malloc((ndata > 0 ? ndata : 1)*sizeof(double));
+    if (weights_obj != Py_None) {
+        w = malloc((ndata > 0 ? ndata : 1)*sizeof(double));
+    }
+    info = malloc(nthreads*sizeof(struct sigma_clip_info));
+    threads = malloc(nthreads*sizeof(pthread_t));
+    if (mean_obj==NULL || err_obj==NULL || sdev_obj==NULL || nuse_obj==NULL
+            || x==NULL || (weights_obj != Py_None && w==NULL)
+            || info==NULL || threads==NULL) {
+        status=0;
+        goto _sigma_clip_bail;
+    }
+    memcpy(x, PyArray_DATA((PyArrayObject*)data_obj), ndata*sizeof(double));
+    if (w != NULL) {
+        memcpy(w, PyArray_DATA((PyArrayObject*)weights_obj), ndata*sizeof(double));
+    }
+
+    iseg=0;
+    for (ithread=0; ithread<nthreads; ithread++) {
+        info[ithread].x = x;
+        info[ithread].w = w;
+        info[ithread].offsets = offsets;
+        info[ithread].niter = niter;
+        info[ithread].nsig = nsig;
+        info[ithread].mean = PyArray_DATA((PyArrayObject*)mean_obj);
+        info[ithread].err = PyArray_DATA((PyArrayObject*)err_obj);
+        info[ithread].sdev = PyArray_DATA((PyArrayObject*)sdev_obj);
+        info[ithread].nuse = PyArray_DATA((PyArrayObject*)nuse_obj);
+
+        info[ithread].start = iseg;
+        if (ithread == nthreads-1) {
+            iseg = nseg;
+        } else {
+            // about the same number of elements in each thread
+            while (iseg < nseg
+                    && (offsets[iseg]-offsets[0])*nthreads
+                        < (offsets[nseg]-offsets[0])*(ithread+1)) {
+                iseg++;
+            }
+        }
+        info[ithread].stop = iseg;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (ithread=1; ithread<nthreads; ithread++) {
+        if (pthread_create(&threads[ithread], NULL, sigma_clip_range, &info[ithread]) != 0) {
+            // do it in this thread instead
+            sigma_clip_range(&info[ithread]);
+            info[ithread].start = info[ithread].stop = -1;
+        }
+    }
+    sigma_clip_range(&info[0]);
+    for (ithread=1; ithread<nthreads; ithread++) {
+        if (info[ithread].start != -1) {
+            pthread_join(threads[ithread], NULL);
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    output_tuple = PyTuple_New(4);
+    PyTuple_SetItem(output_tuple, 0, mean_obj);
+    PyTuple_SetItem(output_tuple, 1, sdev_obj);
+    PyTuple_SetItem(output_tuple, 2, err_obj);
+    PyTuple_SetItem(output_tuple, 3, nuse_obj);
+
+_sigma_clip_bail:
+    free(x);
+    free(w);
+    free(info);
+    free(threads);
+    if (!status) {
+        Py_XDECREF(mean_obj);
+        Py_XDECREF(err_obj);
+        Py_XDECREF(sdev_obj);
+        Py_XDECREF(nuse_obj);
+        return PyErr_NoMemory();
+    }
+    return output_tuple;
+}
+
+
+struct value_weight {
+    double x;
+    double w;
+};
+
+static int compare_value_weight(const void *a, const void *b)
+{
+    double xa = ((const struct value_weight*)a)->x;
+    double xb = ((const struct value_weight*)b)->x;
+    return (xa > xb) - (xa < xb);
+}
+
+/*
+ * Find the first element, in order of value, for which the cumulative
+ * weight reaches target.  Quickselect on the weighted mass, partitioning
+ * into values less than, equal to and greater than the pivot, and falling
+ * back to a sort if the partitions are too unbalanced.  The array is
+ * reordered.
+ */
+static double weighted_select(struct value_weight *a, npy_intp n, double target)
+{
+    npy_intp lo=0, hi=n, i=0, lt=0, gt=0, mid=0, depth=0, maxdepth=0;
+    double prefix=0, wless=0, wequal=0, pivot=0, x0=0, x1=0, x2=0;
+    struct value_weight tmp;
+
+    for (i=n; i > 1; i >>= 1) {
+        maxdepth += 2;
+    }
+
+    while (hi-lo > 1) {
+        if (depth > maxdepth) {
+            qsort(a+lo, hi-lo, sizeof(struct value_weight), compare_value_weight);
+            for (i=lo; i<hi-1; i++) {
+                prefix += a[i].w;
+                if (prefix >= target) {
+                    return a[i].x;
+                }
+            }
+            return a[hi-1].x;
+        }
+        depth++;
+
+        // median of three for the pivot
+        mid = lo + (hi-lo)/2;
+        x0=a[lo].x; x1=a[mid].x; x2=a[hi-1].x;
+        if ( (x0 <= x1 && x1 <= x2) || (x2 <= x1 && x1 <= x0) ) {
+            pivot=x1;
+        } else if ( (x1 <= x0 && x0 <= x2) || (x2 <= x0 && x0 <= x1) ) {
+            pivot=x0;
+        } else {
+            pivot=x2;
+        }
+
+        // [lo,lt) less than pivot, [lt,i) equal, [gt,hi) greater
+        lt=lo; i=lo; gt=hi;
+        wless=0; wequal=0;
+        while (i < gt) {
+            if (a[i].x < pivot) {
+                wless += a[i].w;
+                tmp=a[lt]; a[lt]=a[i]; a[i]=tmp;
+                lt++;
+                i++;
+            } else if (a[i].x > pivot) {
+                gt--;
+                tmp=a[gt]; a[gt]=a[i]; a[i]=tmp;
+            } else {
+                wequal += a[i].w;
+                i++;
+            }
+        }
+
+        if (lt > lo && prefix + wless >= target) {
+            hi = lt;
+        } else if (prefix + wless + wequal >= target || gt == hi) {
+            return pivot;
+        } else {
+            prefix += wless + wequal;
+            lo = gt;
+        }
+    }
+    return a[lo].x;
+}
+
+/*
+ * Weighted quantiles of each segment data[offsets[i]:offsets[i+1]].  The
+ * quantile q is the first value, in sorted order, for which the cumulative
+ * weight reaches q times the total weight; q=0.5 is the same as
+ * esutil.stat.wmedian.  No full sort is done.
+ *
+ * Returns an array of shape (nseg, nq); empty segments get NaN
+ */
+static PyObject *
+PyStatUtil_weighted_quantile_segments(PyObject *self, PyObject *args) 
+{
+    PyObject *data_obj=NULL, *weights_obj=NULL, *offsets_obj=NULL, *q_obj=NULL;
+    PyObject *quant_obj=NULL;
+    const double *data=NULL, *weights=NULL, *q=NULL;
+    const npy_int64 *offsets=NULL;
+    double *quant=NULL, wtot=0;
+    struct value_weight *work=NULL, *seg=NULL;
+    npy_intp ndata=0, nseg=0, nq=0, i=0, j=0, n=0;
+    npy_intp dims[2];
+
+    if (!PyArg_ParseTuple(args, (char*)"O!O!O!O!", 
+                          &PyArray_Type, &data_obj,
+                          &PyArray_Type, &weights_obj,
+                          &PyArray_Type, &offsets_obj,
+                          &PyArray_Type, &q_obj)) {
+        return NULL;
+    }
+    if (PyArray_TYPE((PyArrayObject*)data_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)data_obj)
+            || PyArray_TYPE((PyArrayObject*)weights_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)weights_obj)
+            || PyArray_TYPE((PyArrayObject*)q_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)q_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "data, weights and q must be contiguous, aligned, "
+                     "native float64 arrays");
+        return NULL;
+    }
+    if (PyArray_TYPE((PyArrayObject*)offsets_obj) != NPY_INT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)offsets_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "offsets must be a contiguous, aligned, native int64 array");
+        return NULL;
+    }
+
+    data = PyArray_DATA((PyArrayObject*)data_obj);
+    weights = PyArray_DATA((PyArrayObject*)weights_obj);
+    q = PyArray_DATA((PyArrayObject*)q_obj);
+    offsets = PyArray_DATA((PyArrayObject*)offsets_obj);
+    ndata = PyArray_SIZE((PyArrayObject*)data_obj);
+    nq = PyArray_SIZE((PyArrayObject*)q_obj);
+    nseg = PyArray_SIZE((PyArrayObject*)offsets_obj) - 1;
+
+    if (PyArray_SIZE((PyArrayObject*)weights_obj) != ndata) {
+        PyErr_Format(PyExc_ValueError,"data and weights must be the same size");
+        return NULL;
+    }
+    if (nseg < 0) {
+        PyErr_Format(PyExc_ValueError,"offsets must have at least one element");
+        return NULL;
+    }
+    for (i=0; i<nseg; i++) {
+        if (offsets[i] < 0 || offsets[i+1] < offsets[i] || offsets[i+1] > ndata) {
+            PyErr_Format(PyExc_ValueError,
+                         "offsets must be non-decreasing and within the data, "
+                         "got [%ld,%ld] for segment %ld",
+                         (long)offsets[i], (long)offsets[i+1], (long)i);
+            return NULL;
+        }
+    }
+    for (j=0; j<nq; j++) {
+        if (!(q[j] >= 0 && q[j] <= 1)) {
+            PyErr_Format(PyExc_ValueError,"quantiles must be in [0,1], got %g", q[j]);
+            return NULL;
+        }
+    }
+
+    dims[0] = nseg;
+    dims[1] = nq;
+    quant_obj = PyArray_SimpleNew(2, dims, NPY_FLOAT64);
+    work = malloc((ndata > 0 ? ndata : 1)*sizeof(struct value_weight));
+    if (quant_obj == NULL || work == NULL) {
+        Py_XDECREF(quant_obj);
+        free(work);
+        return PyErr_NoMemory();
+    }
+    quant = PyArray_DATA((PyArrayObject*)quant_obj);
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i=0; i<ndata; i++) {
+        work[i].x = data[i];
+        work[i].w = weights[i];
+    }
+    for (i=0; i<nseg; i++) {
+        seg = work + offsets[i];
+        n = offsets[i+1] - offsets[i];
+
+        wtot=0;
+        for (j=0; j<n; j++) {
+            wtot += seg[j].w;
+        }
+        for (j=0; j<nq; j++) {
+            if (n == 0) {
+                quant[i*nq + j] = Py_NAN;
+            } else {
+                quant[i*nq + j] = weighted_select(seg, n, q[j]*wtot);
+            }
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    free(work);
+    return quant_obj;
+}
+
+
+/*
+ * Evaluate a piecewise linear function at the points u, extrapolating
+ * from the first and last segments, as for esutil.stat.interplin.
+ *
+ * For a uniform grid the segment is found directly from x0 and dx, otherwise
+ * by binary search for the last x less than u.  The output is written into
+ * the sent float32 or float64 array.
+ */
+static PyObject *
+PyStatUtil_interp_eval(PyObject *self, PyObject *args) 
+{
+    PyObject *x_obj=NULL, *y_obj=NULL, *slope_obj=NULL, *u_obj=NULL, *out_obj=NULL;
+    const double *x=NULL, *y=NULL, *slope=NULL, *u=NULL;
+    double *out8=NULL, x0=0, dx=0, t=0, val=0;
+    float *out4=NULL;
+    int uniform=0, out_type=0;
+    npy_intp n=0, nu=0, i=0, lo=0, hi=0, mid=0, ind=0;
+
+    if (!PyArg_ParseTuple(args, (char*)"O!O!O!iddO!O!", 
+                          &PyArray_Type, &x_obj,
+                          &PyArray_Type, &y_obj,
+                          &PyArray_Type, &slope_obj,
+                          &uniform, &x0, &dx,
+                          &PyArray_Type, &u_obj,
+                          &PyArray_Type, &out_obj)) {
+        return NULL;
+    }
+    if (PyArray_TYPE((PyArrayObject*)x_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)x_obj)
+            || PyArray_TYPE((PyArrayObject*)y_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)y_obj)
+            || PyArray_TYPE((PyArrayObject*)slope_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)slope_obj)
+            || PyArray_TYPE((PyArrayObject*)u_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)u_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "x, y, slope and u must be contiguous, aligned, "
+                     "native float64 arrays");
+        return NULL;
+    }
+    out_type = PyArray_TYPE((PyArrayObject*)out_obj);
+    if ( (out_type != NPY_FLOAT64 && out_type != NPY_FLOAT32)
+            || !PyArray_ISCARRAY((PyArrayObject*)out_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "out must be a contiguous, aligned, native, writeable "
+                     "float32 or float64 array");
+        return NULL;
+    }
+
+    n = PyArray_SIZE((PyArrayObject*)x_obj);
+    nu = PyArray_SIZE((PyArrayObject*)u_obj);
+    if (n < 2 || PyArray_SIZE((PyArrayObject*)y_obj) != n
+            || PyArray_SIZE((PyArrayObject*)slope_obj) != n-1) {
+        PyErr_Format(PyExc_ValueError,
+                     "x and y must be the same size, at least 2, with one "
+                     "less slope");
+        return NULL;
+    }
+    if (PyArray_SIZE((PyArrayObject*)out_obj) != nu) {
+        PyErr_Format(PyExc_ValueError,
+                     "out must be the same size as u, got %ld and %ld",
+                     (long)PyArray_SIZE((PyArrayObject*)out_obj), (long)nu);
+        return NULL;
+    }
+
+    x = PyArray_DATA((PyArrayObject*)x_obj);
+    y = PyArray_DATA((PyArrayObject*)y_obj);
+    slope = PyArray_DATA((PyArrayObject*)slope_obj);
+    u = PyArray_DATA((PyArrayObject*)u_obj);
+    if (out_type == NPY_FLOAT64) {
+        out8 = PyArray_DATA((PyArrayObject*)out_obj);
+    } else {
+        out4 = PyArray_DATA((PyArrayObject*)out_obj);
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (i=0; i<nu; i++) {
+        if (uniform) {
+            t = (u[i]-x0)/dx;
+            if (t >= n-2) {
+                ind = n-2;
+            } else if (t > 0) {
+                ind = (npy_intp) t;
+            } else {
+                ind = 0;
+            }
+        } else {
+            // number of x less than u, as for searchsorted
+            lo=0;
+            hi=n;
+            while (lo < hi) {
+                mid = lo + (hi-lo)/2;
+                if (x[mid] < u[i]) {
+                    lo = mid+1;
+                } else {
+                    hi = mid;
+                }
+            }
+            ind = lo-1;
+            if (ind > n-2) {
+                ind = n-2;
+            } else if (ind < 0) {
+                ind = 0;
+            }
+        }
+
+        val = (u[i]-x[ind])*slope[ind] + y[ind];
+        if (out8 != NULL) {
+            out8[i] = val;
+        } else {
+            out4[i] = (float) val;
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    Py_INCREF(out_obj);
+    return out_obj;
+}
+
+
+/*
+ * add val to the Fenwick tree at position pos, 1-offset
+ */
+static void fenwick_add(npy_int64 *tree, npy_intp n, npy_intp pos, npy_int64 val)
+{
+    for (; pos <= n; pos += pos & (-pos)) {
+        tree[pos] += val;
+    }
+}
+
+/*
+ * find the smallest position with cumulative count >= k, 1-offset
+ */
+static npy_intp fenwick_find(const npy_int64 *tree, npy_intp n, npy_int64 k)
+{
+    npy_intp pos=0, step=1;
+    while (step*2 <= n) {
+        step *= 2;
+    }
+    for (; step > 0; step /= 2) {
+        if (pos+step <= n && tree[pos+step] < k) {
+            pos += step;
+            k -= tree[pos];
+        }
+    }
+    return pos+1;
+}
+
+/*
+ * Rolling statistics in trailing windows for each segment
+ * values[offsets[i]:offsets[i+1]].  The window for each element holds the
+ * previous elements of the same segment, either the last nwin elements or,
+ * if times are sent, those with time greater than the element time minus
+ * twin.  The times must be sorted within each segment.
+ *
+ * The mean and standard deviation are updated as elements enter and leave
+ * the window.  Removing elements leaves rounding residue, so the sums are
+ * recalculated from the window each time as many elements have left as it
+ * holds, which keeps the cost linear.  A window of identical values gets a
+ * standard deviation of exactly zero.  For the median, the elements of each segment are ranked by
+ * value and the ranks in the window are kept in a Fenwick tree, so each
+ * step takes O(log n) with no sorting of the window.
+ *
+ * Returns a tuple (mean, std, median, n), with median None if not requested
+ */
+static PyObject *
+PyStatUtil_rolling_segments(PyObject *self, PyObject *args) 
+{
+    PyObject *data_obj=NULL, *offsets_obj=NULL, *times_obj=NULL;
+    PyObject *mean_obj=NULL, *std_obj=NULL, *median_obj=NULL, *n_obj=NULL;
+    PyObject *output_tuple=NULL;
+    const double *data=NULL, *times=NULL;
+    const npy_int64 *offsets=NULL;
+    double *mean=NULL, *std=NULL, *median=NULL, twin=0;
+    npy_int64 *nwindow=NULL, *tree=NULL, *rank=NULL, k=0;
+    struct value_weight *sorted=NULL;
+    long int nwin=0;
+    int domedian=0, status=1, badtimes=0;
+    npy_intp ndata=0, nseg=0, iseg=0, i=0, j=0, lo=0, n=0, start=0, cnt=0, maxseg=1;
+    npy_intp run=0, nremoved=0;
+    double m=0, m2=0, delta=0, x=0, med=0, shift=0;
+    npy_intp dims[1];
+
+    if (!PyArg_ParseTuple(args, (char*)"O!O!Oldi", 
+                          &PyArray_Type, &data_obj,
+                          &PyArray_Type, &offsets_obj,
+                          &times_obj,
+                          &nwin, &twin, &domedian)) {
+        return NULL;
+    }
+    if (PyArray_TYPE((PyArrayObject*)data_obj) != NPY_FLOAT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)data_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "data must be a contiguous, aligned, native float64 array");
+        return NULL;
+    }
+    ndata = PyArray_SIZE((PyArrayObject*)data_obj);
+    if (times_obj != Py_None) {
+        if (!PyArray_Check(times_obj)
+                || PyArray_TYPE((PyArrayObject*)times_obj) != NPY_FLOAT64
+                || !PyArray_ISCARRAY_RO((PyArrayObject*)times_obj)
+                || PyArray_SIZE((PyArrayObject*)times_obj) != ndata) {
+            PyErr_Format(PyExc_ValueError,
+                         "times must be None or a contiguous, aligned, "
+                         "native float64 array the same size as data");
+            return NULL;
+        }
+        times = PyArray_DATA((PyArrayObject*)times_obj);
+    } else if (nwin < 1) {
+        PyErr_Format(PyExc_ValueError,"window must be >= 1, got %ld", nwin);
+        return NULL;
+    }
+    if (PyArray_TYPE((PyArrayObject*)offsets_obj) != NPY_INT64
+            || !PyArray_ISCARRAY_RO((PyArrayObject*)offsets_obj)) {
+        PyErr_Format(PyExc_ValueError,
+                     "offsets must be a contiguous, aligned, native int64 array");
+        return NULL;
+    }
+
+    data = PyArray_DATA((PyArrayObject*)data_obj);
+    offsets = PyArray_DATA((PyArrayObject*)offsets_obj);
+    nseg = PyArray_SIZE((PyArrayObject*)offsets_obj) - 1;
+    if (nseg < 0 || offsets[0] != 0 || offsets[nseg] != ndata) {
+        PyErr_Format(PyExc_ValueError,
+                     "offsets must start at zero and end at the data size");
+        return NULL;
+    }
+    for (iseg=0; iseg<nseg; iseg++) {
+        if (offsets[iseg+1] < offsets[iseg]) {
+            PyErr_Format(PyExc_ValueError,
+                         "offsets must be non-decreasing, got [%ld,%ld] "
+                         "for segment %ld", (long)offsets[iseg],
+                         (long)offsets[iseg+1], (long)iseg);
+            return NULL;
+        }
+        if (offsets[iseg+1]-offsets[iseg] > maxseg) {
+            maxseg = offsets[iseg+1]-offsets[iseg];
+        }
+    }
+
+    dims[0] = ndata;
+    mean_obj = PyArray_SimpleNew(1, dims, NPY_FLOAT64);
+    std_obj = PyArray_SimpleNew(1, dims, NPY_FLOAT64);
+    n_obj = PyArray_SimpleNew(1, dims, NPY_INT64);
+    if (domedian) {
+        median_obj = PyArray_SimpleNew(1, dims, NPY_FLOAT64);
+        sorted = malloc(maxseg*sizeof(struct value_weight));
+        rank = malloc(maxseg*sizeof(npy_int64));
+        tree = malloc((maxseg+1)*sizeof(npy_int64));
+    } else {
+        Py_INCREF(Py_None);
+        median_obj = Py_None;
+    }
+    if (mean_obj==NULL || std_obj==NULL || n_obj==NULL || median_obj==NULL
+            || (domedian && (sorted==NULL || rank==NULL || tree==NULL))) {
+        status=0;
+        goto _rolling_bail;
+    }
+    mean = PyArray_DATA((PyArrayObject*)mean_obj);
+    std = PyArray_DATA((PyArrayObject*)std_obj);
+    nwindow = PyArray_DATA((PyArrayObject*)n_obj);
+    if (domedian) {
+        median = PyArray_DATA((PyArrayObject*)median_obj);
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    for (iseg=0; iseg<nseg; iseg++) {
+        start = offsets[iseg];
+        n = offsets[iseg+1] - start;
+
+        if (times != NULL) {
+            for (i=start+1; i<start+n; i++) {
+                if (times[i] < times[i-1]) {
+                    badtimes=1;
+                }
+            }
+            if (badtimes) {
+                break;
+            }
+        }
+
+        if (domedian && n > 0) {
+            // rank the values within the segment, the weight holds the index
+            for (i=0; i<n; i++) {
+                sorted[i].x = data[start+i];
+                sorted[i].w = (double) i;
+            }
+            qsort(sorted, n, sizeof(struct value_weight), compare_value_weight);
+            for (i=0; i<n; i++) {
+                rank[ (npy_intp) sorted[i].w ] = i+1;
+            }
+            for (i=0; i<=n; i++) {
+                tree[i] = 0;
+            }
+        }
+
+        m=0;
+        m2=0;
+        cnt=0;
+        run=0;
+        nremoved=0;
+        lo=start;
+        if (n > 0) {
+            shift = data[start];
+        }
+        for (i=start; i<start+n; i++) {
+            // add the new element.  The sums are for the values minus a
+            // shift near the data, which avoids cancellation when the
+            // spread is small compared to the values
+            x = data[i] - shift;
+            cnt++;
+            delta = x - m;
+            m += delta/cnt;
+            m2 += delta*(x - m);
+            if (domedian) {
+                fenwick_add(tree, n, rank[i-start], 1);
+            }
+
+            // remove elements that have left the window
+            while ( (times == NULL && i-lo >= nwin)
+                    || (times != NULL && times[lo] <= times[i]-twin && lo < i) ) {
+                x = data[lo] - shift;
+                cnt--;
+                if (cnt == 0) {
+                    m=0;
+                    m2=0;
+                } else {
+                    delta = x - m;
+                    m -= delta/cnt;
+                    m2 -= delta*(x - m);
+                }
+                if (domedian) {
+                    fenwick_add(tree, n, rank[lo-start], -1);
+                }
+                lo++;
+                nremoved++;
+            }
+
+            // length of the run of identical values ending here
+            if (i > start && data[i] == data[i-1]) {
+                run++;
+            } else {
+                run=1;
+            }
+
+            if (run >= cnt) {
+                // all the same value, remove any rounding residue
+                shift = data[i];
+                m = 0;
+                m2 = 0;
+            } else if (nremoved >= cnt) {
+                // recalculate from the window with two passes
+                shift = data[i];
+                m=0;
+                for (j=lo; j<=i; j++) {
+                    m += data[j] - shift;
+                }
+                m /= cnt;
+                m2=0;
+                delta=0;
+                for (j=lo; j<=i; j++) {
+                    x = (data[j] - shift) - m;
+                    m2 += x*x;
+                    delta += x;
+                }
+                m2 -= delta*delta/cnt;
+                m += delta/cnt;
+                nremoved=0;
+            }
+
+            mean[i] = m + shift;
+            std[i] = m2 > 0 ? sqrt(m2/cnt) : 0.0;
+            nwindow[i] = cnt;
+            if (domedian) {
+                k = (cnt+1)/2;
+                j = fenwick_find(tree, n, k);
+                med = sorted[j-1].x;
+                if ( (cnt % 2) == 0 ) {
+                    j = fenwick_find(tree, n, k+1);
+                    med = (med + sorted[j-1].x)/2.;
+                }
+                median[i] = med;
+            }
+        }
+    }
+    Py_END_ALLOW_THREADS
+
+    if (badtimes) {
+        PyErr_Format(PyExc_ValueError, "times must be sorted within each group");
+        goto _rolling_bail;
+    }
+
+    output_tuple = PyTuple_New(4);
+    PyTuple_SetItem(output_tuple, 0, mean_obj);
+    PyTuple_SetItem(output_tuple, 1, std_obj);
+    PyTuple_SetItem(output_tuple, 2, median_obj);
+    PyTuple_SetItem(output_tuple, 3, n_obj);
+
+_rolling_bail:
+    free(sorted);
+    free(rank);
+    free(tree);
+    if (output_tuple == NULL) {
+        Py_XDECREF(mean_obj);
+        Py_XDECREF(std_obj);
+        Py_XDECREF(median_obj);
+        Py_XDECREF(n_obj);
+    }
+    if (!status) {
+        return PyErr_NoMemory();
+    }
+    return output_tuple;
 }
 
 
 static PyMethodDef stat_util_module_methods[] = {
-    {"random_sample", (PyCFunction)PyStatUtil_random_sample, METH_VARARGS,  "r=random_sample(nmax,nrand)"},
+    {"random_sample", (PyCFunction)PyStatUtil_random_sample, METH_VARARGS,  "r=random_sample(nmax,nrand,seed,dosort)"},
+    {"hist_rev", (PyCFunction)PyStatUtil_hist_rev, METH_VARARGS,  "hist,rev,nuse=hist_rev(data,dmin,dmax,binsize,nbin,dorev)"},
+    {"segment_median", (PyCFunction)PyStatUtil_segment_median, METH_VARARGS,  "median=segment_median(data,offsets)"},
+    {"sigma_clip_segments", (PyCFunction)PyStatUtil_sigma_clip_segments, METH_VARARGS,  "mean,stdev,err,nuse=sigma_clip_segments(data,weights,offsets,niter,nsig,nthreads)"},
+    {"weighted_quantile_segments", (PyCFunction)PyStatUtil_weighted_quantile_segments, METH_VARARGS,  "quant=weighted_quantile_segments(data,weights,offsets,q)"},
+    {"interp_eval", (PyCFunction)PyStatUtil_interp_eval, METH_VARARGS,  "out=interp_eval(x,y,slope,uniform,x0,dx,u,out)"},
+    {"rolling_segments", (PyCFunction)PyStatUtil_rolling_segments, METH_VARARGS,  "mean,std,median,n=rolling_segments(data,offsets,times,nwin,twin,domedian)"},
     {NULL}  /* Sentinel */
 };
 
@@ -35,6 +35,250 @@ def test():
         print 'OK'
 
 
+    print '\ncompare counting sort reverse indices to sorted chist: '
+    numpy.random.seed(10)
+    data = numpy.random.normal(size=1000)
+    h,rev = esutil.stat.histogram(data, binsize=0.1, min=-2.0, max=2.0, rev=True)
+
+    s = data.argsort()
+    w, = where( (data[s] >= -2.0) & (data[s] <= 2.0) )
+    h2,rev2 = chist.chist(data, -2.0, s[w], 0.1, h.size, True)
+
+    nbad = 0
+    if (h != h2).any() or (rev[0:h.size+1] != rev2[0:h.size+1]).any():
+        nbad += 1
+    for i in xrange(h.size):
+        r = numpy.sort(rev[rev[i]:rev[i+1]])
+        r2 = numpy.sort(rev2[rev2[i]:rev2[i+1]])
+        if (r != r2).any():
+            nbad += 1
+    if nbad != 0:
+        print '%s Errors found' % nbad
+    else:
+        print 'OK'
+
+
+    print '\nhistogram of a record array column, expect same as a copy: '
+    rec = numpy.zeros(data.size, dtype=[('x','f8'),('y','f4')])
+    rec['x'] = data
+    hr,revr = esutil.stat.histogram(rec['x'], binsize=0.1, min=-2.0, max=2.0, rev=True)
+    if (hr != h).any() or (revr != rev).any():
+        print 'Errors found'
+    else:
+        print 'OK'
+
+
+    print '\ncompare bin statistics to per-bin calculation: '
+    weights = numpy.random.uniform(size=data.size)
+    b = esutil.stat.Binner(data, weights=weights)
+    b.dohist(nbin=20)
+    b.calc_stats()
+    rev = b['rev']
+
+    nbad = 0
+    for i in xrange(b['hist'].size):
+        if rev[i+1]-rev[i] > 1:
+            w = rev[rev[i]:rev[i+1]]
+            wm,we = esutil.stat.wmom(data[w], weights[w])
+            if (abs(b['median'][i]-numpy.median(data[w])) > 1.e-12
+                    or abs(b['mean'][i]-data[w].mean()) > 1.e-12
+                    or abs(b['std'][i]-data[w].std()) > 1.e-12
+                    or abs(b['wmean'][i]-wm) > 1.e-12
+                    or abs(b['werr'][i]-we) > 1.e-12):
+                nbad += 1
+    if nbad != 0:
+        print '%s Errors found' % nbad
+    else:
+        print 'OK'
+
+
+    print '\ncompare accumulated bin statistics to all data at once: '
+    data = numpy.random.uniform(size=1000)
+    y = data**2 + numpy.random.normal(size=data.size)
+    b = esutil.stat.Binner(data, y, weights=weights)
+    b.dohist(binsize=0.125, min=0.0, max=1.0)
+    b.calc_stats()
+
+    edges = numpy.arange(10)*0.125
+    b1 = esutil.stat.Binner(edges=edges)
+    b2 = esutil.stat.Binner(edges=edges)
+    b1.update(data[0:300], y[0:300], weights=weights[0:300])
+    b1.update(data[300:500], y[300:500], weights=weights[300:500])
+    b2.update(data[500:], y[500:], weights=weights[500:])
+    b1.merge(b2)
+    b1.result()
+
+    nbad = 0
+    for name in ['hist','xmean','xstd','ymean','yerr','whist','wymean','wystd','wyerr2']:
+        if numpy.abs(b1[name]-b[name]).max() > 1.e-12:
+            nbad += 1
+    if nbad != 0:
+        print '%s Errors found' % nbad
+    else:
+        print 'OK'
+
+
+    print '\ncompare 3-d histogram to explicit selection: '
+    coords = numpy.random.randint(0, 3, size=(500,3))
+    z = numpy.random.normal(size=500)
+    res = esutil.stat.histogramdd(coords, binsize=1, min=0, max=2, values={'z':z})
+    rev = res['rev']
+
+    nbad = 0
+    for i in xrange(res['hist'].size):
+        ii,jj,kk = numpy.unravel_index(i, res['hist'].shape)
+        w, = where( (coords[:,0] == ii) & (coords[:,1] == jj) & (coords[:,2] == kk) )
+        if (res['hist'][ii,jj,kk] != w.size
+                or (numpy.sort(rev[rev[i]:rev[i+1]]) != w).any()
+                or abs(res['zmean'][ii,jj,kk] - z[w].mean()) > 1.e-12):
+            nbad += 1
+    if nbad != 0:
+        print '%s Errors found' % nbad
+    else:
+        print 'OK'
+
+
+    print '\ncompare grouped sigma clipping to sigma_clip: '
+    group_ids = numpy.random.randint(0, 10, size=2000)
+    data = numpy.random.normal(size=group_ids.size)
+    data[::40] += 20.0
+    res = esutil.stat.sigma_clip_groups(data, group_ids=group_ids, nthreads=2)
+
+    nbad = 0
+    for i in xrange(res['groups'].size):
+        w, = where(group_ids == res['groups'][i])
+        mean,stdev,ind = esutil.stat.sigma_clip(data[w], get_indices=True)
+        if (abs(res['mean'][i]-mean) > 1.e-12 or abs(res['stdev'][i]-stdev) > 1.e-12
+                or res['nuse'][i] != ind.size):
+            nbad += 1
+    if nbad != 0:
+        print '%s Errors found' % nbad
+    else:
+        print 'OK'
+
+
+    print '\ncompare weighted quantiles to sorted cumulative weights: '
+    weights = numpy.random.uniform(size=data.size)
+    q = numpy.array([0.1, 0.5, 0.9])
+    quant = esutil.stat.wquantile(data, weights, q)
+
+    s = data.argsort()
+    cumw = weights[s].cumsum()
+    expected = data[s[numpy.searchsorted(cumw, q*weights.sum())]]
+
+    res = esutil.stat.wquantile_groups(data, weights, 0.5, group_ids=group_ids)
+    w, = where(group_ids == res['groups'][3])
+    wmed = esutil.stat.wmedian(data[w], weights[w])
+
+    # strided input
+    quant2 = esutil.stat.wquantile(data[::2], weights[::2], q)
+    s2 = data[::2].argsort()
+    cumw2 = weights[::2][s2].cumsum()
+    expected2 = data[::2][s2[numpy.searchsorted(cumw2, q*weights[::2].sum())]]
+
+    # the median is an element of the input, with the same type, even
+    # for integers that are not exact in double precision
+    iarr = numpy.array([2**53+1, 2**53, 2**53+3, 5], dtype='i8')
+    imed = esutil.stat.wmedian(iarr, [1.0, 1.0, 1.0, 0.5])
+
+    if (numpy.abs(quant-expected).max() > 1.e-12
+            or numpy.abs(quant2-expected2).max() > 1.e-12
+            or imed.dtype != iarr.dtype or imed != 2**53+1
+            or abs(res['quantiles'][3]-wmed) > 1.e-12):
+        print 'Errors found'
+    else:
+        print 'OK'
+
+
+    print '\ncompare Interpolator to direct linear interpolation: '
+    x = numpy.sort(numpy.random.uniform(size=20))
+    xuni = numpy.linspace(0.0, 1.0, 20)
+    y = numpy.random.normal(size=20)
+    u = numpy.random.uniform(low=-0.5, high=1.5, size=100)
+
+    nbad = 0
+    for xx in [x, xuni]:
+        ind = (xx.searchsorted(u) - 1).clip(0, xx.size-2)
+        expected = (u-xx[ind])*(y[ind+1]-y[ind])/(xx[ind+1]-xx[ind]) + y[ind]
+
+        interp = esutil.stat.Interpolator(xx, y)
+        out = numpy.zeros(u.size, dtype='f4')
+        interp(u, out=out)
+        if (numpy.abs(interp(u)-expected).max() > 1.e-12
+                or numpy.abs(out-expected).max() > 1.e-5):
+            nbad += 1
+    if nbad != 0 or not interp.uniform:
+        print 'Errors found'
+    else:
+        print 'OK'
+
+
+    print '\ncompare accumulated weighted moments to wmom: '
+    data = 1000.0 + numpy.random.normal(size=1000)
+    weights = numpy.random.uniform(size=data.size)
+    expected = esutil.stat.wmom(data, weights, calcerr=True, sdev=True)
+
+    wm1 = esutil.stat.WMom()
+    wm1.update(data[0:600], weights[0:600], chunksize=250)
+    wm2 = esutil.stat.WMom()
+    wm2.update(data[600:], weights[600:])
+    wm1.merge(wm2)
+    res = wm1.result(calcerr=True, sdev=True)
+
+    if numpy.abs(numpy.array(res)-numpy.array(expected)).max() > 1.e-10:
+        print 'Errors found'
+    else:
+        print 'OK'
+
+
+    print '\ncompare rolling statistics in groups to explicit windows: '
+    data = numpy.random.normal(size=100)
+    offsets = numpy.array([0, 30, 30, 75, 100], dtype='i8')
+    res = esutil.stat.rolling_stats(data, offsets, window=4)
+
+    nbad = 0
+    for g in range(offsets.size-1):
+        for i in range(offsets[g], offsets[g+1]):
+            w = data[max(offsets[g], i-3):i+1]
+            if (abs(res['mean'][i]-w.mean()) > 1.e-12
+                    or abs(res['std'][i]-w.std()) > 1.e-12
+                    or res['median'][i] != numpy.median(w)
+                    or res['n'][i] != w.size):
+                nbad += 1
+
+    # strided values and times
+    times = numpy.arange(200)*0.5
+    res2 = esutil.stat.rolling_stats(numpy.repeat(data, 2)[::2], offsets,
+                                     times=times[::2], twindow=3.5)
+    for name in ['mean','std','median','n']:
+        if (res2[name] != res[name]).any():
+            nbad += 1
+
+    # windows of identical values after other values have passed through
+    cdata = numpy.concatenate([numpy.random.normal(size=20)*100.0,
+                               numpy.zeros(10) + 1000.1,
+                               numpy.random.normal(size=5)])
+    res3 = esutil.stat.rolling_stats(cdata, window=4, median=False)
+    if (res3['std'][23:30] != 0).any() or (res3['mean'][23:30] != 1000.1).any():
+        nbad += 1
+    if nbad != 0:
+        print 'Errors found'
+    else:
+        print 'OK'
+
+    print '\ncheck unique random indices and reservoir sample: '
+    ind = esutil.random.random_indices(10**10, 1000, seed=35)
+    indr = esutil.random.random_indices(1000, 1000, seed=35, sort=False)
+    chunks = [numpy.arange(i, min(i+30, 100)) for i in range(0, 100, 30)]
+    sample, sind = esutil.random.reservoir_sample(chunks, 10, seed=35)
+    if (ind.size != 1000 or (numpy.diff(ind) <= 0).any()
+            or ind.min() < 0 or ind.max() >= 10**10
+            or (numpy.sort(indr) != numpy.arange(1000)).any()
+            or (sample != sind).any() or numpy.unique(sind).size != 10):
+        print 'Errors found'
+    else:
+        print 'OK'
+
 
 
 if __name__=='__main__':
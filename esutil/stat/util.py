@@ -8,6 +8,10 @@ classes
 -------
 Binner: 
     A class for binning data.
+Interpolator:
+    Linear interpolation like interplin, reusable for many sets of points.
+WMom:
+    Accumulate weighted moments, as for wmom, over chunks of data.
 
 functions
 -------
@@ -18,12 +22,23 @@ histogram:
     to tabulate a large number of statistics for each bin.
 histogram2d:  
     Histgram two variables.
+histogramdd:
+    Histogram in any number of dimensions, with reverse indices and
+    statistics of other values in the bins.
 wmom:  
     Calculate weighted mean and error for the given input data.
 wmedian:
     Calculate the weighted median.
+wquantile:
+    Calculate weighted quantiles.
+wquantile_groups:
+    Calculate weighted quantiles for many groups at once.
 sigma_clip:  
     Return the sigma-clipped mean and error for the input data.
+sigma_clip_groups:
+    Sigma clip the data in many groups at once.
+rolling_stats:
+    Rolling mean, standard deviation and median, for many groups at once.
 interplin:  
     Perform linear interpolation.  This function is less powerful than
     scipy.interpolate.interp1d but behaves like the IDL interpol()
@@ -82,6 +97,10 @@ class Binner(dict):
     Bin data and calculate statistics of the bins.
 
     b = Binner(x, y=None, weights=None)
+    b = Binner(edges=edges)
+
+    With edges, the Binner accumulates statistics over chunks of data sent
+    to update(), see below.
 
     Examples
     --------
@@ -106,6 +125,9 @@ class Binner(dict):
         b.dohist(binsize=0.1)
         b.calc_stats()
 
+        # only calculate some of the statistics
+        b.calc_stats(stats=['mean','wmean'])
+
     2 variables (get averages of the second in the bins of the first):
         b=Binner(x,y)
         b.dohist(nperbin=10)
@@ -116,8 +138,32 @@ class Binner(dict):
         b['xmean'], b['xstd'], b['xerr'], b['xerr2']
         b['ymean'], b['ystd'], b['yerr'], b['yerr2']
 
+    Accumulate over chunks of data with fixed bin edges.  The results
+    have the same names as from calc_stats, except there are no medians:
+        b=Binner(edges=numpy.linspace(0.0, 1.0, 11))
+        for x,y,w in chunks:
+            b.update(x, y, weights=w)
+        b.result()
+        b['xmean'], b['ymean'], b['wymean']
+
+        # combine with a Binner accumulated elsewhere
+        b.merge(b2)
+
     """
-    def __init__(self, x, y=None, weights=None):
+    def __init__(self, x=None, y=None, weights=None, edges=None):
+        self.edges = None
+        self._acc = None
+        if edges is not None:
+            self.edges = numpy.array(edges, ndmin=1, dtype='f8')
+            if self.edges.size < 2 or (numpy.diff(self.edges) <= 0).any():
+                raise ValueError("edges must be increasing with at "
+                                 "least two elements")
+            if x is not None:
+                raise ValueError("send x to update() when using edges")
+            return
+        elif x is None:
+            raise ValueError("send x or edges")
+
         self.x = numpy.array(x, ndmin=1, copy=False)
         self.y = y
         self.weights = weights
@@ -142,8 +188,14 @@ class Binner(dict):
         """
         Perform the basic histogram, optionally getting reverse indices. Note
         if weights were sent, reverse indices will always be calculated
+
+        Binning by binsize or nbin does not sort the data, so 'sort_index'
+        and 'wsort' are only set when binning with nperbin.
         """
 
+        if self.edges is not None:
+            raise ValueError("with edges use update() and result()")
+
         # this method inherited from dict
         self.clear()
 
@@ -151,12 +203,13 @@ class Binner(dict):
         if self.y is not None:
             rev=True
 
-        # get self['wsort'] and self.dmin, self.dmax
-        self._get_minmax_and_indices(min=min, max=max)
-
         if nperbin is not None:
+            # get self['wsort'] and self.dmin, self.dmax
+            self._get_minmax_and_indices(min=min, max=max)
             self._hist_by_num(nperbin, mergelast=mergelast)
         elif nbin is not None or binsize is not None:
+            # no sort is needed for fixed size bins
+            self._get_minmax(min=min, max=max)
             self._hist_by_binsize_or_nbin(binsize, nbin, rev)
         else:
             raise ValueError("Send binsize or nbin or nperbin")
@@ -172,7 +225,17 @@ class Binner(dict):
         self['binsize'] = binsize
         self['nbin'] = nbin
 
-        h,r = self._do_hist(self.x, self.dmin, self['wsort'], binsize, nbin, rev=rev)
+        dorev = rev
+        if self.weights is not None:
+            # force rev so we can add up in bins with weights
+            dorev=True
+
+        # counting sort, the indices within each bin are in the
+        # original order
+        x = numpy.ascontiguousarray(self.x, dtype='f8')
+        h,r,nuse = _stat_util.hist_rev(x, self.dmin, self.dmax, binsize, nbin, dorev)
+        if nuse == 0:
+            raise ValueError("No data in specified min/max range: [%s,%s]" % (self.dmin,self.dmax))
 
         self['hist'] = h
         if r is not None:
@@ -273,6 +336,26 @@ class Binner(dict):
         # make it visible too
         self['sort_index'] = self.sort_index
 
+    def _get_minmax(self, min=None, max=None):
+        """
+        Get min/max without sorting
+        """
+        if min is not None:
+            xmin = min
+        else:
+            xmin = self.x.min()
+
+        if max is not None:
+            xmax = max
+        else:
+            xmax = self.x.max()
+
+        self.dmin = xmin
+        self.dmax = xmax
+
+        self[self.xpref+'min'] = xmin
+        self[self.xpref+'max'] = xmax
+
     def _get_minmax_and_indices(self, min=None, max=None):
         """
         Get sort index, min/max, and w, the sorted indices in the specified
@@ -310,7 +393,27 @@ class Binner(dict):
         else:
             self['wsort'] = s
 
-    def calc_stats(self):
+    def calc_stats(self, stats=None):
+        """
+        Calculate statistics of the data in each bin.
+
+        The bin edges are always calculated.  If reverse indices are present
+        the requested statistics are calculated for x and, if sent, y.  The
+        statistics are calculated for all bins at once from the reverse
+        indices.  Bins with no data get -9999, or zero for 'whist'.
+
+        parameters
+        ----------
+        stats: sequence, optional
+            Names of the statistics to calculate.  Default is all that apply.
+                'mean','std','err','median'
+            and if weights were sent
+                'whist','wmean','wstd','werr','werr2'
+            The results are stored with the variable prefix, e.g. 'xmean',
+            'wymean' when y was sent.
+        """
+        if self.edges is not None:
+            raise ValueError("with edges use update() and result()")
         if 'hist' not in self:
             raise ValueError("run dohist first")
 
@@ -337,119 +440,422 @@ class Binner(dict):
 
 
         if 'rev' in self:
+            stats = _get_stats_names(stats, self.weights is not None)
+
             revind = self['rev']
-            # calculate the mean in the bins
-            xmean   = numpy.zeros(nhist) - 9999.0
-            xstd    = xmean.copy()
-            xerr    = xmean.copy()
-            xmedian = xmean.copy()
-            if self.y is not None:
-                ymean   = xmean.copy()
-                ystd    = xmean.copy()
-                yerr    = xmean.copy()
-                ymedian = xmean.copy()
+            nper = revind[1:nhist+1] - revind[0:nhist]
+            wbin, = numpy.where(nper > 0)
+
+            # indices of the data in the bins, grouped by bin
+            ind = revind[ revind[0]:revind[nhist] ]
+            n = nper[wbin]
+            starts = revind[wbin] - revind[0]
 
             if self.weights is not None:
-                whist = xmean.copy()
-                whist[:] = 0
-                wxmean = xmean.copy()
-                wxstd  = xmean.copy()
-                wxerr  = xmean.copy()
-                wxerr2 = xmean.copy()
-                if self.y is not None:
-                    wymean = xmean.copy()
-                    wystd  = xmean.copy()
-                    wyerr  = xmean.copy()
-                    wyerr2 = xmean.copy()
-
-            for i in xrange(nhist):
-                if revind[i] != revind[i+1]:
-                    w = revind[ revind[i]:revind[i+1] ]
-
-                    if w.size == 1:
-                        xmean[i] = self.x[w[0]]
-                        xmedian[i] = xmean[i]
-                        xstd[i] = 0
-                        xerr[i] = xmean[i]
-                        if self.y is not None:
-                            ymean[i] = self.y[w[0]]
-                            ymedian[i] = ymean[i]
-                            ystd[i] = 0
-                            yerr[i] = ymean[i]
-
-                        if self.weights is not None:
-                            whist[i] = self.x[w[0]]*self.weights[w[0]]
-                            wxmean[i] = xmean[i]
-                            wxstd[i] = 0
-                            wxerr[i] = wxmean[i]
-                            wxerr2[i] = wxmean[i]
-                            if self.y is not None:
-                                wymean[i] = ymean[i]
-                                wystd[i] = 0
-                                wyerr[i] = wymean[i]
-                                wyerr2[i] = wymean[i]
-
-
-                    else:
-                        xmean[i] = self.x[w].mean()
-                        xstd[i] = self.x[w].std()
-                        xerr[i] = xstd[i]/numpy.sqrt(w.size)
-                        xmedian[i] = numpy.median(self.x[w])
-                        if self.y is not None:
-                            ymean[i] = self.y[w].mean()
-                            ystd[i] = self.y[w].std()
-                            yerr[i] = ystd[i]/numpy.sqrt(w.size)
-                            ymedian[i] = numpy.median(self.y[w])
-
-                        if self.weights is not None:
-                            whist[i] = self.weights[w].sum()
-                            wm,we,ws=wmom(self.x[w],self.weights[w],sdev=True)
-                            j1,we2=wmom(self.x[w],self.weights[w], calcerr=True)
-                            wxmean[i] = wm
-                            wxstd[i] = ws
-                            wxerr[i] = we
-                            wxerr2[i] = we2
-
-                            if self.y is not None:
-                                wm,we,ws=wmom(self.y[w],self.weights[w],sdev=True)
-                                j1,we2=wmom(self.y[w],self.weights[w], calcerr=True)
-                                wymean[i] = wm
-                                wystd[i] = ws
-                                wyerr[i] = we
-                                wyerr2[i] = we2
-
-
-
-
-            self[xpref+'mean']   = xmean
-            self[xpref+'std']    = xstd
-            self[xpref+'err']    = xerr
-            self[xpref+'median'] = xmedian
+                weights = numpy.array(self.weights[ind], dtype='f8', copy=False)
+            else:
+                weights = None
+
+            res = _calc_bin_stats(self.x[ind], weights, starts, n, stats)
+            self._set_stats(res, xpref, wbin, nhist)
+
             if self.y is not None:
-                self['ymean']   = ymean
-                self['ystd']    = ystd
-                self['yerr']    = yerr
-                self['ymedian'] = ymedian
+                res = _calc_bin_stats(self.y[ind], weights, starts, n, stats)
+                self._set_stats(res, 'y', wbin, nhist)
 
+    def _set_stats(self, res, pref, wbin, nhist):
+        """
+        Expand the statistics for filled bins to all bins
+        """
+        for name in res:
+            if name == 'whist':
+                vals = numpy.zeros(nhist)
+                key = 'whist'
+            else:
+                vals = numpy.zeros(nhist) - 9999.0
+                if name[0] == 'w':
+                    key = 'w' + pref + name[1:]
+                else:
+                    key = pref + name
+            vals[wbin] = res[name]
+            self[key] = vals
+
+    def update(self, x, y=None, weights=None):
+        """
+        Accumulate statistics for a chunk of data, for a Binner created with
+        fixed bin edges.  y and weights must be sent for every chunk or
+        for none.
+
+        The counts, means and sums of squared deviations in each bin are
+        combined with those from previous chunks using the pairwise
+        updates of Chan et al., which are numerically stable.  Run result()
+        to get the statistics.
+        """
+        if self.edges is None:
+            raise ValueError("update requires a Binner created with edges=")
 
-            if self.weights is not None:
-                self['whist']          = whist
-                self['w'+xpref+'mean'] = wxmean
-                self['w'+xpref+'std']  = wxstd
-                self['w'+xpref+'err']  = wxerr
-                self['w'+xpref+'err2'] = wxerr2
-                if self.y is not None:
-                    self['wymean'] = wymean
-                    self['wystd']  = wystd
-                    self['wyerr']  = wyerr
-                    self['wyerr2'] = wyerr2
+        x = numpy.array(x, ndmin=1, copy=False)
+        if y is not None:
+            y = numpy.array(y, ndmin=1, copy=False)
+            if y.size != x.size:
+                raise ValueError("y must be same len as x")
+        if weights is not None:
+            weights = numpy.array(weights, ndmin=1, dtype='f8', copy=False)
+            if weights.size != x.size:
+                raise ValueError("Weights must be same len as data")
+
+        hasy, hasw = (y is not None), (weights is not None)
+        if self._acc is None:
+            self._acc = _init_bin_acc(self.edges.size-1, hasy, hasw)
+        if self._acc['hasy'] != hasy or self._acc['hasw'] != hasw:
+            raise ValueError("y and weights must be sent for all chunks or none")
+
+        # bins are [low,high), with the upper edge included in the last bin
+        binnum = numpy.searchsorted(self.edges, x, side='right') - 1
+        binnum[x == self.edges[-1]] = self.edges.size-2
+        w, = numpy.where( (binnum >= 0) & (binnum < self.edges.size-1) )
+        if w.size == 0:
+            return
+
+        binnum = binnum[w]
+        if y is not None:
+            y = y[w]
+        if weights is not None:
+            weights = weights[w]
+
+        chunk = _bin_acc_chunk(binnum, self.edges.size-1, x[w], y, weights)
+        _combine_bin_acc(self._acc, chunk)
+
+    def merge(self, other):
+        """
+        Combine the accumulated statistics from another Binner with the same
+        bin edges, for example one run on part of the data in another
+        process.
+        """
+        if self.edges is None or other.edges is None:
+            raise ValueError("merge requires Binners created with edges=")
+        if (self.edges.size != other.edges.size
+                or (self.edges != other.edges).any()):
+            raise ValueError("Binners must have the same edges to merge")
+
+        if other._acc is None:
+            return
+        if self._acc is None:
+            self._acc = _init_bin_acc(self.edges.size-1,
+                                      other._acc['hasy'], other._acc['hasw'])
+        if (self._acc['hasy'] != other._acc['hasy']
+                or self._acc['hasw'] != other._acc['hasw']):
+            raise ValueError("Binners must both have y and weights or not")
+
+        _combine_bin_acc(self._acc, other._acc)
+
+    def result(self):
+        """
+        Calculate the statistics from the data accumulated with update(),
+        with the same names as calc_stats.  Medians are not available.  The
+        Binner itself is returned.
+        """
+        if self.edges is None:
+            raise ValueError("result requires a Binner created with edges=")
+        nbin = self.edges.size-1
+        acc = self._acc
+        if acc is None:
+            acc = _init_bin_acc(nbin, False, False)
+
+        self.clear()
+        xpref = ''
+        if acc['hasy']:
+            xpref = 'x'
+
+        self['hist'] = numpy.array(acc['n'], dtype='i8')
+        self[xpref+'low'] = self.edges[0:nbin].copy()
+        self[xpref+'high'] = self.edges[1:].copy()
+        self[xpref+'center'] = 0.5*(self.edges[0:nbin] + self.edges[1:])
+
+        wbin, = numpy.where(acc['n'] > 0)
+        res = _bin_acc_stats(acc, 'x', wbin)
+        self._set_stats(res, xpref, wbin, nbin)
+        if acc['hasy']:
+            res = _bin_acc_stats(acc, 'y', wbin)
+            self._set_stats(res, 'y', wbin, nbin)
+
+        return self
+
+
+# statistics calculated by Binner.calc_stats
+_bin_stats=['mean','std','err','median']
+_bin_wstats=['whist','wmean','wstd','werr','werr2']
+
+def _get_stats_names(stats, hasweights):
+    """
+    Check the requested statistics, default all
+    """
+    if stats is None:
+        stats = list(_bin_stats)
+        if hasweights:
+            stats += _bin_wstats
+        return stats
+
+    if isinstance(stats, basestring):
+        stats = [stats]
+    for name in stats:
+        if name in _bin_wstats:
+            if not hasweights:
+                raise ValueError("weights are required for '%s'" % name)
+        elif name not in _bin_stats:
+            raise ValueError("bad stat name '%s', expected one "
+                             "of %s" % (name, _bin_stats+_bin_wstats))
+    return stats
+
+def _calc_bin_stats(data, weights, starts, n, stats):
+    """
+    Calculate the requested statistics for data grouped into bins
+
+    parameters
+    ----------
+    data: array
+        The data, grouped by bin
+    weights: array or None
+        Weights for each data point
+    starts: array
+        Index of the start of each bin in the data.  The bins must be
+        contiguous and each must have at least one element.
+    n: array
+        Number of points in each bin
+    stats: list
+        The names of the statistics, see _bin_stats and _bin_wstats
+
+    outputs
+    -------
+    A dictionary keyed by the statistic names.  The errors for bins with a
+    single point are set to the value of the point.
+    """
+
+    res={}
+    if n.size == 0:
+        for name in stats:
+            res[name] = numpy.zeros(0)
+        return res
+
+    data = numpy.array(data, dtype='f8', copy=False)
+    binid = numpy.repeat(numpy.arange(n.size), n)
+    single = (n == 1)
+    fn = numpy.array(n, dtype='f8')
+
+    need_std = ('std' in stats or 'err' in stats)
+    if 'mean' in stats or need_std:
+        mean = numpy.add.reduceat(data, starts)/fn
+        if 'mean' in stats:
+            res['mean'] = mean
+        if need_std:
+            diff = data - mean[binid]
+            std = sqrt( numpy.add.reduceat(diff**2, starts)/fn )
+            std[single] = 0.0
+            if 'std' in stats:
+                res['std'] = std
+            if 'err' in stats:
+                err = std/sqrt(fn)
+                err[single] = mean[single]
+                res['err'] = err
+
+    if 'median' in stats:
+        offsets = numpy.zeros(n.size+1, dtype='i8')
+        offsets[0:n.size] = starts
+        offsets[n.size] = data.size
+        res['median'] = _stat_util.segment_median(data, offsets)
+
+    wnames = [name for name in stats if name in _bin_wstats]
+    if len(wnames) > 0:
+        wtot = numpy.add.reduceat(weights, starts)
+        if 'whist' in stats:
+            res['whist'] = wtot
+
+        wmean = numpy.add.reduceat(weights*data, starts)/wtot
+        wmean[single] = data[starts[single]]
+        if 'wmean' in stats:
+            res['wmean'] = wmean
+        if 'werr' in stats:
+            werr = 1.0/sqrt(wtot)
+            werr[single] = wmean[single]
+            res['werr'] = werr
+
+        if 'wstd' in stats or 'werr2' in stats:
+            diff2 = (data - wmean[binid])**2
+            if 'wstd' in stats:
+                wstd = sqrt( numpy.add.reduceat(weights*diff2, starts)/wtot )
+                wstd[single] = 0.0
+                res['wstd'] = wstd
+            if 'werr2' in stats:
+                werr2 = sqrt( numpy.add.reduceat(weights**2*diff2, starts) )/wtot
+                werr2[single] = wmean[single]
+                res['werr2'] = werr2
+
+    return res
+
+
+
+def _init_bin_acc(nbin, hasy, hasw):
+    """
+    Empty accumulated statistics for Binner.update
+    """
+    acc = {'hasy':hasy, 'hasw':hasw, 'n':numpy.zeros(nbin)}
+    names = ['x']
+    if hasy:
+        names.append('y')
+
+    if hasw:
+        acc['wsum'] = numpy.zeros(nbin)
+        acc['w2sum'] = numpy.zeros(nbin)
+    for name in names:
+        acc[name+'mean'] = numpy.zeros(nbin)
+        acc[name+'m2'] = numpy.zeros(nbin)
+        if hasw:
+            acc['w'+name+'mean'] = numpy.zeros(nbin)
+            acc['w'+name+'m2'] = numpy.zeros(nbin)
+            # sums of w**2*(x-wmean) and w**2*(x-wmean)**2
+            acc['w'+name+'u'] = numpy.zeros(nbin)
+            acc['w'+name+'q'] = numpy.zeros(nbin)
+    return acc
+
+def _bin_acc_chunk(binnum, nbin, x, y, weights):
+    """
+    Statistics for a single chunk of data, in the form of _init_bin_acc
+    """
+    acc = _init_bin_acc(nbin, y is not None, weights is not None)
+
+    n = numpy.bincount(binnum, minlength=nbin).astype('f8')
+    acc['n'] = n
+    nz = numpy.where(n > 0, n, 1.0)
+    if weights is not None:
+        wsum = numpy.bincount(binnum, weights=weights, minlength=nbin)
+        acc['wsum'] = wsum
+        w2 = weights**2
+        acc['w2sum'] = numpy.bincount(binnum, weights=w2, minlength=nbin)
+        wsumz = numpy.where(wsum != 0, wsum, 1.0)
+
+    data = [('x',x)]
+    if y is not None:
+        data.append( ('y',y) )
+
+    for name,d in data:
+        d = numpy.array(d, dtype='f8', copy=False)
+
+        mean = numpy.bincount(binnum, weights=d, minlength=nbin)/nz
+        diff = d - mean[binnum]
+        acc[name+'mean'] = mean
+        acc[name+'m2'] = numpy.bincount(binnum, weights=diff**2, minlength=nbin)
+
+        if weights is not None:
+            wmean = numpy.bincount(binnum, weights=weights*d, minlength=nbin)/wsumz
+            diff = d - wmean[binnum]
+            acc['w'+name+'mean'] = wmean
+            acc['w'+name+'m2'] = numpy.bincount(binnum, weights=weights*diff**2,
+                                                minlength=nbin)
+            acc['w'+name+'u'] = numpy.bincount(binnum, weights=w2*diff,
+                                               minlength=nbin)
+            acc['w'+name+'q'] = numpy.bincount(binnum, weights=w2*diff**2,
+                                               minlength=nbin)
+
+    return acc
+
+def _combine_moments(n1, mean1, m21, n2, mean2, m22):
+    """
+    Combine the counts or summed weights, means and sums of squared
+    deviations from the mean of two sets of data, Chan et al. 1979.
+    Works for scalars or arrays.
+    """
+    n = n1 + n2
+    nz = numpy.where(n != 0, n, 1.0)
+    frac = numpy.where(n != 0, n2/nz, 0.0)
+
+    delta = mean2 - mean1
+    mean = mean1 + delta*frac
+    m2 = m21 + m22 + delta**2*n1*frac
+    return n, mean, m2
+
+def _shift_w2_moments(mean_from, mean_to, u, q, w2sum):
+    """
+    Shift the sums of w**2*(x-mean) and w**2*(x-mean)**2 to a new mean.
+    Returns u, q
+    """
+    d = mean_from - mean_to
+    return u + d*w2sum, q + 2*d*u + d**2*w2sum
+
+def _combine_bin_acc(acc, other):
+    """
+    Add the statistics in other to acc
+    """
+    names = ['x']
+    if acc['hasy']:
+        names.append('y')
+
+    for name in names:
+        junk, acc[name+'mean'], acc[name+'m2'] = \
+            _combine_moments(acc['n'], acc[name+'mean'], acc[name+'m2'],
+                             other['n'], other[name+'mean'], other[name+'m2'])
+
+        if acc['hasw']:
+            mpref = 'w'+name
+            mean1, mean2 = acc[mpref+'mean'], other[mpref+'mean']
+            junk, mean, acc[mpref+'m2'] = \
+                _combine_moments(acc['wsum'], mean1, acc[mpref+'m2'],
+                                 other['wsum'], mean2, other[mpref+'m2'])
+
+            # shift the sums of w**2 weighted deviations to the new mean
+            u1, q1 = _shift_w2_moments(mean1, mean, acc[mpref+'u'],
+                                       acc[mpref+'q'], acc['w2sum'])
+            u2, q2 = _shift_w2_moments(mean2, mean, other[mpref+'u'],
+                                       other[mpref+'q'], other['w2sum'])
+            acc[mpref+'u'] = u1 + u2
+            acc[mpref+'q'] = q1 + q2
+            acc[mpref+'mean'] = mean
+
+    acc['n'] = acc['n'] + other['n']
+    if acc['hasw']:
+        acc['wsum'] = acc['wsum'] + other['wsum']
+        acc['w2sum'] = acc['w2sum'] + other['w2sum']
+
+def _bin_acc_stats(acc, name, wbin):
+    """
+    Statistics for the filled bins from accumulated sums, in the form
+    returned by _calc_bin_stats
+    """
+    n = acc['n'][wbin]
+    mean = acc[name+'mean'][wbin]
+    single = (n == 1)
+
+    std = sqrt(acc[name+'m2'][wbin]/n)
+    std[single] = 0.0
+    err = std/sqrt(n)
+    err[single] = mean[single]
+    res = {'mean':mean, 'std':std, 'err':err}
+
+    if acc['hasw']:
+        mpref = 'w'+name
+        wtot = acc['wsum'][wbin]
+        wmean = acc[mpref+'mean'][wbin]
+
+        wstd = sqrt(acc[mpref+'m2'][wbin]/wtot)
+        wstd[single] = 0.0
+        werr = 1.0/sqrt(wtot)
+        werr[single] = wmean[single]
+        werr2 = sqrt(acc[mpref+'q'][wbin].clip(0.0))/wtot
+        werr2[single] = wmean[single]
+
+        res['whist'] = wtot
+        res['wmean'] = wmean
+        res['wstd'] = wstd
+        res['werr'] = werr
+        res['werr2'] = werr2
+
+    return res
 
 
 
 def histogram(data, weights=None, binsize=1., nbin=None, 
               nperbin=None, mergelast=True,
               min=None, max=None, 
-              rev=False, more=False, **keys):
+              rev=False, more=False, stats=None, **keys):
     """
     Calculate the histogram of the input data.  
     
@@ -517,6 +923,10 @@ def histogram(data, weights=None, binsize=1., nbin=None,
                     weighted variance: 
                       sqrt( (w**2 * (arr-mean)**2).sum() )/weights.sum()
 
+    stats: sequence, optional
+        The statistics to calculate when more=True or weights are sent,
+        e.g. stats=['mean','wmean'].  Default is all.  See Binner.calc_stats
+
 
     Using Reverse Indices:
         h,rev = histogram(data, binsize=binsize, rev=True)
@@ -527,6 +937,9 @@ def histogram(data, weights=None, binsize=1., nbin=None,
                 indices = rev[ rev[i]:rev[i+1] ]
 
                 # do calculations with data[indices] ...
+
+        When binning by binsize or nbin the indices within each bin are in
+        increasing order, and the data are not sorted.
     """
 
     if nbin is not None:
@@ -540,7 +953,7 @@ def histogram(data, weights=None, binsize=1., nbin=None,
              min=min, max=max, rev=rev)
 
     if more or weights is not None:
-        b.calc_stats()
+        b.calc_stats(stats=stats)
 
     if weights is not None or more:
         return b
@@ -828,6 +1241,187 @@ def histogram2d(x, y,
             output['zmean'] = zmean.reshape(nx,ny)
         return output
 
+def histogramdd(data, weights=None, binsize=None, nbin=None,
+                min=None, max=None, rev=False, more=False,
+                values=None, stats=None):
+    """
+    Name:
+        histogramdd
+    Purpose:
+        Histogram data in any number of dimensions, optionally calculating
+        reverse indices and statistics of other values in each bin.
+
+    Calling Sequence:
+        hist = histogramdd(data, binsize=None, nbin=None, min=None, max=None)
+        hist, rev = histogramdd(data, binsize=0.1, rev=True)
+        res = histogramdd(data, nbin=[10,5,20], values={'shear':shear},
+                          weights=w)
+
+    Inputs:
+        data: The coordinates of the data, either an (n,ndim) array or a
+            sequence of ndim arrays, each of length n.
+
+    Keywords:
+        weights: Weights for each data point.  If sent, more=True is
+            implied and the weighted histogram 'whist' is calculated, as
+            well as weighted statistics of the values.
+        binsize: The bin size.  A scalar or one for each dimension.
+        nbin: The number of bins.  A scalar or one for each dimension.
+            Overrides binsize.
+        min, max: The range of data to use.  Scalars or one for each
+            dimension.  Default is the range of the data.
+        rev: If True, return a tuple hist,rev.  The reverse indices are in
+            the same format as for histogram, with the bin number the index
+            into the flattened histogram.
+        more: If True, return a dictionary with the histogram in the 'hist'
+            key, the reverse indices in 'rev', and for each dimension lists
+            of the bin 'low', 'high' and 'center', as well as 'nbin',
+            'binsize', 'min' and 'max'.
+        values: A dictionary of arrays, each of length n.  Statistics of
+            each are calculated in the bins and returned with the name as
+            prefix, e.g. 'shearmean','shearstd','wshearmean'.  more=True is
+            implied.
+        stats: The statistics to calculate for the values, see
+            Binner.calc_stats.  Default is all.
+
+    The histogram, and the statistics, have shape nbin.  For each dimension
+    the bins are the same as for histogram, bin = int( (x-min)/binsize ).
+    Data outside of the bins in any dimension are not used.
+    """
+
+    if isinstance(data, numpy.ndarray) and data.ndim == 2:
+        coords = [data[:,i] for i in xrange(data.shape[1])]
+    elif isinstance(data, numpy.ndarray) and data.ndim == 1:
+        coords = [data]
+    else:
+        coords = [numpy.array(d, ndmin=1, copy=False) for d in data]
+    ndim = len(coords)
+    npts = coords[0].size
+    for c in coords:
+        if c.size != npts:
+            raise ValueError("all dimensions must be the same length")
+
+    if nbin is not None:
+        binsize=None
+    elif binsize is None:
+        raise ValueError("send binsize or nbin")
+
+    if weights is not None or values is not None:
+        more=True
+    if more:
+        rev=True
+    if weights is not None:
+        weights = numpy.array(weights, ndmin=1, dtype='f8', copy=False)
+        if weights.size != npts:
+            raise ValueError("Weights must be same len as data")
+
+    dmin = _get_per_dim(min, ndim, 'min')
+    dmax = _get_per_dim(max, ndim, 'max')
+    dnbin = _get_per_dim(nbin, ndim, 'nbin')
+    dbinsize = _get_per_dim(binsize, ndim, 'binsize')
+
+    # linear bin number, -1 for data outside of the bins
+    linbin = numpy.zeros(npts, dtype='i8')
+    use = numpy.ones(npts, dtype='bool')
+    for i in xrange(ndim):
+        x = coords[i]
+        if dmin[i] is None:
+            dmin[i] = x.min()
+        if dmax[i] is None:
+            dmax[i] = x.max()
+        if dnbin[i] is not None:
+            dbinsize[i] = float(dmax[i]-dmin[i])/dnbin[i]
+        else:
+            dnbin[i] = numpy.int64( (dmax[i]-dmin[i])/dbinsize[i] ) + 1
+
+        xbin = ((x-dmin[i])/dbinsize[i]).astype('i8')
+        use &= (x >= dmin[i]) & (x <= dmax[i]) & (xbin >= 0) & (xbin < dnbin[i])
+
+        linbin *= dnbin[i]
+        linbin += xbin
+
+    shape = tuple(dnbin)
+    nbintot = numpy.prod(shape)
+    linbin = numpy.where(use, linbin, -1).astype('f8')
+
+    hist, revind, nuse = _stat_util.hist_rev(linbin, 0.0, nbintot-1, 1.0,
+                                             nbintot, rev)
+    if nuse == 0:
+        raise ValueError("No data in specified min/max range")
+    hist = hist.reshape(shape)
+
+    if not more:
+        if rev:
+            return hist, revind
+        else:
+            return hist
+
+    output={}
+    output['hist'] = hist
+    output['rev'] = revind
+    output['nbin'] = numpy.array(dnbin, dtype='i8')
+    output['binsize'] = numpy.array(dbinsize, dtype='f8')
+    output['min'] = numpy.array(dmin, dtype='f8')
+    output['max'] = numpy.array(dmax, dtype='f8')
+
+    output['low'] = []
+    output['high'] = []
+    output['center'] = []
+    for i in xrange(ndim):
+        low = dmin[i] + numpy.arange(dnbin[i], dtype='f8')*dbinsize[i]
+        output['low'].append(low)
+        output['high'].append(low + dbinsize[i])
+        output['center'].append(low + 0.5*dbinsize[i])
+
+    nper = revind[1:nbintot+1] - revind[0:nbintot]
+    wbin, = numpy.where(nper > 0)
+    ind = revind[ revind[0]:revind[nbintot] ]
+    n = nper[wbin]
+    starts = revind[wbin] - revind[0]
+
+    wts = None
+    if weights is not None:
+        wts = weights[ind]
+        whist = numpy.zeros(nbintot)
+        whist[wbin] = numpy.add.reduceat(wts, starts)
+        output['whist'] = whist.reshape(shape)
+
+    if values is not None:
+        stats = _get_stats_names(stats, weights is not None)
+        for name in values:
+            val = numpy.array(values[name], ndmin=1, copy=False)
+            if val.size != npts:
+                raise ValueError("values '%s' must be same len as data" % name)
+            res = _calc_bin_stats(val[ind], wts, starts, n, stats)
+            for stat in res:
+                if stat == 'whist':
+                    continue
+                vals = numpy.zeros(nbintot) - 9999.0
+                vals[wbin] = res[stat]
+                if stat[0] == 'w':
+                    key = 'w' + name + stat[1:]
+                else:
+                    key = name + stat
+                output[key] = vals.reshape(shape)
+
+    return output
+
+def _get_per_dim(val, ndim, name):
+    """
+    Expand a scalar or sequence keyword to a list with one entry per
+    dimension
+    """
+    if val is None:
+        return [None]*ndim
+    val = numpy.array(val, ndmin=1, copy=False)
+    if val.size == 1:
+        return [val[0]]*ndim
+    if val.size != ndim:
+        raise ValueError("%s must be scalar or have one entry per "
+                         "dimension, got %s" % (name,val.size))
+    return list(val)
+
+
 def boxcar_average(x, N):
     """
     convolve the data with a boxcar window of the specified length
@@ -843,6 +1437,67 @@ def boxcar_average(x, N):
     kernel=ones((N,))/N
     return convolve(x, kernel)[(N-1):]
 
+def rolling_stats(values, offsets=None, window=None, times=None, twindow=None,
+                  median=True):
+    """
+    Calculate statistics in trailing rolling windows, for many groups at
+    once.
+
+    parameters
+    ----------
+    values: array
+        The data, ordered by group, and within groups in the order for
+        the windows, e.g. by time.
+    offsets: array, optional
+        Group i is values[offsets[i]:offsets[i+1]], e.g. from the start of
+        each object in a set of light curves.  Default is a single group.
+    window: integer, optional
+        Use windows holding this many points, the current point and those
+        before it in the group.  Fewer are used at the start of a group.
+    times: array, optional
+        With twindow, use windows in time.  The window for each point holds
+        the points in the group with times[i]-twindow < time <= times[i].
+        The times must be sorted within each group.
+    twindow: number, optional
+        The length of the time windows.
+    median: bool, optional
+        If True, calculate the rolling median, default True.
+
+    returns
+    -------
+    A dictionary with arrays the same length as values: 'mean', 'std',
+    'median' and 'n' the number of points in each window.
+
+    The mean and standard deviation are updated as points enter and leave
+    the window.  For the median the points are ranked within each group and
+    the ranks in the window kept in a binary indexed tree, so each step is
+    logarithmic rather than a sort of the window.
+    """
+    values = numpy.ascontiguousarray(values, dtype='f8')
+    if offsets is None:
+        offsets = numpy.array([0, values.size], dtype='i8')
+    else:
+        offsets = numpy.ascontiguousarray(offsets, dtype='i8')
+
+    if times is not None:
+        if window is not None or twindow is None:
+            raise ValueError("send window or times and twindow")
+        if twindow <= 0:
+            raise ValueError("twindow must be > 0")
+        times = numpy.ascontiguousarray(times, dtype='f8')
+        window = 0
+    else:
+        if window is None or twindow is not None:
+            raise ValueError("send window or times and twindow")
+        twindow = 0.0
+
+    mean, std, med, n = _stat_util.rolling_segments(values, offsets, times,
+                                                    window, twindow, median)
+    output = {'mean':mean, 'std':std, 'n':n}
+    if median:
+        output['median'] = med
+    return output
+
 
 def wmom(arrin, weights_in, inputmean=None, calcerr=False, sdev=False):
     """
@@ -911,32 +1566,246 @@ def wmom(arrin, weights_in, inputmean=None, calcerr=False, sdev=False):
     else:
         return wmean,werr
 
+class WMom(object):
+    """
+    Accumulate weighted moments over chunks of data, for data that do not
+    fit into memory.
+
+    wm = WMom()
+    wm.update(arr, weights, chunksize=None)
+    wmean, werr = wm.result(inputmean=None, calcerr=False, sdev=False)
+
+    The results are the same as for wmom run on all of the data.  Each
+    chunk is reduced to its summed weights, weighted mean and sums of
+    squared deviations, which are combined with those of previous chunks
+    using the pairwise updates of Chan et al.  merge() combines the
+    results from another WMom, e.g. one run in another process.
+
+    examples
+    --------
+        # chunks read from a file
+        wm = WMom()
+        for data in sf.read_chunks(chunksize=1000000, fields=['x','w']):
+            wm.update(data['x'], data['w'])
+        wmean, werr, wsdev = wm.result(sdev=True)
+
+        # a memory map, processed in chunks to limit the memory used
+        mm = sf.get_memmap()
+        wm = WMom()
+        wm.update(mm['x'], mm['w'], chunksize=1000000)
+    """
+    def __init__(self):
+        self.n = 0
+        self.wsum = 0.0
+        self.w2sum = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+        # sums of w**2*(x-mean) and w**2*(x-mean)**2
+        self.u = 0.0
+        self.q = 0.0
+
+    def update(self, arr, weights, chunksize=None):
+        """
+        Add the data to the moments.  If chunksize is sent, the data are
+        processed in chunks of that many elements, which limits the memory
+        used for memory mapped inputs.
+        """
+        if len(arr) != len(weights):
+            raise ValueError("array and weights must be same size")
+
+        if chunksize is None:
+            chunksize = len(arr)
+        chunksize = max(chunksize, 1)
+        for i in xrange(0, len(arr), chunksize):
+            self._update_chunk(arr[i:i+chunksize], weights[i:i+chunksize])
+
+    def _update_chunk(self, arrin, weights_in):
+        arr = numpy.array(arrin, ndmin=1, dtype='f8', copy=False)
+        weights = numpy.array(weights_in, ndmin=1, dtype='f8', copy=False)
+        if arr.size == 0:
+            return
+
+        chunk = WMom()
+        chunk.n = arr.size
+        chunk.wsum = weights.sum()
+        if chunk.wsum != 0:
+            chunk.mean = (weights*arr).sum()/chunk.wsum
+        diff = arr - chunk.mean
+        w2 = weights**2
+        chunk.w2sum = w2.sum()
+        chunk.m2 = (weights*diff**2).sum()
+        chunk.u = (w2*diff).sum()
+        chunk.q = (w2*diff**2).sum()
+
+        self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Combine the moments accumulated in another WMom
+        """
+        wsum, mean, m2 = _combine_moments(self.wsum, self.mean, self.m2,
+                                          other.wsum, other.mean, other.m2)
+        u1, q1 = _shift_w2_moments(self.mean, mean, self.u, self.q, self.w2sum)
+        u2, q2 = _shift_w2_moments(other.mean, mean, other.u, other.q, other.w2sum)
+
+        self.n += other.n
+        self.wsum = float(wsum)
+        self.w2sum += other.w2sum
+        self.mean = float(mean)
+        self.m2 = float(m2)
+        self.u = float(u1 + u2)
+        self.q = float(q1 + q2)
+
+    def result(self, inputmean=None, calcerr=False, sdev=False):
+        """
+        Get the weighted mean and error, and optionally the standard
+        deviation.  The keywords and outputs are the same as for wmom.
+        """
+        if self.n == 0:
+            raise ValueError("no data have been accumulated")
+
+        wtot = self.wsum
+        if inputmean is None:
+            wmean = self.mean
+            m2, q = self.m2, self.q
+        else:
+            wmean = float(inputmean)
+            u, q = _shift_w2_moments(self.mean, wmean, self.u, self.q, self.w2sum)
+            m2 = self.m2 + wtot*(self.mean-wmean)**2
+
+        if calcerr:
+            werr = numpy.sqrt( max(q, 0.0) )/wtot
+        else:
+            werr = 1.0/numpy.sqrt(wtot)
+
+        if sdev:
+            wsdev = numpy.sqrt( max(m2, 0.0)/wtot )
+            return wmean,werr,wsdev
+        else:
+            return wmean,werr
+
 def wmedian(arr_in, weights_in):
     """
-    Calculate the weighted median.  The routine is from
+    Calculate the weighted median.  The median is the first value, in
+    sorted order, for which the cumulative weight reaches half the total.
+    See wquantile.
+    """
+    return wquantile(arr_in, weights_in, 0.5)
 
-    http://stackoverflow.com/questions/9794558/weighted-median-computation
+def wquantile(arr_in, weights_in, q):
     """
-    # no copy made if they are already arrays
-    arr = numpy.array(arr_in, ndmin=1, copy=False)
+    Calculate weighted quantiles.
 
-    sind=arr.argsort()
-    
-    # Weights is forced to be type double. All resulting calculations
-    # will also be double
-    weights = numpy.array(weights_in, ndmin=1, dtype='f8', copy=False)
+    parameters
+    ----------
+    arr: array or sequence
+        A numpy array or sequence
+    weights: array or sequence
+        A weight for each element
+    q: scalar or sequence
+        The quantile or quantiles, in [0,1]
 
-    wtot = weights.sum()
-    wtot2 = wtot/2.
+    returns
+    -------
+    The quantile q is the first value, in sorted order, for which the
+    cumulative weight reaches q times the total weight.  A scalar if q is
+    a scalar, otherwise an array with a value for each q.
+
+    The quantiles are found by selection on the weighted data rather than
+    a full sort.  They are elements of the array, with the same type.
+    """
+    arrorig = numpy.array(arr_in, ndmin=1, copy=False)
+    arr = numpy.ascontiguousarray(arrorig, dtype='f8')
+    weights = numpy.ascontiguousarray(weights_in, dtype='f8')
+    if weights.size != arr.size:
+        raise ValueError("array and weights must be same size")
+    if arr.size == 0:
+        raise ValueError("array must have at least one element")
+
+    qarr = numpy.array(q, ndmin=1, dtype='f8')
+    offsets = numpy.array([0, arr.size], dtype='i8')
+    quant = _stat_util.weighted_quantile_segments(arr, weights, offsets, qarr)
+    quant = quant[0,:]
+
+    if arrorig.dtype != quant.dtype:
+        quant = _wquantile_elements(arrorig, arr, weights, qarr, quant)
+
+    if numpy.isscalar(q):
+        return quant[0]
+    else:
+        return quant
+
+def _wquantile_elements(arrorig, arr, weights, qarr, quant):
+    """
+    Get the quantiles found in double precision as elements of the original
+    array.  Values that are equal in double precision but not in the
+    original type, such as integers beyond 2**53, are put in order here
+    """
+    out = numpy.zeros(qarr.size, dtype=arrorig.dtype)
+    wtot = None
+    for i in xrange(qarr.size):
+        w, = numpy.where(arr == quant[i])
+        cand = arrorig[w]
+        if (cand == cand[0]).all():
+            out[i] = cand[0]
+            continue
+
+        if wtot is None:
+            wtot = weights.sum()
+        prefix = weights[arr < quant[i]].sum()
+        s = cand.argsort()
+        cumw = prefix + weights[w[s]].cumsum()
+        k = cumw.searchsorted(qarr[i]*wtot)
+        out[i] = cand[s[min(k, s.size-1)]]
+
+    return out
+
+def wquantile_groups(arrin, weights, q, group_ids=None, rev=None):
+    """
+    Calculate weighted quantiles for many groups at once.
+
+    parameters
+    ----------
+    arr: array or sequence
+        A numpy array or sequence
+    weights: array or sequence
+        A weight for each element
+    q: scalar or sequence
+        The quantile or quantiles, in [0,1].  See wquantile
+    group_ids: array, optional
+        The group for each element of arr.  The results are for the
+        unique group ids, in sorted order.
+    rev: array, optional
+        Reverse indices from histogram, with the results for each bin.
+        Send either group_ids or rev.
+
+    returns
+    -------
+    A dictionary with 'quantiles', shape (ngroup,) for scalar q or
+    (ngroup, nq) otherwise.  If group_ids were sent, 'groups' holds the
+    unique ids.  Empty bins get -9999.
+    """
+    arr = numpy.array(arrin, ndmin=1, dtype='f8', copy=False)
+    weights = numpy.array(weights, ndmin=1, dtype='f8', copy=False)
+    if weights.size != arr.size:
+        raise ValueError("array and weights must be same size")
 
-    k=0
-    sum = wtot-weights[sind[0]]
+    output={}
+    ind, offsets, groups = _get_group_segments(arr.size, group_ids, rev)
+    if groups is not None:
+        output['groups'] = groups
 
-    while sum > wtot2:
-        k += 1
-        sum -= weights[sind[k]]
+    qarr = numpy.array(q, ndmin=1, dtype='f8')
+    quant = _stat_util.weighted_quantile_segments(arr[ind], weights[ind],
+                                                  offsets, qarr)
+    w, = numpy.where(offsets[1:] == offsets[0:offsets.size-1])
+    quant[w,:] = -9999.0
 
-    return arr[sind[k]]
+    if numpy.isscalar(q):
+        quant = quant[:,0]
+    output['quantiles'] = quant
+    return output
 
 
 def sigma_clip(arrin, weights=None, niter=4, nsig=4, get_err=False, get_indices=False, extra={}, 
@@ -1020,6 +1889,104 @@ def sigma_clip(arrin, weights=None, niter=4, nsig=4, get_err=False, get_indices=
 
     return res 
 
+def sigma_clip_groups(arrin, group_ids=None, rev=None, weights=None,
+                      niter=4, nsig=4, nthreads=1):
+    """
+    Sigma clip the data in many groups at once.
+
+    Each group is clipped with the same algorithm as sigma_clip, in compiled
+    code, optionally using multiple threads.
+
+    parameters
+    ----------
+    arr: array or sequence
+        A numpy array or sequence
+    group_ids: array, optional
+        The group for each element of arr, e.g. a HEALPix pixel number.
+        The results are for the unique group ids, in sorted order.
+    rev: array, optional
+        Reverse indices from histogram, with the results for each bin.
+        Send either group_ids or rev.
+    weights: array, optional
+        Weights for each element.  The statistics are calculated as for
+        wmom with calcerr=True, sdev=True
+    niter: int, optional
+        number of iterations, defaults to 4
+    nsig: float, optional
+        number of sigma, defaults to 4
+    nthreads: int, optional
+        Number of threads to use, default 1
+
+    returns
+    -------
+    A dictionary with the per-group arrays 'mean','stdev','err' and 'nuse'
+    the number of elements used for the final statistics.  If group_ids were
+    sent, 'groups' holds the unique ids.  Empty bins have nuse 0 and
+    statistics -9999.
+    """
+    arr = numpy.array(arrin, ndmin=1, dtype='f8', copy=False)
+    if weights is not None:
+        weights = numpy.array(weights, ndmin=1, dtype='f8', copy=False)
+        if weights.size != arr.size:
+            raise ValueError("array and weights must be same size")
+
+    output={}
+    ind, offsets, groups = _get_group_segments(arr.size, group_ids, rev)
+    if groups is not None:
+        output['groups'] = groups
+
+    data = arr[ind]
+    if weights is not None:
+        weights = weights[ind]
+
+    mean, stdev, err, nuse = _stat_util.sigma_clip_segments(data, weights, offsets,
+                                                            niter, nsig, nthreads)
+    w, = numpy.where(nuse == 0)
+    mean[w] = -9999.0
+    stdev[w] = -9999.0
+    err[w] = -9999.0
+
+    output['mean'] = mean
+    output['stdev'] = stdev
+    output['err'] = err
+    output['nuse'] = nuse
+    return output
+
+def _get_group_segments(n, group_ids, rev):
+    """
+    Get the indices of the data grouped by group id or by bin for reverse
+    indices from histogram, and the offsets of each group in those indices.
+    For group ids, the sorted unique ids are also returned, otherwise None.
+    """
+    if group_ids is not None:
+        if rev is not None:
+            raise ValueError("send group_ids or rev, not both")
+        group_ids = numpy.array(group_ids, ndmin=1, copy=False)
+        if group_ids.size != n:
+            raise ValueError("array and group_ids must be same size")
+
+        ind = group_ids.argsort(kind='mergesort')
+        sids = group_ids[ind]
+        wstart, = numpy.where(sids[1:] != sids[0:sids.size-1])
+        offsets = numpy.zeros(wstart.size+2, dtype='i8')
+        offsets[1:wstart.size+1] = wstart+1
+        offsets[-1] = sids.size
+        if sids.size == 0:
+            offsets = numpy.zeros(1, dtype='i8')
+        groups = sids[offsets[0:offsets.size-1]]
+    elif rev is not None:
+        rev = numpy.array(rev, ndmin=1, copy=False)
+        nbin = 0
+        if rev.size > 0:
+            nbin = rev[0]-1
+        ind = rev[ rev[0]:rev[nbin] ]
+        offsets = numpy.array(rev[0:nbin+1] - rev[0], dtype='i8')
+        groups = None
+    else:
+        raise ValueError("send group_ids or rev")
+
+    return ind, offsets, groups
+
 def _get_sigma_clip_stats(arr, indices, weights=None):
     if weights is not None:
         m,e,s=wmom(arr[indices], weights[indices], calcerr=True, sdev=True)
@@ -1056,27 +2023,95 @@ def interplin(vin, xin, uin):
     REVISION HISTORY:
       Created: 2006-10-24, Erin Sheldon, NYU
     """
-    # Make sure inputs are arrays.  Copy only made if they are not.
-    v=numpy.array(vin, ndmin=1, copy=False)
-    x=numpy.array(xin, ndmin=1, copy=False)
-    u=numpy.array(uin, ndmin=1, copy=False)
+    interp = Interpolator(xin, vin)
+    return interp(uin)
 
-    # Find closest indices
-    xm = x.searchsorted(u) - 1
-    
-    # searchsorted returns size(array) when the input is larger than xmax
-    # Also, we need the index to be less than the last since we interpolate
-    # *between* points.
-    w, = numpy.where(xm >= (x.size-1))
-    if w.size > 0:
-        xm[w] = x.size-2
-
-    w, = numpy.where(xm < 0)
-    if w.size > 0:
-        xm[w] = 0
-        
-    xmp1 = xm+1
-    return (u-x[xm])*(v[xmp1] - v[xm])/(x[xmp1] - x[xm]) + v[xm]
+
+class Interpolator(object):
+    """
+    Linear interpolation that can be reused for many sets of points.
+
+    interp = Interpolator(x, y, dtype='f8')
+    yint = interp(u, out=None)
+
+    Values outside the bounds are extrapolated from the first or last
+    segment, as for interplin.  The slopes are calculated once, and if the
+    x values are on a uniform grid the segment for each point is found
+    directly, otherwise by a binary search.
+
+    parameters
+    ----------
+    x, y: arrays
+        The x and y values of the data.  x must be sorted in increasing
+        order.
+    dtype: optional
+        The type of the output when out= is not sent, 'f8' or 'f4'.
+
+    calling
+    -------
+    u: array or scalar
+        The x values to which to interpolate.
+    out: array, optional
+        A contiguous float32 or float64 array with the same size as u, into
+        which the result is written.  Reuse it to avoid allocating for
+        repeated calls.
+
+    examples
+    --------
+        interp = Interpolator(pcum, x)
+        out = numpy.zeros(1000, dtype='f4')
+        for i in xrange(10):
+            interp(numpy.random.random(1000), out=out)
+    """
+    def __init__(self, x, y, dtype='f8'):
+        self.x = numpy.array(x, ndmin=1, dtype='f8', copy=True)
+        self.y = numpy.array(y, ndmin=1, dtype='f8', copy=True)
+        if self.x.size != self.y.size:
+            raise ValueError("x and y must be same size")
+        if self.x.size < 2:
+            raise ValueError("need at least 2 points to interpolate")
+
+        dx = self.x[1:] - self.x[0:self.x.size-1]
+        if (dx < 0).any():
+            raise ValueError("x must be sorted in increasing order")
+
+        self.dtype = numpy.dtype(dtype)
+        if self.dtype not in (numpy.dtype('f8'), numpy.dtype('f4')):
+            raise ValueError("dtype must be 'f8' or 'f4'")
+
+        # repeated x values are never used as a segment
+        err = numpy.seterr(divide='ignore', invalid='ignore')
+        try:
+            self.slope = (self.y[1:] - self.y[0:self.y.size-1])/dx
+        finally:
+            numpy.seterr(**err)
+
+        self._check_uniform()
+
+    def _check_uniform(self):
+        """
+        See if the x values are uniform to within rounding error
+        """
+        n = self.x.size
+        self.x0 = self.x[0]
+        self.dx = (self.x[-1] - self.x[0])/(n-1)
+
+        self.uniform = False
+        if self.dx > 0:
+            xuni = self.x0 + numpy.arange(n)*self.dx
+            tol = 1.e-12*self.dx + 8*numpy.finfo('f8').eps*numpy.abs(self.x).max()
+            if numpy.abs(self.x - xuni).max() <= tol:
+                self.uniform = True
+
+    def __call__(self, u, out=None):
+        u = numpy.require(u, dtype='f8', requirements=['C','A'])
+        u = numpy.array(u, ndmin=1, copy=False)
+        if out is None:
+            out = numpy.zeros(u.shape, dtype=self.dtype)
+
+        _stat_util.interp_eval(self.x, self.y, self.slope, self.uniform,
+                               self.x0, self.dx, u, out)
+        return out
 
 
 def cor2cov(cor, diagerr):
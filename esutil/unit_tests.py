@@ -0,0 +1,123 @@
+import esutil
+import numpy
+
+def test():
+
+    print '\ncheck match_multi requires a unique first array except for hash: '
+    arr1 = numpy.array([1,1,2])
+    arr2 = numpy.array([1,2,2,1])
+
+    nbad = 0
+    for method in ['histogram','sort','auto']:
+        try:
+            esutil.numpy_util.match_multi(arr1, arr2, method=method)
+            nbad += 1
+        except ValueError:
+            pass
+    try:
+        esutil.numpy_util.match_multi(arr1, arr2)
+        nbad += 1
+    except ValueError:
+        pass
+
+    sub1,sub2 = esutil.numpy_util.match_multi(arr1, arr2, method='hash')
+    if sub1.size != 6 or (arr1[sub1] != arr2[sub2]).any():
+        nbad += 1
+
+    # the default is the histogram method
+    arr1 = numpy.array([5,3,9,1])
+    arr2 = numpy.array([9,9,1,7,5,3,1])
+    sub1,sub2 = esutil.numpy_util.match_multi(arr1, arr2)
+    sub1h,sub2h = esutil.numpy_util.match_multi(arr1, arr2, method='histogram')
+    if ((sub1 != sub1h).any() or (sub2 != sub2h).any()
+            or sub2.size != 6 or (arr1[sub1] != arr2[sub2]).any()):
+        nbad += 1
+
+    if nbad != 0:
+        print 'Errors found'
+    else:
+        print 'OK'
+
+
+    print '\ncompare unique and rem_dup to explicit selection: '
+    numpy.random.seed(25)
+    iarr = numpy.random.randint(0, 20, size=100)
+    sarr = numpy.array(['key%02d' % i for i in iarr])
+    flag = numpy.random.randint(0, 5, size=iarr.size)
+
+    nbad = 0
+    for arr in [iarr, sarr]:
+        uvals = numpy.array(sorted(set(arr.tolist())), dtype=arr.dtype)
+        for keep in ['first','last','max_flag','min_flag']:
+            expected = []
+            for val in uvals:
+                w, = numpy.where(arr == val)
+                if keep == 'first':
+                    expected.append(w[0])
+                elif keep == 'last':
+                    expected.append(w[-1])
+                elif keep == 'max_flag':
+                    expected.append(w[flag[w].argmax()])
+                else:
+                    expected.append(w[flag[w].argmin()])
+            expected = numpy.array(expected)
+
+            for return_counts in [False,True]:
+                for return_inverse in [False,True]:
+                    kw = {'return_counts':return_counts,
+                          'return_inverse':return_inverse}
+                    if keep in ['first','last']:
+                        res = esutil.numpy_util.unique(arr, keep=keep, **kw)
+                        res = _as_list(res)
+                        if (res[0] != expected).any():
+                            nbad += 1
+                        nbad += _check_counts_inverse(arr, res, **kw)
+
+                    res = esutil.numpy_util.rem_dup(arr, flag, values=True,
+                                                    keep=keep, **kw)
+                    res = _as_list(res)
+                    vals = res.pop(1)
+                    if ((res[0] != numpy.sort(expected)).any()
+                            or (arr[res[0]] != vals).any()):
+                        nbad += 1
+                    nbad += _check_counts_inverse(arr, res, **kw)
+
+                    if keep in ['first','last']:
+                        vals = esutil.numpy_util.unique(arr, values=True,
+                                                        keep=keep)
+                        if (vals != uvals).any():
+                            nbad += 1
+
+    if nbad != 0:
+        print '%s Errors found' % nbad
+    else:
+        print 'OK'
+
+def _as_list(res):
+    if isinstance(res, tuple):
+        return list(res)
+    return [res]
+
+def _check_counts_inverse(arr, res, return_counts=False, return_inverse=False):
+    """
+    res holds the indices followed by the counts and inverse, if requested
+    """
+    nbad = 0
+    if len(res) != 1 + return_counts + return_inverse:
+        return 1
+
+    ind = res[0]
+    if return_counts:
+        counts = res[1]
+        for i in range(ind.size):
+            if counts[i] != (arr == arr[ind[i]]).sum():
+                nbad += 1
+    if return_inverse:
+        inverse = res[-1]
+        if (arr[ind][inverse] != arr).any():
+            nbad += 1
+    return nbad
+
+
+if __name__=='__main__':
+    test()
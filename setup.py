@@ -75,6 +75,20 @@ if have_numpy:
     ext_modules.append(cosmo_module)
     packages.append('esutil.cosmology')
 
+    # compiled numpy_util routines
+    numpy_util_module = Extension('esutil._numpy_util',
+                                  extra_compile_args=extra_compile_args,
+                                  extra_link_args=extra_link_args,
+                                  sources=['esutil/_numpy_util.c'])
+    ext_modules.append(numpy_util_module)
+
+    # compiled coordinate routines
+    coords_module = Extension('esutil._coords',
+                              extra_compile_args=extra_compile_args,
+                              extra_link_args=extra_link_args,
+                              sources=['esutil/_coords.c'])
+    ext_modules.append(coords_module)
+
 
 
     # HTM